@@ -0,0 +1,128 @@
+"""
+buzz: collocation statistics
+
+Windows around each node are built with numpy offsets, and co-occurrences
+are counted with np.bincount over the codes of the collocate column, so the
+cost grows with the number of nodes times the span, not with Python loops.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .utils import _codes_and_labels, _sentence_ids
+
+
+def _node_rows(df, query):
+    """
+    Get the row positions in df of the nodes described by query
+
+    query can be a depgrep string, a Dataset of results, a ResultSet, a lazy
+    Query, or a boolean index over df
+    """
+    from .query import Query
+    from .results import ResultSet
+
+    if isinstance(query, Query):
+        query = query.collect()
+    if isinstance(query, str):
+        query = df.depgrep(query)
+    if isinstance(query, ResultSet):
+        wanted = query.ids
+    elif isinstance(query, pd.DataFrame):
+        wanted = np.unique(query["_n"].values)
+    else:
+        return np.flatnonzero(np.asarray(query, dtype=bool))
+    ns = df["_n"].values
+    sorter = np.argsort(ns, kind="mergesort")
+    rows = np.searchsorted(ns, wanted, sorter=sorter)
+    rows[rows >= len(ns)] = 0
+    rows = sorter[rows]
+    return np.sort(rows[ns[rows] == wanted])
+
+
+def _window_rows(df, nodes, span, sentence_bound=True):
+    """
+    Rows inside the window around every node, plus the offset of each one
+    """
+    offsets = np.arange(span[0], span[1] + 1)
+    offsets = offsets[offsets != 0]
+    window = nodes[:, None] + offsets
+    valid = (window >= 0) & (window < len(df))
+    sents = _sentence_ids(df) if sentence_bound else None
+    if sents is not None:
+        clipped = np.clip(window, 0, len(df) - 1)
+        valid &= sents[clipped] == sents[nodes][:, None]
+    return window[valid], np.broadcast_to(offsets, window.shape)[valid]
+
+
+def _association(measure, observed, expected, node_freq, coll_freq, slots, total):
+    """
+    Vectorised association measures for every collocate at once
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if measure == "mi":
+            return np.log2(observed / expected)
+        if measure == "t":
+            return (observed - expected) / np.sqrt(observed)
+        if measure == "logdice":
+            return 14 + np.log2(2 * observed / (node_freq + coll_freq))
+        if measure == "ll":
+            # 2x2 contingency table: in window or not, collocate or not
+            o11 = observed
+            o12 = slots - observed
+            o21 = coll_freq - observed
+            o22 = total - slots - coll_freq + observed
+            r1, r2 = slots, total - slots
+            c1, c2 = coll_freq, total - coll_freq
+            score = np.zeros(len(observed), dtype=float)
+            for o, r, c in [(o11, r1, c1), (o12, r1, c2), (o21, r2, c1), (o22, r2, c2)]:
+                e = r * c / total
+                score += np.where(o > 0, o * np.log(o / e), 0.0)
+            score *= 2
+            return np.where(observed < expected, -score, score)
+    raise ValueError(f"Unknown measure: {measure}. Use mi, t, ll or logdice")
+
+
+def _collocates(
+    df,
+    query,
+    span=(-4, 4),
+    measure="mi",
+    by="l",
+    min_count=1,
+    sentence_bound=True,
+    preserve_case=False,
+):
+    """
+    Rank the collocates of the nodes matching query by an association measure
+
+    span: (left, right) offsets of the window around each node
+    measure: mi, t, ll or logdice
+    by: column(s) to count collocates by
+    min_count: drop collocates seen in fewer windows than this
+    sentence_bound: windows stop at sentence boundaries
+    """
+    from .table import Table
+
+    if isinstance(span, int):
+        span = (-span, span)
+    codes, labels = _codes_and_labels(df, by, preserve_case=preserve_case)
+    nodes = _node_rows(df, query)
+    rows, _ = _window_rows(df, nodes, span, sentence_bound=sentence_bound)
+
+    total = len(df)
+    slots = len(rows)
+    coll_freq = np.bincount(codes, minlength=len(labels)).astype(float)
+    observed = np.bincount(codes[rows], minlength=len(labels)).astype(float)
+    expected = coll_freq * slots / total if total else coll_freq
+
+    keep = observed >= max(min_count, 1)
+    observed, expected, coll_freq = observed[keep], expected[keep], coll_freq[keep]
+    score = _association(measure, observed, expected, len(nodes), coll_freq, slots, total)
+
+    by_name = by if isinstance(by, str) else "/".join(by)
+    index = pd.Index(labels[keep], name=by_name)
+    data = dict(count=observed.astype(int), frequency=coll_freq.astype(int), expected=expected)
+    data[measure] = score
+    table = Table(pd.DataFrame(data, index=index), reference=df)
+    return table.sort_values(measure, ascending=False)
@@ -1,7 +1,10 @@
+import copy
+
+import numpy as np
 import pandas as pd
 
 from .constants import CONLL_COLUMNS
-from .utils import _auto_window, _make_match_col
+from .utils import _auto_window, _make_match_col, _ranges, _sentence_ids
 from .views import _tabview
 
 
@@ -28,109 +31,292 @@ class Concordance(pd.DataFrame):
         return _tabview(self, self.reference, *args, **kwargs)
 
 
-def _get_right(n, allwords, window, multiword=0):
+# matches to cut out at once, to bound the size of the character matrix
+CHUNK_SIZE = 100_000
+
+
+def _words_key(words):
     """
-    For df.apply(), generate right
+    Cheap identity of the words: the array holding them, where it lives and
+    its length. The array is kept in the key, so its memory is not reused.
+    """
+    values, categories = words.values, None
+    if words.dtype.name == "category":
+        values, categories = values.codes, values.categories
+    pointer = values.__array_interface__["data"][0]
+    return (values, categories), pointer, len(values), id(categories)
+
 
-    This needs to be performant.
+def _char_offsets(reference):
+    """
+    The words of reference joined by spaces, as codepoints, plus where each word
+    starts and ends in that buffer. Cached on the reference Dataset, and rebuilt
+    if its w column is set again. Edits made in place (e.g. with .iloc) are not
+    seen, so assign a new w column after changing words.
+
+    The buffer is UTF-32, so it costs 4 bytes for every character of the corpus.
+    """
+    key = _words_key(reference["w"])
+    cached = getattr(reference, "_char_offsets", None)
+    if cached is not None and cached[1][1:] == key[1:]:
+        return cached[0]
+    words = reference["w"].astype(str).values
+    lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+    starts = np.cumsum(lengths + 1) - (lengths + 1)
+    buffer = np.frombuffer(" ".join(words).encode("utf-32-le"), dtype=np.uint32)
+    offsets = (buffer, starts, starts + lengths)
+    if "_char_offsets" in getattr(reference, "_internal_names_set", set()):
+        reference._char_offsets = (offsets, key)
+    return offsets
+
+
+def _cut(buffer, begin, length):
+    """
+    Cut one string per row out of buffer, starting at begin, length chars long
     """
-    # get smallest out of: this index+window_right, or last index
-    end = min(multiword + n + window[1], multiword + len(allwords) - 1)
-    return " ".join(allwords[n + 1 + multiword : end])[: window[1] + multiword]
+    width = int(length.max()) if len(length) else 0
+    if not width:
+        return np.full(len(begin), "", dtype=object)
+    out = list()
+    for i in range(0, len(begin), CHUNK_SIZE):
+        chunk_begin, chunk_length = begin[i : i + CHUNK_SIZE], length[i : i + CHUNK_SIZE]
+        cols = np.arange(width)
+        valid = cols < chunk_length[:, None]
+        chars = np.zeros((len(chunk_begin), width), dtype=np.uint32)
+        chars[valid] = buffer[(chunk_begin[:, None] + cols)[valid]]
+        # padding is NUL, which numpy drops from the end of unicode strings
+        out.append(chars.view(f"<U{width}").ravel())
+    return np.concatenate(out).astype(object)
 
 
-def _get_left(n, allwords, window, multiword=0):
+def _contexts(match_indices, reference, window, extra=None, sentence_bound=False):
     """
-    For df.apply(), generate left
+    Left and right context for every match at once
 
-    This needs to be performant.
+    Like joining up to window[0] words before the match and keeping the last
+    window[0] characters, and joining the words after the match (and after any
+    extra words of multiword matches) and keeping the first window[1] characters.
     """
-    return " ".join(allwords[max(n - window[0], 0) : n])[-window[0] :]
+    buffer, starts, ends = _char_offsets(reference)
+    size = len(starts)
+    n = np.asarray(match_indices, dtype=np.int64)
+    extra = np.zeros(len(n), dtype=np.int64) if extra is None else np.asarray(extra, dtype=np.int64)
 
+    first = np.maximum(n - window[0], 0)
+    after = n + 1 + extra
+    stop = np.minimum(np.minimum(extra + n + window[1], extra + size - 1), size)
+    if sentence_bound:
+        sents = _sentence_ids(reference)
+        if sents is not None:
+            sent_first = np.flatnonzero(np.r_[True, sents[1:] != sents[:-1]])
+            sent_last = np.r_[sent_first[1:], size] - 1
+            first = np.maximum(first, sent_first[sents[n]])
+            stop = np.minimum(stop, sent_last[sents[np.minimum(n + extra, size - 1)]] + 1)
 
-def multiword_matches(matches, multiword, preserve_case):
+    # left: words first..n-1, last window[0] characters
+    has_left = first < n
+    left_end = np.where(has_left, ends[np.maximum(n - 1, 0)], 0)
+    left_begin = np.where(has_left, starts[np.minimum(first, size - 1)], 0)
+    left_begin = np.maximum(left_begin, left_end - window[0])
+    left = _cut(buffer, left_begin, np.where(has_left, left_end - left_begin, 0))
+
+    # right: words after..stop-1, first window[1] (+ extra) characters
+    has_right = after < stop
+    right_begin = np.where(has_right, starts[np.minimum(after, size - 1)], 0)
+    right_end = np.where(has_right, ends[np.maximum(stop - 1, 0)], 0)
+    right_end = np.minimum(right_end, right_begin + window[1] + extra)
+    right = _cut(buffer, right_begin, np.where(has_right, right_end - right_begin, 0))
+
+    index = getattr(match_indices, "index", None)
+    return pd.Series(left, index=index), pd.Series(right, index=index)
+
+
+def multiword_matches(matches, positions, preserve_case):
     """
-    Shift matches to make match column for multiword
+    Join the tokens of each multiword match to make the match column
 
-    matches is the match column, formatted
+    matches is the match column, formatted; positions is _position, which
+    starts again at 0 for each match, so spans can have different lengths
     """
-    # get just the first word (may not handle -1 etc)
-    # match_indices = data_in[data_in.["_position"] == 0]["_n"]
-    # this will become a new df
-    out = {0: matches.values}
-    for i in range(1, multiword+1):
-        # shift df so index aligns with the next token in the gram
-        shifted = matches.shift(-i)
-        out[i] = shifted.values
-    # this should give us normal index with 3 cols, word 0, 1, 2
-    df = pd.DataFrame(out, index=matches.index)
-    made = df.iloc[:,0].str.cat(others=df.iloc[:,1:], sep=" ").str.rstrip("/")
+    starts = positions.values == 0
+    span = np.cumsum(starts)
+    made = matches.groupby(span, sort=False).agg(" ".join)
+    made = pd.Series(made.values, index=matches.index[starts]).str.rstrip("/")
     if not preserve_case:
         made = made.str.lower()
     return made
 
 
-def _concordance(
-    data_in,
-    reference,
-    show=["w"],
-    n=-1,
-    window="auto",
-    metadata=True,
-    preserve_case=True,
-    preserve_index=False,
-):
-    """
-    Generate a concordance
-    """
-    # cut dataset down
-    if n and n > 0:
-        data_in = data_in.iloc[:n]
-
-    if window == "auto":
-        window = _auto_window()
-    if isinstance(window, int):
-        window = [window, window]
-
-    if not preserve_index:
-        data_in = data_in.reset_index()
-
-    # multiword mode, for ngrams and so on
-    multiword = "_position" in data_in.columns
-    if multiword:
-        # error happens on refreshing web interface, not sure why
-        try:
-            data_in["_position"] = data_in["_position"].astype(int)
-        except ValueError:
-            pass
-        multiword = data_in["_position"].max()
-    # get series of matches, fsi index
-    matches = _make_match_col(data_in, show, preserve_case=preserve_case)
-    match_indices = data_in["_n"]
-    # for multiword results, we now need to join the matches with space
-    # and potentially change the i-index to a span
-    if multiword:
-        matches = multiword_matches(matches, multiword, preserve_case)
-        matches = matches[data_in["_position"] == 0]
-        match_indices = match_indices[data_in["_position"] == 0]
-
-    words = reference["w"].values
-    apply_data = dict(allwords=words, window=window, multiword=multiword)
-    left = match_indices.apply(_get_left, **apply_data)
-    right = match_indices.apply(_get_right, **apply_data)
-
-    left.name, matches.name, right.name = "left", "match", "right"
-
-    ignores = ["_match", "_n", "sent_len", "parse", "text", "_position"]
-
-    conc = pd.concat([left, matches, right], axis=1)
-
-    if metadata is True:  # add all meta cols
-        skips = CONLL_COLUMNS + ignores
-        metadata = [i for i in list(data_in.columns) if i not in skips]
-
-    if metadata:
-        conc = conc.join(data_in[metadata])
-
-
-    return Concordance(conc, reference=data_in)
+class LazyConcordance(object):
+    """
+    Concordance that only stores where its lines are, and makes the left,
+    match and right strings for a page or slice when it is asked for them
+    """
+
+    def __init__(
+        self,
+        data_in,
+        reference,
+        show=["w"],
+        n=-1,
+        window="auto",
+        metadata=True,
+        preserve_case=True,
+        preserve_index=False,
+        sentence_bound=False,
+    ):
+        # cut dataset down
+        if n and n > 0:
+            data_in = data_in.iloc[:n]
+
+        if window == "auto":
+            window = _auto_window()
+        if isinstance(window, int):
+            window = [window, window]
+
+        if not preserve_index:
+            data_in = data_in.reset_index()
+
+        # multiword mode, for ngrams and so on
+        self.multiword = "_position" in data_in.columns
+        if self.multiword:
+            # error happens on refreshing web interface, not sure why
+            try:
+                data_in["_position"] = data_in["_position"].astype(int)
+            except ValueError:
+                pass
+            starts = np.flatnonzero((data_in["_position"] == 0).values)
+            # extra tokens in each span, which can differ from match to match
+            extra = np.diff(np.append(starts, len(data_in))) - 1
+        else:
+            starts = np.arange(len(data_in))
+            extra = np.zeros(len(data_in), dtype=np.int64)
+
+        if metadata is True:  # add all meta cols
+            ignores = ["_match", "_n", "sent_len", "parse", "text", "_position"]
+            skips = CONLL_COLUMNS + ignores
+            metadata = [i for i in list(data_in.columns) if i not in skips]
+
+        self.data = data_in
+        self.reference = reference
+        self.show = show
+        self.window = window
+        self.metadata = metadata
+        self.preserve_case = preserve_case
+        self.sentence_bound = sentence_bound
+        self._lines = starts
+        self._extra = extra
+        self._word_codes = None
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __repr__(self):
+        return f"{self.head(10)!r}\n\n[{len(self)} concordance lines]"
+
+    def __getitem__(self, key):
+        """
+        conc[5], conc[100:150] or conc[[1, 5, 9]] make just those lines
+        """
+        which = np.arange(len(self))[key]
+        return self._render(np.atleast_1d(which))
+
+    def _render(self, which):
+        """
+        Make the Concordance for the line numbers in which
+        """
+        starts, extra = self._lines[which], self._extra[which]
+        rows = np.repeat(starts, extra + 1) + _ranges(extra + 1)
+        data_in = self.data.iloc[rows]
+
+        matches = _make_match_col(data_in, self.show, preserve_case=self.preserve_case)
+        match_indices = data_in["_n"]
+        if self.multiword:
+            # for multiword results, we now need to join the matches with space
+            matches = multiword_matches(matches, data_in["_position"], self.preserve_case)
+            match_indices = match_indices[(data_in["_position"] == 0).values]
+
+        window, bound = self.window, self.sentence_bound
+        left, right = _contexts(match_indices, self.reference, window, extra, bound)
+        left.name, matches.name, right.name = "left", "match", "right"
+
+        conc = pd.concat([left, matches, right], axis=1)
+        if self.metadata:
+            conc = conc.join(data_in[self.metadata])
+        return Concordance(conc, reference=self.data)
+
+    def collect(self):
+        """
+        Make every line, giving a regular Concordance
+        """
+        return self._render(np.arange(len(self)))
+
+    def head(self, n=5):
+        return self[:n]
+
+    def page(self, number, size=50):
+        """
+        Lines for one page, counting from 0
+        """
+        return self[number * size : (number + 1) * size]
+
+    def view(self, *args, page=0, size=50, **kwargs):
+        """
+        View one page interactively with tabview
+        """
+        return self.page(page, size=size).view(*args, **kwargs)
+
+    def _codes(self):
+        """
+        Rank of every word in the reference, in alphabetical order, made once
+        """
+        if self._word_codes is None:
+            words = self.reference["w"].astype(str)
+            if not self.preserve_case:
+                words = words.str.lower()
+            self._word_codes = pd.factorize(words, sort=True)[0]
+        return self._word_codes
+
+    def _key(self, name):
+        """
+        Sort key for every line: L1 is the word before the match, R2 the
+        second word after it, M the first word of the match
+        """
+        codes = self._codes()
+        n = self.data["_n"].values[self._lines]
+        name = name.upper()
+        if name in {"M", "MATCH"}:
+            where = n
+        elif name[0] == "L" and name[1:].isdigit():
+            where = n - int(name[1:])
+        elif name[0] == "R" and name[1:].isdigit():
+            where = n + self._extra + int(name[1:])
+        else:
+            raise ValueError(f"Cannot sort concordance by {name}: use L1, R1, M and so on")
+        inside = (where >= 0) & (where < len(codes))
+        # positions off either end of the corpus sort first
+        return np.where(inside, codes[np.clip(where, 0, len(codes) - 1)], -1)
+
+    def sort(self, by="R1", ascending=True):
+        """
+        Reorder lines by the words around the match, e.g. sort(["R1", "R2"])
+        """
+        if isinstance(by, str):
+            by = [by]
+        keys = [self._key(name) for name in by]
+        order = np.lexsort(keys[::-1])
+        if not ascending:
+            order = order[::-1]
+        out = copy.copy(self)
+        out._lines, out._extra = self._lines[order], self._extra[order]
+        return out
+
+
+def _concordance(data_in, reference, *args, lazy=False, **kwargs):
+    """
+    Generate a concordance, or a LazyConcordance if lazy=True
+
+    sentence_bound: keep left and right context inside the match's sentence
+    """
+    lines = LazyConcordance(data_in, reference, *args, **kwargs)
+    return lines if lazy else lines.collect()
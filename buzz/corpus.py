@@ -6,13 +6,24 @@ import shutil
 from collections import MutableSequence
 from functools import total_ordering
 
+import numpy as np
+import pandas as pd
+
+from joblib import Parallel
+
 from . import utils
 from .constants import FORMATS, VALID_EXTENSIONS
 from .contents import Contents
+from .cql import _cql
 from .extract import _extract
+from .freqlist import FrequencyList
+from .ngrams import NgramIndex
 from .parse import Parser
+from .query import Query
 from .search import Searcher
+from .similarity import _mean_vector, _spacy_encoder, _vector_sum
 from .slice import Filter, Interim
+from .store import ModelStore
 
 tqdm = utils._get_tqdm()
 
@@ -65,6 +76,7 @@ class Collection(object):
         constituencies=False,
         speakers=True,
         just_missing=False,
+        disable=(),
     ):
         language = language.split("_", 1)[0]  # de_frak to de
         parsed_path = os.path.join(self.path, "conllu")
@@ -78,6 +90,7 @@ class Collection(object):
             constituencies=constituencies,
             speakers=speakers,
             just_missing=just_missing,
+            disable=disable,
         )
         parsed = self.parser.run(self)
         self.conllu = parsed
@@ -176,28 +189,113 @@ class Corpus(MutableSequence):
         """
         return Searcher().run(self, "t", query, **kwargs)
 
-    def table(self, show=["w"], subcorpora=["file"], **kwargs):
+    def table(self, show=["w"], subcorpora=["file"], streaming=False, **kwargs):
         """
         Generate a frequency table from the whole corpus
+
+        streaming: count each file separately (in multiprocess workers if
+        requested) and add the counts up, rather than loading everything
         """
         if isinstance(show, str):
             show = [show]
         if isinstance(subcorpora, str):
             subcorpora = [subcorpora]
-        needed = show + subcorpora
+        needed = show + (subcorpora or [])
         usecols = kwargs.pop("usecols", needed)
+        if streaming:
+            return self._streamed_table(show, subcorpora, usecols, **kwargs)
         loaded = self.load(usecols=usecols)
         return loaded.table(show=show, subcorpora=subcorpora, **kwargs)
 
+    def _streamed_table(
+        self,
+        show,
+        subcorpora,
+        usecols,
+        multiprocess=False,
+        preserve_case=False,
+        min_occur=0,
+        reference=None,
+        keyness=False,
+        **kwargs,
+    ):
+        """
+        Map: count each file in workers. Reduce: add the counts together.
+
+        Only count tables are held in memory. min_occur, relative, keyness and
+        sort are done on the summed table.
+        """
+        from . import multi
+        from .views import _finish_table, _merge_counts
+
+        # options such as show_entities need the tokens, which are not kept
+        finish = ["relative", "sort", "keep_stats", "remove_above_p", "multiindex_columns"]
+        finish.append("sparse")
+        unsupported = sorted(set(kwargs) - set(finish))
+        if unsupported:
+            supported = ["multiprocess", "preserve_case", "min_occur", "reference", "keyness"]
+            supported = ", ".join(supported + finish)
+            err = f"Cannot stream with {', '.join(unsupported)}. Streaming supports: {supported}"
+            raise ValueError(err)
+
+        multiprocess = multi.how_many(multiprocess)
+        files = list(self.files)
+        chunks = [list(i) for i in np.array_split(files, multiprocess) if len(i)]
+        args = (show, subcorpora, preserve_case, usecols)
+        delay = (multi.table(chunk, i, *args) for i, chunk in enumerate(chunks))
+        partials = Parallel(n_jobs=multiprocess)(delay)
+        counts = _merge_counts(partials, subcorpora)
+
+        if min_occur:
+            counts = counts.loc[:, counts.sum() >= min_occur]
+        if keyness is not False:
+            # counts over the whole corpus are the default reference
+            if reference is None:
+                reference = counts.sum()
+            elif isinstance(reference, FrequencyList):
+                reference.check(show, preserve_case)
+            elif isinstance(reference, Corpus):
+                kwa = dict(show=show, subcorpora=False, streaming=True, sort=False)
+                reference = reference.table(multiprocess=multiprocess, **kwa).iloc[0]
+        return _finish_table(counts, show, reference=reference, keyness=keyness, **kwargs)
+
     def depgrep(self, query, **kwargs):
         """
         Search dependencies using depgrep
         """
         return Searcher().run(self, "d", query, **kwargs)
 
-    def parse(self, language="en", multiprocess=False, constituencies=False, speakers=True):
+    def cql(self, query):
+        """
+        Search token sequences with a CQL query, one file at a time
+        """
+        from .dataset import Dataset
+
+        results = list()
+        n = 0
+        for file in self.files:
+            loaded = file.load()
+            loaded["_n"] = range(n, n + len(loaded))
+            n += len(loaded)
+            res = _cql(loaded, query)
+            if not res.empty:
+                results.append(res)
+        if not results:
+            return Dataset(pd.DataFrame(), name=self.name)
+        return Dataset(pd.concat(results, sort=False), name=self.name)
+
+    def parse(
+        self,
+        language="en",
+        multiprocess=False,
+        constituencies=False,
+        speakers=True,
+        disable=(),
+    ):
         """
         Parse a plaintext corpus
+
+        disable names spaCy components to skip, e.g. ["ner"]
         """
         from buzz.file import File
         language = language.split("_", 1)[0]  # de_frak to de
@@ -216,6 +314,7 @@ class Corpus(MutableSequence):
             multiprocess=multiprocess,
             constituencies=constituencies,
             speakers=speakers,
+            disable=disable,
         )
         return self.parser.run(self, files=files)
 
@@ -237,17 +336,65 @@ class Corpus(MutableSequence):
         switched off. This is for performance in both cases --- your unparsed
         corpus needs to be pretty huge to be loaded quicker via multiprocess.
         """
+        from .dataset import Dataset
+
         if self.format == "feather":
-            return self.files[0].load()
-        return utils._load_corpus(self, **kwargs)
+            loaded = self.files[0].load()
+        else:
+            loaded = utils._load_corpus(self, **kwargs)
+        # fitted models for this data are kept with the corpus
+        if isinstance(loaded, Dataset):
+            loaded._store = self.model_store
+        return loaded
+
+    @property
+    def model_store(self):
+        """
+        Store of tf-idf models fitted on this corpus, in its .buzz folder
+        """
+        return ModelStore(os.path.join(self.path, ".buzz", "models"))
 
     @property
     def vector(self):
         """
         Grab the spacy vector for this document
         """
-        spac = self.to_spacy(concat=True)
-        return spac.vector
+        return self.document_vector()
+
+    def document_vector(self, language="en", batch_size=1000):
+        """
+        Mean spaCy token vector of the corpus, without loading it
+
+        Sentences are streamed through spaCy in batches, file by file. Each
+        file's token vector sum is cached in the .buzz folder, as is the result
+        for this exact set of files, so only new or changed files are parsed.
+        """
+        stamp = utils._files_fingerprint(self.filepaths)
+        cache = utils._cache_path(self.path, f"vector-{language}-{stamp}.npy")
+        if os.path.isfile(cache):
+            return np.load(cache)
+        encoder = _spacy_encoder(language)
+        total, count = 0.0, 0
+        for file in self.files:
+            name = re.sub(r"[^\w.-]", "_", os.path.relpath(file.path, self.path))
+            file_cache = utils._cache_path(self.path, f"vector-{language}-{name}.npz")
+            if utils._cache_is_fresh(file_cache, [file.path]):
+                with np.load(file_cache) as data:
+                    file_total, file_count = data["total"], int(data["count"])
+            else:
+                data = file.read()
+                if self.is_parsed:
+                    texts = utils._get_texts(data).splitlines()
+                else:
+                    texts = [line for line in data.splitlines() if line.strip()]
+                nlp, disable = encoder.nlp()
+                file_total, file_count = _vector_sum(texts, nlp, disable, batch_size)
+                np.savez(file_cache, total=file_total, count=file_count)
+            total, count = total + file_total, count + file_count
+        vector = _mean_vector(total, count)
+        np.save(cache, vector)
+        utils._remove_stale_caches(cache)
+        return vector
 
     def to_spacy(self, language="en", concat=False):
         """
@@ -283,6 +430,8 @@ class Corpus(MutableSequence):
         files = list()
         fullpaths = list()
         for root, dirnames, filenames in os.walk(self.path):
+            # do not look inside hidden folders, like the .buzz cache
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
             for directory in sorted(dirnames):
                 if directory.startswith("."):
                     continue
@@ -305,6 +454,57 @@ class Corpus(MutableSequence):
         files = Contents(files, **info)
         return subcorpora, files
 
+    def ngram_index(self, show="w", preserve_case=False):
+        """
+        Suffix array over the whole corpus, cached in the corpus' .buzz folder
+        """
+        case = "cased" if preserve_case else "uncased"
+        # keyed on the file set, so added, removed or replaced files are noticed
+        stamp = utils._files_fingerprint(self.filepaths)
+        cache = utils._cache_path(self.path, f"ngrams-{show}-{case}-{stamp}.npz")
+        if os.path.isfile(cache):
+            return NgramIndex.load(cache)
+        loaded = self.load(usecols=[show])
+        index = NgramIndex.from_dataset(loaded, show=show, preserve_case=preserve_case)
+        index.save(cache)
+        utils._remove_stale_caches(cache)
+        return index
+
+    def frequency_list(self, show=["w"], preserve_case=False, multiprocess=False):
+        """
+        Counts of show over the whole corpus, for use as a keyness reference
+
+        Counted file by file, then cached in the corpus' .buzz folder
+        """
+        if isinstance(show, str):
+            show = show.split("/")
+        case = "cased" if preserve_case else "uncased"
+        stamp = utils._files_fingerprint(self.filepaths)
+        cache = utils._cache_path(self.path, f"freqs-{'-'.join(show)}-{case}-{stamp}.npz")
+        if os.path.isfile(cache):
+            return FrequencyList.load(cache)
+        kwa = dict(show=show, preserve_case=preserve_case, multiprocess=multiprocess)
+        freqs = FrequencyList.from_corpus(self, **kwa)
+        freqs.save(cache)
+        utils._remove_stale_caches(cache)
+        return freqs
+
+    def ngrams(self, n, show="l", min_count=1, preserve_case=False):
+        """
+        Count every n-gram inside a sentence, using the cached index
+        """
+        index = self.ngram_index(show=show, preserve_case=preserve_case)
+        return index.ngrams(n, min_count=min_count)
+
+    @property
+    def lazy(self):
+        """
+        Start a lazy query plan, run in one pass per file when it is needed
+
+        corpus.lazy.just.speaker.MOOKIE.skip.xpos.PUNCT.see.lemma.by.wordclass
+        """
+        return Query(self)
+
     @property
     def just(self):
         """
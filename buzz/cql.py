@@ -0,0 +1,437 @@
+"""
+buzz: CQL-style token sequence queries
+
+    [x="ADJ"]{1,3} [l="house"]
+    <s> [w="but"%c] []* [x="VERB"] </s>
+    "the" ([x="ADJ"] | [x="NOUN"])+ [speaker!="MOOKIE" & f="obj"]
+
+Each [...] becomes one boolean array over the rows, worked out once per
+category. The sequence part compiles to a Thompson NFA, which is run over
+every possible start position at once: one numpy step per token of match
+length, dropping start positions as soon as no state is alive. Matches never
+cross sentences, and are leftmost-longest and non-overlapping.
+"""
+
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from .utils import (
+    _category_labels,
+    _get_categorical,
+    _get_short_name_from_long_name,
+    _ranges,
+    _sentence_ids,
+)
+
+# number of start positions to simulate at once, to bound memory
+CHUNK_SIZE = 1_000_000
+
+TOKEN_RE = re.compile(
+    r"""
+    (?P<space>\s+)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<flag>%[a-z]+)
+  | (?P<anchor></?s>)
+  | (?P<op>!=|=)
+  | (?P<number>\d+)
+  | (?P<name>[A-Za-z_][\w]*)
+  | (?P<punct>[\[\](){},?*+|&!])
+    """,
+    re.VERBOSE,
+)
+
+
+def _tokenise(query):
+    """
+    Split a CQL query into (kind, text) pairs
+    """
+    tokens = list()
+    pos = 0
+    while pos < len(query):
+        match = TOKEN_RE.match(query, pos)
+        if not match:
+            raise ValueError(f"Cannot parse CQL query at position {pos}: {query[pos:]}")
+        pos = match.end()
+        kind = match.lastgroup
+        if kind != "space":
+            tokens.append((kind, match.group()))
+    return tokens
+
+
+class _Parser(object):
+    """
+    Recursive descent parser, from CQL string to a small tuple AST
+    """
+
+    def __init__(self, query):
+        self.tokens = _tokenise(query)
+        self.i = 0
+        self.predicates = list()
+
+    def peek(self):
+        return self.tokens[self.i][1] if self.i < len(self.tokens) else None
+
+    def take(self, expected=None):
+        if self.i >= len(self.tokens):
+            raise ValueError(f"Unexpected end of CQL query, expected {expected}")
+        kind, text = self.tokens[self.i]
+        if expected is not None and text != expected:
+            raise ValueError(f"Expected {expected} in CQL query, got {text}")
+        self.i += 1
+        return kind, text
+
+    def parse(self):
+        node = self.alternation()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected {self.peek()} in CQL query")
+        return node
+
+    def alternation(self):
+        branches = [self.sequence()]
+        while self.peek() == "|":
+            self.take("|")
+            branches.append(self.sequence())
+        return branches[0] if len(branches) == 1 else ("alt", branches)
+
+    def sequence(self):
+        items = list()
+        while self.peek() not in {None, "|", ")"}:
+            items.append(self.item())
+        return ("seq", items)
+
+    def item(self):
+        node = self.atom()
+        while self.peek() in {"?", "*", "+", "{"}:
+            text = self.take()[1]
+            if text == "?":
+                node = ("rep", node, 0, 1)
+            elif text == "*":
+                node = ("rep", node, 0, None)
+            elif text == "+":
+                node = ("rep", node, 1, None)
+            else:
+                low = int(self.take()[1])
+                high = low
+                if self.peek() == ",":
+                    self.take(",")
+                    high = None if self.peek() == "}" else int(self.take()[1])
+                self.take("}")
+                if high is not None and high < low:
+                    raise ValueError(f"Bad repetition {{{low},{high}}} in CQL query")
+                node = ("rep", node, low, high)
+        return node
+
+    def atom(self):
+        kind, text = self.take()
+        if kind == "anchor":
+            return ("bos",) if text == "<s>" else ("eos",)
+        if kind == "string":
+            # a bare "string" means [w="string"]
+            return self._token(("cmp", "w", "=", _unquote(text), self._flags()))
+        if text == "(":
+            node = self.alternation()
+            self.take(")")
+            return node
+        if text == "[":
+            if self.peek() == "]":
+                self.take("]")
+                return self._token(("any",))
+            expr = self.expression()
+            self.take("]")
+            return self._token(expr)
+        raise ValueError(f"Unexpected {text} in CQL query")
+
+    def _token(self, expr):
+        self.predicates.append(expr)
+        return ("tok", len(self.predicates) - 1)
+
+    def _flags(self):
+        if self.peek() is not None and self.peek().startswith("%"):
+            return self.take()[1].lstrip("%")
+        return ""
+
+    def expression(self):
+        node = self.conjunction()
+        while self.peek() == "|":
+            self.take("|")
+            node = ("or", node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.peek() == "&":
+            self.take("&")
+            node = ("and", node, self.negation())
+        return node
+
+    def negation(self):
+        if self.peek() == "!":
+            self.take("!")
+            return ("not", self.negation())
+        if self.peek() == "(":
+            self.take("(")
+            node = self.expression()
+            self.take(")")
+            return node
+        kind, attr = self.take()
+        if kind != "name":
+            raise ValueError(f"Expected an attribute name in CQL query, got {attr}")
+        op = self.take()[1]
+        if op not in {"=", "!="}:
+            raise ValueError(f"Expected = or != after {attr} in CQL query, got {op}")
+        kind, value = self.take()
+        if kind != "string":
+            raise ValueError(f"Expected a quoted value after {attr}{op} in CQL query")
+        return ("cmp", attr, op, _unquote(value), self._flags())
+
+
+def _unquote(text):
+    return re.sub(r"\\(.)", r"\1", text[1:-1])
+
+
+def _compare(df, attr, value, flags):
+    """
+    Boolean index: rows whose attr fully matches the regex value
+    """
+    column = _get_short_name_from_long_name(attr)
+    unknown = set(flags) - set("cdl")
+    if unknown:
+        raise ValueError(f"Unknown CQL flag(s) %{''.join(sorted(unknown))}: use %c, %d or %l")
+    case = "c" not in flags
+    literal = "l" in flags
+    # %d ignores diacritics, on both sides of the comparison
+    fold = _strip_diacritics if "d" in flags else str
+    if column not in df.columns and column not in df.index.names:
+        raise ValueError(f"No such attribute in CQL query: {attr}")
+    pattern = re.escape(fold(value)) if literal else fold(value)
+    regex = re.compile(pattern, flags=0 if case else re.IGNORECASE)
+    categorical = _get_categorical(df, column)
+    if categorical is not None:
+        # match each category once, then look the answer up for every row
+        labels = _category_labels(categorical, column, case=True)
+        hits = np.array([bool(regex.fullmatch(fold(label))) for label in labels])
+        return hits[categorical.codes]
+    values = df[column] if column in df.columns else df.index.get_level_values(column)
+    values = pd.Series(np.asarray(values)).astype(str).map(fold)
+    return values.str.fullmatch(regex).fillna(False).values.astype(bool)
+
+
+def _strip_diacritics(text):
+    """
+    text without its accents: cafe for café
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(i for i in decomposed if not unicodedata.combining(i))
+
+
+def _predicate_mask(df, expr):
+    """
+    Evaluate the inside of one [...] over all rows of df
+    """
+    kind = expr[0]
+    if kind == "any":
+        return np.ones(len(df), dtype=bool)
+    if kind == "cmp":
+        _, attr, op, value, flags = expr
+        hits = _compare(df, attr, value, flags)
+        return ~hits if op == "!=" else hits
+    if kind == "not":
+        return ~_predicate_mask(df, expr[1])
+    left, right = _predicate_mask(df, expr[1]), _predicate_mask(df, expr[2])
+    return left & right if kind == "and" else left | right
+
+
+class _NFA(object):
+    """
+    Thompson NFA: token states consume a row, others are epsilon moves
+    """
+
+    def __init__(self, node):
+        self.kind, self.arg, self.out = list(), list(), list()
+        start, ends = self._compile(node)
+        self.accept = self._add("match")
+        self._patch(ends, self.accept)
+        self.start = start
+
+    def _add(self, kind, arg=None):
+        self.kind.append(kind)
+        self.arg.append(arg)
+        self.out.append(list())
+        return len(self.kind) - 1
+
+    def _patch(self, ends, target):
+        for state in ends:
+            self.out[state].append(target)
+
+    def _compile(self, node):
+        kind = node[0]
+        if kind == "tok":
+            state = self._add("tok", node[1])
+            return state, [state]
+        if kind in {"bos", "eos"}:
+            state = self._add(kind)
+            return state, [state]
+        if kind == "seq":
+            start = self._add("split")
+            ends = [start]
+            for item in node[1]:
+                first, last = self._compile(item)
+                self._patch(ends, first)
+                ends = last
+            return start, ends
+        if kind == "alt":
+            start = self._add("split")
+            ends = list()
+            for branch in node[1]:
+                first, last = self._compile(branch)
+                self.out[start].append(first)
+                ends += last
+            return start, ends
+        _, inner, low, high = node
+        start = self._add("split")
+        ends = [start]
+        for _ in range(low):
+            first, last = self._compile(inner)
+            self._patch(ends, first)
+            ends = last
+        if high is None:
+            loop = self._add("split")
+            self._patch(ends, loop)
+            first, last = self._compile(inner)
+            self.out[loop].append(first)
+            self._patch(last, loop)
+            return start, [loop]
+        for _ in range(high - low):
+            optional = self._add("split")
+            self._patch(ends, optional)
+            first, last = self._compile(inner)
+            self.out[optional].append(first)
+            ends = [optional] + last
+        return start, ends
+
+    def first_tokens(self):
+        """
+        Predicates that the first row of a match could have to satisfy
+        """
+        seen, todo, found = set(), [self.start], set()
+        while todo:
+            state = todo.pop()
+            if state in seen:
+                continue
+            seen.add(state)
+            if self.kind[state] == "tok":
+                found.add(self.arg[state])
+            else:
+                todo += self.out[state]
+        return found
+
+
+def _closure(nfa, active, at_start, at_end):
+    """
+    Follow epsilon moves until nothing changes; anchors only pass where allowed
+    """
+    changed = True
+    while changed:
+        changed = False
+        for state, kind in enumerate(nfa.kind):
+            if kind in {"tok", "match"}:
+                continue
+            moving = active[state]
+            if kind == "bos":
+                moving = moving & at_start
+            elif kind == "eos":
+                moving = moving & at_end
+            if not moving.any():
+                continue
+            for target in nfa.out[state]:
+                new = moving & ~active[target]
+                if new.any():
+                    active[target] |= new
+                    changed = True
+    return active
+
+
+def _simulate(nfa, masks, sents, starts):
+    """
+    Length of the longest match from each of starts (0 where there is none)
+    """
+    size = len(sents)
+    best = np.zeros(len(starts), dtype=np.int64)
+    alive = np.arange(len(starts))
+    active = np.zeros((len(nfa.kind), len(starts)), dtype=bool)
+    active[nfa.start] = True
+    step = 0
+    while len(alive):
+        cand = starts[alive]
+        pos = cand + step
+        inside = pos < size
+        clipped = np.minimum(pos, size - 1)
+        same = inside & (sents[clipped] == sents[cand])
+        previous = np.maximum(pos - 1, 0)
+        at_start = (pos == cand) & ((cand == 0) | (sents[previous] != sents[cand]))
+        at_end = ~same
+        active = _closure(nfa, active, at_start, at_end)
+        accepted = active[nfa.accept]
+        best[alive[accepted]] = step
+        following = np.zeros_like(active)
+        for state, kind in enumerate(nfa.kind):
+            if kind != "tok":
+                continue
+            moving = active[state] & same & masks[nfa.arg[state]][clipped]
+            if moving.any():
+                following[nfa.out[state][0]] |= moving
+        keep = following.any(axis=0)
+        alive, active = alive[keep], following[:, keep]
+        step += 1
+    return best
+
+
+def _leftmost_longest(starts, lengths):
+    """
+    Drop matches that overlap an earlier match
+    """
+    ends = starts + lengths
+    if len(starts) < 2 or (starts[1:] >= ends[:-1]).all():
+        return starts, lengths
+    keep = np.zeros(len(starts), dtype=bool)
+    last_end = -1
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        if start >= last_end:
+            keep[i] = True
+            last_end = end
+    return starts[keep], lengths[keep]
+
+
+def _cql(df, query):
+    """
+    Search df for a CQL query, returning matching rows with their _position
+    """
+    parser = _Parser(query)
+    nfa = _NFA(parser.parse())
+    masks = [_predicate_mask(df, expr) for expr in parser.predicates]
+    sents = _sentence_ids(df)
+    if sents is None:
+        sents = np.zeros(len(df), dtype=np.int64)
+
+    # a match has to begin on a row that some first token could match
+    possible = np.zeros(len(df), dtype=bool)
+    for pred in nfa.first_tokens():
+        possible |= masks[pred]
+    starts = np.flatnonzero(possible)
+    found, lengths = list(), list()
+    for i in range(0, len(starts), CHUNK_SIZE):
+        chunk = starts[i : i + CHUNK_SIZE]
+        best = _simulate(nfa, masks, sents, chunk)
+        found.append(chunk[best > 0])
+        lengths.append(best[best > 0])
+    found = np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+    lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+    found, lengths = _leftmost_longest(found, lengths)
+
+    rows = np.repeat(found, lengths) + _ranges(lengths)
+    out = df.iloc[rows]
+    out["_position"] = _ranges(lengths)
+    return out
@@ -4,14 +4,20 @@ import numpy as np
 import pandas as pd
 import scipy
 
-from joblib import Parallel
-
 from . import multi
+from .collocates import _collocates
 from .conc import _concordance
+from .cql import _cql
 from .constants import QUERYSETS, SENT_LEVEL_METADATA
 from .exceptions import NoReferenceCorpus
+from .freqlist import FrequencyList
+from .ngrams import NgramIndex, _phrase
+from .query import Query
+from .results import ResultSet
 from .search import Searcher
+from .similarity import _document_vector, _most_similar, _sentence_index
 from .slice import Just, See, Skip  # noqa: F401
+from .store import ModelStore
 from .tfidf import _tfidf_model, _tfidf_prototypical, _tfidf_score
 from .topology import _topology
 from .utils import (
@@ -31,12 +37,22 @@ class Dataset(pd.DataFrame):
     A corpus or corpus subset in memory
     """
 
-    _internal_names = pd.DataFrame._internal_names
+    # caches that must not be copied onto slices
+    _internal_names = pd.DataFrame._internal_names + [
+        "_char_offsets",
+        "_tfidf",
+        "_sentence_indexes",
+        "_vectors",
+    ]
     _internal_names_set = set(_internal_names)
 
-    _metadata = ["reference", "_tfidf", "_name"]
+    _metadata = ["reference", "_name", "_store"]
     reference = None
-    _tfidf = dict()
+    _char_offsets = None
+    _tfidf = None
+    _sentence_indexes = None
+    _vectors = None
+    _store = None
 
     @property
     def _constructor(self):
@@ -67,6 +83,23 @@ class Dataset(pd.DataFrame):
         """
         return self.shape[0]
 
+    def __setitem__(self, key, value):
+        """
+        Setting w drops the cached concordance buffer, which pandas may
+        otherwise keep, as it can write a new column into the old array
+        """
+        keys = key if isinstance(key, list) else [key]
+        if any(isinstance(i, str) and i == "w" for i in keys):
+            self._char_offsets = None
+        super().__setitem__(key, value)
+
+    @property
+    def lazy(self):
+        """
+        Start a lazy query plan: dataset.lazy.just.speaker.MOOKIE.skip.x.PUNCT
+        """
+        return Query(self)
+
     def tgrep(self, query, **kwargs):
         """
         Search constituency parses using tgrep
@@ -79,6 +112,63 @@ class Dataset(pd.DataFrame):
         """
         return Searcher().run(self, "d", query, **kwargs)
 
+    def cql(self, query):
+        """
+        Search token sequences with a CQL query: '[x="ADJ"]{1,3} [l="house"]'
+
+        Matching tokens get a _position, so conc() shows each whole span.
+        """
+        return _cql(self, query)
+
+    def to_resultset(self, reference=None):
+        """
+        Get these results as a compact, sorted array of _n values
+
+        ResultSets can be combined cheaply with | & - and ~, and only turned
+        back into rows (collect, table, conc) when needed.
+        """
+        return ResultSet.from_dataset(self, reference=reference)
+
+    def collocates(self, query, span=(-4, 4), measure="mi", by="l", **kwargs):
+        """
+        Rank the collocates of query (depgrep string, results or ResultSet)
+
+        measure: mi, t, ll or logdice
+        span: (left, right) window around each match, or an int for both
+        by: column(s) to count collocates by
+        min_count: ignore collocates seen fewer times than this
+        sentence_bound: do not let windows cross sentence boundaries
+        """
+        return _collocates(self, query, span=span, measure=measure, by=by, **kwargs)
+
+    def ngram_index(self, show="w", preserve_case=False):
+        """
+        Build a suffix array over this data, for fast n-gram and phrase lookups
+        """
+        return NgramIndex.from_dataset(self, show=show, preserve_case=preserve_case)
+
+    def frequency_list(self, show=["w"], preserve_case=False):
+        """
+        Counts of show over this data, for use as a keyness reference
+        """
+        return FrequencyList.from_dataset(self, show=show, preserve_case=preserve_case)
+
+    def ngrams(self, n, show="l", min_count=1, preserve_case=False):
+        """
+        Count every n-gram inside a sentence, most frequent first
+        """
+        index = self.ngram_index(show=show, preserve_case=preserve_case)
+        return index.ngrams(n, min_count=min_count)
+
+    def phrase(self, query, show="w", preserve_case=False):
+        """
+        Find exact token sequences: dataset.phrase("in the end")
+
+        Each matching token has a _position, as in multiword searches.
+        """
+        index = self.ngram_index(show=show, preserve_case=preserve_case)
+        return _phrase(self, index, query)
+
     def conc(self, *args, **kwargs):
         """
         Generate a concordance for each row
@@ -129,7 +219,6 @@ class Dataset(pd.DataFrame):
         scorer = FormalityScorer()
         return scorer.sentences(self, **kwargs)
 
-
     def wordcloud(self, show="w", preserve_case=False, **kwargs):
         from wordcloud import WordCloud
         if not isinstance(show, list):
@@ -160,8 +249,7 @@ class Dataset(pd.DataFrame):
         queries = [q.format(query=depgrep_query) for q in QUERYSETS[queryset]]
         multiprocess = multi.how_many(multiprocess)
         chunks = np.array_split(queries, multiprocess)
-        delay = (multi.search(self, x, i, **kwargs) for i, x in enumerate(chunks))
-        nested = Parallel(n_jobs=multiprocess)(delay)
+        nested = multi.broadcast(multi.search, self, chunks, **kwargs)
         # unpack the nested list that multiprocessing creates
         results = [item for sublist in nested for item in sublist]
 
@@ -182,13 +270,24 @@ class Dataset(pd.DataFrame):
         self.reference = self.copy()
         return self
 
-    def tfidf_by(self, column, n_top_members=-1, show=["w"]):
+    def tfidf_by(self, column, n_top_members=-1, show=["w"], store=None):
         """
         Generate tfidf vectors for the given column
 
         I.e. one model for each speaker, setting, whatever
-        """
-        vectors = _tfidf_model(self, column, n_top_members=n_top_members, show=show)
+
+        store: a ModelStore (or folder) to reuse/save fitted models. Datasets
+        loaded from a Corpus use the corpus' own store by default.
+        """
+        store = self._store if store is None else store
+        if isinstance(store, str):
+            store = ModelStore(store)
+        if store is not None:
+            vectors = store.get(self, column, show=show, n_top_members=n_top_members)
+        else:
+            vectors = _tfidf_model(self, column, n_top_members=n_top_members, show=show)
+        if self._tfidf is None:
+            self._tfidf = dict()
         self._tfidf[(column, tuple(show))] = vectors
 
     def tfidf_score(self, column, show, text):
@@ -199,9 +298,13 @@ class Dataset(pd.DataFrame):
         """
         return _tfidf_score(self, column, show, text)
 
-    def prototypical(self, column, show, n_top_members=-1, only_correct=True, top=-1):
+    def prototypical(
+        self, column, show, n_top_members=-1, only_correct=True, top=-1, chunk_size=100_000
+    ):
         """
         Get prototypical instances over bins segmented by column
+
+        chunk_size: how many sentences to score at once, to bound memory
         """
         return _tfidf_prototypical(
             self,
@@ -210,6 +313,7 @@ class Dataset(pd.DataFrame):
             n_top_members=n_top_members,
             only_correct=only_correct,
             top=top,
+            chunk_size=chunk_size,
         )
 
     def to_spacy(self, language="en"):
@@ -220,7 +324,40 @@ class Dataset(pd.DataFrame):
 
     @property
     def vector(self):
-        return self.to_spacy().vector
+        return self.document_vector()
+
+    def document_vector(self, language="en", batch_size=1000):
+        """
+        Mean spaCy token vector over all sentences, worked out in batches
+
+        Made once per session, and kept in the corpus' model store if there is one
+        """
+        return _document_vector(self, language=language, batch_size=batch_size)
+
+    def sentence_index(self, by="tfidf", show=["w"], dims=256, language="en", batch_size=1000):
+        """
+        Vectors for every sentence, for most_similar, made once per session
+
+        by: tfidf (rows of a tf-idf model, projected to dims) or spacy
+        """
+        key = (by, tuple(show), dims, language)
+        if self._sentence_indexes is None:
+            self._sentence_indexes = dict()
+        if key not in self._sentence_indexes:
+            kwa = dict(by=by, show=show, dims=dims, language=language, batch_size=batch_size)
+            self._sentence_indexes[key] = _sentence_index(self, **kwa)
+        return self._sentence_indexes[key]
+
+    def most_similar(self, query, k=20, approximate=False, **kwargs):
+        """
+        The k sentences most similar to query, which can be a text string, a
+        (file, s) key or a Dataset of sentences
+
+        approximate: only score sentences found by random-hyperplane hashing
+        kwargs go to sentence_index
+        """
+        index = self.sentence_index(**kwargs)
+        return _most_similar(self, index, query, k=k, approximate=approximate)
 
     def similarity(self, other, save_as=None, **kwargs):
         """
@@ -2,9 +2,10 @@
 buzz: attempting to measure token/sentence formality
 """
 
+import numpy as np
 import pandas as pd
 
-from .utils import _get_tqdm
+from .utils import _codes_and_labels
 
 try:
     from pattern.en.wordlist import ACADEMIC, BASIC, PROFANITY
@@ -12,9 +13,6 @@ except ImportError:
     print("pattern.en not found. Install it for more precision here!")
     ACADEMIC, BASIC, PROFANITY = set(), set(), set()
 
-
-tqdm = _get_tqdm()
-
 # here are all the different scores within formality, and how important
 # they should be for the final score. adjust them to prioritise things until it works
 WEIGHTS = dict(
@@ -48,18 +46,42 @@ class FormalityScorer:
         self.lemma_formality = LEMMA_FORMALITY
         self.wordclass_formality = WORDCLASS_FORMALITY
         self.override = OVERRIDE
+        self.basic = BASIC
+        self.academic = ACADEMIC
+        self.profanity = PROFANITY
         self.wsum = sum([abs(v) for v in WEIGHTS.values()])
         self.max_word_length = 12  # any letters beyond this don't count
         self.max_sent_length = 100
 
+    def _scores(self, lemmas, xpos):
+        """
+        Each unweighted score, for arrays of lemma and XPOS strings
+
+        Lemma scores only need lemmas, wordclass scores only XPOS, so each
+        array can be the vocabulary rather than every token.
+        """
+        lemmas = pd.Series(lemmas, dtype=object)
+        small = np.minimum(self.max_word_length, lemmas.str.len().values)
+        half = self.max_word_length / 2
+        # in this order, so that sums match token()
+        return dict(
+            length=(small - half) / half,
+            formality_of_wordclass=(
+                pd.Series(xpos, dtype=object).map(self.wordclass_formality).fillna(0).values
+            ),
+            formality_of_word=lemmas.map(self.lemma_formality).fillna(0).values,
+            is_common=np.where(lemmas.isin(self.basic), 1, -1),
+            is_profane=np.where(lemmas.isin(self.profanity), 1, -1),
+            is_academic=np.where(lemmas.isin(self.academic), 1, -1),
+        )
+
     def token(self, lemma, xpos=None):
         """
         Score a token for formality
         """
-        # allow a pandas series (i.e. dataset row) to be passed in
-        if isinstance(lemma, pd.Series):
-            xpos = lemma[0]
-            lemma = lemma[1]
+        # allow a pandas series (i.e. dataset row) of lemma and xpos to be passed in
+        if isinstance(lemma, (pd.Series, np.ndarray)):
+            lemma, xpos = list(lemma)[:2]
         if not xpos:
             msg = "For token formality, either pass a Series, or lemma and XPOS"
             raise ValueError(msg)
@@ -67,49 +89,51 @@ class FormalityScorer:
         if (lemma, xpos) in self.override:
             return self.override[(lemma, xpos)]
 
-        scores = dict()
-
-        # add any score we can figure out
-        small = min(self.max_word_length, len(lemma))
-        scores["length"] = (small - self.max_word_length / 2) / (
-            self.max_word_length / 2
-        )
-        scores["formality_of_wordclass"] = WORDCLASS_FORMALITY.get(xpos, 0)
-        scores["formality_of_word"] = LEMMA_FORMALITY.get(lemma, 0)
-        scores["is_common"] = 1 if lemma in BASIC else -1
-        scores["is_profane"] = 1 if lemma in PROFANITY else -1
-        scores["is_academic"] = 1 if lemma in ACADEMIC else -1
+        scores = self._scores([lemma], [xpos])
         return sum(
-            [score * self.weights[name] / self.wsum for name, score in scores.items()]
+            [score[0] * self.weights[name] / self.wsum for name, score in scores.items()]
         )
 
+    def tokens(self, df):
+        """
+        Score every token in a dataset
+
+        Scores are worked out once per lemma and XPOS in the vocabulary, then
+        looked up for each token by its category code.
+        """
+        lemma_codes, lemmas = _codes_and_labels(df, "l", preserve_case=True)
+        xpos_codes, xpos = _codes_and_labels(df, "x", preserve_case=True)
+        lemma_scores = self._scores(lemmas, [""] * len(lemmas))
+        xpos_scores = self._scores([""] * len(xpos), xpos)
+        total = 0
+        for name in lemma_scores:
+            scores = xpos_scores if name == "formality_of_wordclass" else lemma_scores
+            codes = xpos_codes if name == "formality_of_wordclass" else lemma_codes
+            total = total + (scores[name] * self.weights[name] / self.wsum)[codes]
+        for (lemma, pos), score in self.override.items():
+            found = (lemmas == lemma)[lemma_codes] & (xpos == pos)[xpos_codes]
+            total[found] = score
+        return pd.Series(total, index=df.index, name="_formality")
+
     def _formality_by_sent_length(self, length):
         """
         A score between -1 and 1 for sent length
         """
-        sent_len = min(length, self.max_sent_length)
+        sent_len = np.minimum(length, self.max_sent_length)
         return (sent_len - self.max_sent_length / 2) / (self.max_sent_length / 2)
 
-    def _sent_formality(self, group):
-        sent_score = self._formality_by_sent_length(len(group))
-        token_score = group.mean()
-        return ((sent_score / 2) + (token_score * 2)) / 2
-
     def sentences(self, df):
         """
         Score each sentence in a dataset
 
         Right now, the score from sentence length is just as important as the averaged tokens score
         """
-        kwa = dict(ncols=120, unit="token", desc="Calculating tokens")
-        tqdm.pandas(**kwa)
-        df["_formality"] = (
-            df[["l", "x"]].astype(str).progress_apply(self.token, axis=1, raw=True)
-        )
-        kwa = dict(ncols=120, unit="sentence", desc="Calculating sentences")
-        tqdm.pandas(**kwa)
-        groups = df["_formality"].astype(float).groupby(["file", "s"])
-        df["_sent_formality"] = groups.progress_apply(self._sent_formality)
+        df["_formality"] = self.tokens(df)
+        sents = df.groupby(["file", "s"], sort=False).ngroup().values
+        lengths = np.bincount(sents)
+        token_score = np.bincount(sents, weights=df["_formality"].values) / lengths
+        sent_score = self._formality_by_sent_length(lengths)
+        df["_sent_formality"] = (((sent_score / 2) + (token_score * 2)) / 2)[sents]
         return df[["_formality", "_sent_formality"]]
 
     def text(self, df):
@@ -0,0 +1,90 @@
+"""
+buzz: frequency lists, stored reference counts for keyness
+
+A frequency list is the vocabulary of one show-spec (e.g. w, l or l/x) and
+how often each item occurs. Built once, it can be passed as reference= when
+calculating keyness, so the reference corpus never needs loading.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class FrequencyList(object):
+    """
+    Counts of every match for one show-spec, plus the number of tokens counted
+    """
+
+    def __init__(self, counts, show=["w"], preserve_case=False):
+        if isinstance(show, str):
+            show = show.split("/")
+        self.counts = counts.astype(np.int64).rename_axis("/".join(show))
+        self.show = list(show)
+        self.preserve_case = preserve_case
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __repr__(self):
+        name = "/".join(self.show)
+        return f"<FrequencyList of {name}: {len(self)} types, {self.total} tokens>"
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    @classmethod
+    def from_dataset(cls, df, show=["w"], preserve_case=False):
+        """
+        Count show over a loaded Dataset
+        """
+        from .views import _code_table
+
+        if isinstance(show, str):
+            show = show.split("/")
+        counts = _code_table(df, False, show, preserve_case).iloc[0]
+        return cls(counts, show=show, preserve_case=preserve_case)
+
+    @classmethod
+    def from_corpus(cls, corpus, show=["w"], preserve_case=False, multiprocess=False):
+        """
+        Count show over an unloaded Corpus, one file at a time
+        """
+        if isinstance(show, str):
+            show = show.split("/")
+        kwa = dict(subcorpora=False, streaming=True, sort=False, multiprocess=multiprocess)
+        counts = corpus.table(show=show, preserve_case=preserve_case, **kwa).iloc[0]
+        return cls(counts, show=show, preserve_case=preserve_case)
+
+    def save(self, path):
+        """
+        Store the list as a .npz file
+        """
+        np.savez(
+            path,
+            vocab=np.asarray(self.counts.index, dtype=str),
+            counts=self.counts.values,
+            settings=np.array(["/".join(self.show), str(self.preserve_case)]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a list stored with FrequencyList.save
+        """
+        with np.load(path) as data:
+            show, preserve_case = data["settings"]
+            counts = pd.Series(data["counts"], index=data["vocab"].astype(object))
+            return cls(counts, show=str(show), preserve_case=preserve_case == "True")
+
+    def check(self, show, preserve_case=False):
+        """
+        Raise ValueError if this list was not counted the way a table is
+        """
+        if list(show) != self.show or bool(preserve_case) != self.preserve_case:
+            counted = "/".join(self.show)
+            wanted = "/".join(show)
+            raise ValueError(
+                f"Frequency list counts {counted} (preserve_case={self.preserve_case}), "
+                f"but the table shows {wanted} (preserve_case={preserve_case})"
+            )
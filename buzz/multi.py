@@ -3,11 +3,22 @@ buzz: multiprocessing helpers
 """
 import multiprocessing
 import os
+import shutil
+import tempfile
 
-from joblib import delayed
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
 
 from .utils import _get_tqdm, _to_df, _tqdm_close, _tqdm_update
 
+try:
+    # pandas >= 1.3: a frame can be one block per column, so nothing is copied
+    from pandas.core.internals import BlockManager
+    from pandas.core.internals.api import make_block
+except ImportError:
+    BlockManager = None
+
 
 def how_many(multiprocess):
     """
@@ -25,6 +36,147 @@ def how_many(multiprocess):
     return multiprocess
 
 
+# on linux, /dev/shm keeps the shared arrays in memory rather than on disk
+SHARED_FOLDER = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+class SharedDataset(object):
+    """
+    A Dataset written once as arrays that worker processes memory-map
+
+    Only this small description of the columns is pickled for each job.
+    Numeric columns, index codes and the codes of categorical columns are
+    mapped without copying, and object columns become categoricals.
+    """
+
+    def __init__(self, df):
+        self.folder = tempfile.mkdtemp(prefix="buzz-", dir=SHARED_FOLDER)
+        self.name = getattr(df, "_name", None)
+        self.length = len(df)
+        self._mapped = dict()
+        index = df.index
+        if not isinstance(index, pd.MultiIndex):
+            index = pd.MultiIndex.from_arrays([index])
+        # the index keeps its own levels, so workers need not factorize them
+        self.names = list(index.names)
+        pairs = zip(index.levels, index.codes)
+        self.levels = [(level, self._save(codes)) for level, codes in pairs]
+        self.columns = [self._publish(i, df[i]) for i in df.columns]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        # memory maps are opened again in each worker
+        return {k: v for k, v in self.__dict__.items() if k != "_mapped"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._mapped = dict()
+
+    def _save(self, values):
+        """
+        Write one array to the folder, returning its path
+        """
+        path = os.path.join(self.folder, f"{len(os.listdir(self.folder))}.npy")
+        np.save(path, np.asarray(values))
+        return path
+
+    def _map(self, path):
+        """
+        Memory-map a saved array, once per process
+        """
+        if path not in self._mapped:
+            self._mapped[path] = np.load(path, mmap_mode="r")
+        return self._mapped[path]
+
+    def _publish(self, name, values):
+        """
+        Write one column to the folder, returning what is needed to rebuild it
+        """
+        if isinstance(values.dtype, np.dtype) and values.dtype.kind in "biufcmM":
+            return name, "array", self._save(values), None
+        if values.dtype.name == "category":
+            values = values.values
+        else:
+            try:
+                values = pd.Categorical(np.asarray(values))
+            except TypeError:
+                # unhashable values, like parse trees, are shared once per object
+                ids = pd.Series(np.fromiter(map(id, values), dtype=np.int64, count=len(values)))
+                codes, first = ids.factorize()[0], ~ids.duplicated().values
+                return name, "objects", self._save(codes), np.asarray(values)[first]
+        # codes are saved with the dtype pandas wants for them, so are not cast
+        return name, "category", self._save(values.codes), values.categories
+
+    def _rebuild(self, kind, path, extra):
+        values = self._map(path)
+        if kind == "category":
+            return pd.Categorical.from_codes(values, categories=extra)
+        if kind == "objects":
+            # python objects cannot live in shared memory, so only these are built
+            return extra[values]
+        return values
+
+    def attach(self):
+        """
+        Rebuild the Dataset from the shared arrays, inside a worker
+        """
+        from .dataset import Dataset
+
+        codes = [self._map(path) for _, path in self.levels]
+        levels = [level for level, _ in self.levels]
+        kwa = dict(names=self.names, verify_integrity=False)
+        index = pd.MultiIndex(levels=levels, codes=codes, **kwa)
+        if len(levels) == 1:
+            index = index.get_level_values(0)
+        names = [i[0] for i in self.columns]
+        columns = [self._rebuild(*i[1:]) for i in self.columns]
+        if BlockManager is None:
+            # categoricals keep their shared codes, numeric columns are consolidated
+            data = dict(zip(names, columns))
+            return Dataset(pd.DataFrame(data, index=index, copy=False), name=self.name)
+        blocks = list()
+        for i, values in enumerate(columns):
+            if isinstance(values, np.ndarray):
+                values = values.reshape(1, -1)
+            blocks.append(make_block(values, placement=[i], ndim=2))
+        manager = BlockManager(blocks, [pd.Index(names), index], verify_integrity=False)
+        return Dataset(pd.DataFrame(manager), name=self.name)
+
+    def close(self):
+        """
+        Delete the shared arrays
+        """
+        self._mapped = dict()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def _attach(df):
+    """
+    Get the Dataset a job was given, whether shared or not
+    """
+    return df.attach() if isinstance(df, SharedDataset) else df
+
+
+def broadcast(function, df, chunks, **kwargs):
+    """
+    Run a delayed function(df, chunk, position) on each chunk in parallel
+
+    The Dataset is shared between the workers once, rather than pickled for
+    every job. With one chunk, everything happens in this process.
+    """
+    if len(chunks) < 2:
+        delay = (function(df, chunk, i, **kwargs) for i, chunk in enumerate(chunks))
+        return Parallel(n_jobs=1)(delay)
+    with SharedDataset(df) as shared:
+        delay = (function(shared, chunk, i, **kwargs) for i, chunk in enumerate(chunks))
+        return Parallel(n_jobs=len(chunks))(delay)
+
+
 @delayed
 def load(files, position, order={}, **kwargs):
     """
@@ -70,6 +222,7 @@ def search(corpus, queries, position, **kwargs):
 
     No need for progress bar  because it is in depgrep
     """
+    corpus = _attach(corpus)
     out = []
     for query in queries:
         res = corpus.depgrep(query, position=position, **kwargs)
@@ -79,7 +232,18 @@ def search(corpus, queries, position, **kwargs):
 
 
 @delayed
-def parse(paths, position, save_as, corpus_name, language, constituencies, speakers, plain_path, hocr):
+def parse(
+    paths,
+    position,
+    save_as,
+    corpus_name,
+    language,
+    constituencies,
+    speakers,
+    plain_path,
+    hocr,
+    disable=(),
+):
     """
     Parse using multiprocessing, chunks of paths
     """
@@ -92,21 +256,21 @@ def parse(paths, position, save_as, corpus_name, language, constituencies, speak
     for path in paths:
         with open(path, "r") as fo:
             plain = fo.read().strip()
-        _process_string(
-            plain, path, save_as, corpus_name, language, constituencies, speakers, plain_path, hocr
-        )
+        args = (save_as, corpus_name, language, constituencies, speakers, plain_path, hocr)
+        _process_string(plain, path, *args, disable)
         _tqdm_update(t)
     _tqdm_close(t)
 
 
 @delayed
-def topology(corpus, queries, position):
+def topology(corpus, queries, position, counts=None):
     """
     Topolgy using multiprocessing, chunks of queries
     """
     # [word, name, query, is_bool, features_of_interest]
     from .topology import _process_chunk
 
+    corpus = _attach(corpus)
     kwa = dict(
         ncols=120,
         unit="query",
@@ -118,7 +282,28 @@ def topology(corpus, queries, position):
     t = _get_tqdm()(**kwa)
     results = []
     for querybits in queries:
-        results.append(_process_chunk(corpus, *querybits))
+        results.append(_process_chunk(corpus, *querybits, counts))
         _tqdm_update(t, postfix=querybits[0])
     _tqdm_close(t)
     return results
+
+
+@delayed
+def table(files, position, show, subcorpora, preserve_case, usecols):
+    """
+    Count one chunk of files for a streamed table, holding one file at a time
+    """
+    from .views import _merge_counts, _partial_counts
+
+    kwa = dict(
+        ncols=120, unit="file", desc="Counting", position=position, total=len(files)
+    )
+    t = _get_tqdm()(**kwa)
+    partials = []
+    for file in files:
+        df = file.load(usecols=usecols)
+        if df is not None:
+            partials.append(_partial_counts(df, show, subcorpora, preserve_case))
+        _tqdm_update(t)
+    _tqdm_close(t)
+    return _merge_counts(partials, subcorpora, wide=False)
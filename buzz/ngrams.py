@@ -0,0 +1,201 @@
+"""
+buzz: n-gram counts and exact phrase search over a suffix array
+
+The corpus is turned into one array of token codes, with a separator (0)
+after every sentence. Sorting every suffix of that array puts all
+occurrences of any token sequence next to each other, so counting a
+sequence is two binary searches, and counting all n-grams is one pass over
+the sorted suffixes.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .utils import _codes_and_labels, _sentence_ids
+
+
+def _suffix_array(text):
+    """
+    Sort the suffixes of an integer array by prefix doubling
+
+    Each round sorts by (rank of first k items, rank of next k items), which
+    gives the rank of the first 2k items, until every suffix has its own rank.
+    """
+    size = len(text)
+    if not size:
+        return np.zeros(0, dtype=np.int64)
+    rank = text.astype(np.int64)
+    # keep ranks dense, so that a pair of ranks fits in one int64 sort key
+    rank = np.unique(rank, return_inverse=True)[1].ravel().astype(np.int64)
+    k = 1
+    while True:
+        following = np.zeros(size, dtype=np.int64)
+        following[: max(size - k, 0)] = rank[k:] + 1
+        key = rank * (size + 1) + following
+        sa = np.argsort(key, kind="stable")
+        key = key[sa]
+        changed = np.empty(size, dtype=np.int64)
+        changed[0] = 0
+        np.not_equal(key[1:], key[:-1], out=changed[1:], casting="unsafe")
+        rank = np.empty(size, dtype=np.int64)
+        rank[sa] = np.cumsum(changed)
+        if rank[sa[-1]] == size - 1 or k >= size:
+            return sa
+        k *= 2
+
+
+class NgramIndex(object):
+    """
+    Suffix array over the codes of one column, for n-grams and phrase lookups
+    """
+
+    def __init__(self, text, sa, rows, labels, show="w", preserve_case=False):
+        self.text = text
+        self.sa = sa
+        self.rows = rows
+        self.labels = np.asarray(labels, dtype=object)
+        self.show = show
+        self.preserve_case = preserve_case
+        self._vocab = None
+
+    @classmethod
+    def from_dataset(cls, df, show="w", preserve_case=False):
+        """
+        Build the index for the tokens of df, counting by show
+        """
+        codes, labels = _codes_and_labels(df, show, preserve_case=preserve_case)
+        sents = _sentence_ids(df)
+        if sents is None:
+            sents = np.zeros(len(df), dtype=np.int64)
+        num_sents = int(sents[-1]) + 1 if len(df) else 0
+        # row r goes to r + (sentences before it), leaving a gap after each sentence
+        where = np.arange(len(df)) + sents
+        text = np.zeros(len(df) + num_sents, dtype=np.int32)
+        text[where] = codes + 1
+        rows = np.full(len(text), -1, dtype=np.int64)
+        rows[where] = np.arange(len(df))
+        return cls(text, _suffix_array(text), rows, labels, show=show, preserve_case=preserve_case)
+
+    def save(self, path):
+        """
+        Store the index as a .npz file
+        """
+        np.savez(
+            path,
+            text=self.text,
+            sa=self.sa,
+            rows=self.rows,
+            labels=self.labels.astype(str),
+            settings=np.array([self.show, str(self.preserve_case)]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index stored with NgramIndex.save
+        """
+        with np.load(path) as data:
+            show, preserve_case = data["settings"]
+            return cls(
+                data["text"],
+                data["sa"],
+                data["rows"],
+                data["labels"].astype(object),
+                show=str(show),
+                preserve_case=preserve_case == "True",
+            )
+
+    def _encode(self, sequence):
+        """
+        Turn a phrase (string or list of tokens) into text codes, or None if unknown
+        """
+        if isinstance(sequence, str):
+            sequence = sequence.split()
+        if self._vocab is None:
+            self._vocab = {label: i + 1 for i, label in enumerate(self.labels)}
+        codes = list()
+        for token in sequence:
+            token = token if self.preserve_case else token.lower()
+            if token not in self._vocab:
+                return
+            codes.append(self._vocab[token])
+        return codes
+
+    def _span(self, codes):
+        """
+        Range of the suffix array whose suffixes start with codes
+        """
+        lo, hi = 0, len(self.sa)
+        for offset, code in enumerate(codes):
+            if lo >= hi:
+                break
+            # suffixes in lo:hi share the earlier codes, so this column is sorted
+            positions = np.minimum(self.sa[lo:hi] + offset, len(self.text) - 1)
+            column = self.text[positions]
+            lo, hi = (
+                lo + np.searchsorted(column, code, side="left"),
+                lo + np.searchsorted(column, code, side="right"),
+            )
+        return lo, hi
+
+    def count(self, sequence):
+        """
+        How many times does this sequence of tokens occur?
+        """
+        codes = self._encode(sequence)
+        if not codes:
+            return 0
+        lo, hi = self._span(codes)
+        return max(hi - lo, 0)
+
+    def find(self, sequence):
+        """
+        Sorted row numbers where the sequence starts
+        """
+        codes = self._encode(sequence)
+        if not codes:
+            return np.zeros(0, dtype=np.int64)
+        lo, hi = self._span(codes)
+        return np.sort(self.rows[self.sa[lo:hi]])
+
+    def ngrams(self, n, min_count=1):
+        """
+        Frequency of every n-gram within a sentence, most frequent first
+        """
+        text, sa = self.text, self.sa
+        # tokens left in the sentence from each position; separators get 0
+        seps = np.flatnonzero(text == 0)
+        next_sep = seps[np.searchsorted(seps, np.arange(len(text)))]
+        remaining = next_sep - np.arange(len(text))
+        starts = sa[remaining[sa] >= n]
+        if not len(starts):
+            return pd.Series([], dtype=int, name="count")
+        grams = np.stack([text[starts + i] for i in range(n)], axis=1)
+        # sorted suffixes: equal n-grams are neighbours
+        new = np.ones(len(starts), dtype=bool)
+        new[1:] = (grams[1:] != grams[:-1]).any(axis=1)
+        firsts = np.flatnonzero(new)
+        counts = np.diff(np.append(firsts, len(starts)))
+        keep = counts >= min_count
+        firsts, counts = firsts[keep], counts[keep]
+        words = self.labels[grams[firsts] - 1]
+        index = [" ".join(gram) for gram in words]
+        out = pd.Series(counts, index=pd.Index(index, name=self.show), name="count")
+        return out.sort_values(ascending=False, kind="mergesort")
+
+
+def _phrase(df, index, sequence):
+    """
+    Rows of df taking part in an exact match of sequence, with their _position
+    """
+    length = len(sequence.split() if isinstance(sequence, str) else sequence)
+    starts = index.find(sequence)
+    rows = (starts[:, None] + np.arange(length)).ravel()
+    positions = np.tile(np.arange(length), len(starts))
+    # overlapping matches share rows: keep the smallest offset, as multiword does
+    order = np.lexsort((positions, rows))
+    rows, positions = rows[order], positions[order]
+    rows, first = np.unique(rows, return_index=True)
+    out = df.iloc[rows]
+    out["_position"] = positions[first]
+    return out
@@ -106,7 +106,16 @@ def _make_misc_field(word, token_meta, all_meta):
 
 
 def _process_string(
-    plain, path, save_as, corpus_name, language, constituencies, speakers, corpus_path, hocr
+    plain,
+    path,
+    save_as,
+    corpus_name,
+    language,
+    constituencies,
+    speakers,
+    corpus_path,
+    hocr,
+    disable=(),
 ):
     """
     spacy: process a string of text
@@ -119,9 +128,12 @@ def _process_string(
     plain = "\n".join(plain)
     # stripped_data = _strip_metadata(plain, speakers)
     stripped_data = to_stripped(plain, hocr=hocr)
-    nlp = _get_nlp(language=language, constituencies=constituencies)
-    sentencizer = nlp.create_pipe("sentencizer")
-    nlp.add_pipe(sentencizer, before='parser')
+    nlp = _get_nlp(
+        language=language,
+        constituencies=constituencies,
+        sentencizer=True,
+        disable=disable,
+    )
     doc = nlp(stripped_data)
     output = list()
     sent_index = 1
@@ -253,16 +265,26 @@ def _parse_cmd_line():
 class Parser:
     """
     Create an object that can parse a Corpus.
+
+    disable names spaCy components not to run, e.g. ["ner"] when entities
+    are not needed. The model is loaded once per process, not once per file.
     """
 
     def __init__(
-        self, language="en", multiprocess=False, constituencies=False, speakers=True, just_missing=False
+        self,
+        language="en",
+        multiprocess=False,
+        constituencies=False,
+        speakers=True,
+        just_missing=False,
+        disable=(),
     ):
         self.multiprocess = multiprocess
         self.language = language
         self.constituencies = constituencies
         self.speakers = speakers
         self.just_missing = just_missing
+        self.disable = tuple(disable)
 
     def _spacy_parse(self):
         if self.from_str:
@@ -276,9 +298,10 @@ class Parser:
                 self.constituencies,
                 self.speakers,
                 ".",
-                self.hocr
+                self.hocr,
+                self.disable,
             )
-            return self._process_string(*args)
+            return _process_string(*args)
         else:
             abspath = os.path.abspath(os.getcwd())
             fs = [os.path.join(abspath, f.path) for f in self.plain_corpus.files]
@@ -306,7 +329,8 @@ class Parser:
                     self.constituencies,
                     self.speakers,
                     self.plain_corpus.path,
-                    self.hocr
+                    self.hocr,
+                    self.disable,
                 )
                 for i, x in enumerate(chunks)
             )
@@ -0,0 +1,457 @@
+"""
+Lazy query plans for chained just/skip/near/see expressions
+
+corpus.lazy.just.speaker.MOOKIE.skip.xpos.PUNCT.see.lemma.by.wordclass
+
+Each just/skip/near step only adds to a plan. Nothing is filtered until a
+terminal operation happens (table, conc, see, len, iteration, collect). At
+that point, consecutive filters are fused into one boolean mask, with all
+filters on the same column merged into one test, and the plan is run in one
+pass over each file (unloaded Corpus) or over the whole Dataset.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .slice import Filter, Nearby
+from .utils import (
+    _category_labels,
+    _ensure_list_of_short_names,
+    _get_short_name_from_long_name,
+    _get_tqdm,
+    _order_df_columns,
+    _tqdm_close,
+    _tqdm_update,
+)
+
+tqdm = _get_tqdm()
+
+# searches that cannot be expressed as a row-wise mask
+SEARCH_COLUMNS = {"dependencies", "depgrep", "deps", "d", "tgrep", "trees", "t", "tree"}
+
+
+class Step(object):
+    """
+    One just/skip/near filter in a query plan
+    """
+
+    def __init__(self, column, entry, inverse=False, distance=None, **kwargs):
+        self.column = _get_short_name_from_long_name(column)
+        self.entry = entry
+        self.inverse = inverse
+        self.distance = distance
+        self.case = kwargs.pop("case", True)
+        self.exact_match = kwargs.pop("exact_match", False)
+        self.multiword = kwargs.pop("multiword", False)
+        self.kwargs = kwargs
+
+    @property
+    def fusable(self):
+        """
+        Can this step be computed as part of one combined row mask?
+        """
+        if self.distance is not None or self.multiword:
+            return False
+        return self.column not in SEARCH_COLUMNS
+
+    def mask(self, frame):
+        """
+        Row-wise boolean mask for this step over frame
+        """
+        finder = Filter(frame, self.column)
+        kwa = dict(self.kwargs)
+        bool_ix, _ = finder._make_bool_index(
+            self.entry, self.case, self.exact_match, False, **kwa
+        )
+        # str.contains gives nan for missing values, which must not match
+        bool_ix = pd.Series(np.asarray(bool_ix)).fillna(False).values.astype(bool)
+        return ~bool_ix if self.inverse else bool_ix
+
+    def label_hits(self, categorical):
+        """
+        Per-category version of mask, or None if this step cannot use categories
+        """
+        first = list(self.entry)[0] if isinstance(self.entry, (list, set, tuple)) else self.entry
+        if not isinstance(first, str):
+            return
+        labels = _category_labels(categorical, self.column, case=self.case)
+        normed = Filter._normalise_entry(self.entry, self.case)
+        hits = Filter._match_strung(normed, labels, self.exact_match, **self.kwargs)
+        hits = hits.values.astype(bool)
+        return ~hits if self.inverse else hits
+
+    def run(self, frame):
+        """
+        Run a step that could not be fused, using the eager machinery
+        """
+        kwa = dict(self.kwargs, case=self.case, exact_match=self.exact_match)
+        if self.distance is not None:
+            return Nearby(frame, self.column, distance=self.distance)(self.entry, **kwa)
+        if self.multiword:
+            kwa["multiword"] = self.multiword
+        return Filter(frame, self.column, inverse=self.inverse)(self.entry, **kwa)
+
+    def __repr__(self):
+        if self.distance is not None:
+            name = "near" if self.distance != 1 else "bigrams"
+        else:
+            name = "skip" if self.inverse else "just"
+        return f"{name}.{self.column}({self.entry!r})"
+
+    def describe(self):
+        """
+        Human readable version of the test this step performs
+        """
+        negate = "not " if self.inverse else ""
+        if isinstance(self.entry, (list, set, tuple)):
+            return f"{negate}{self.column} in {sorted(self.entry)}"
+        exact = self.exact_match and not self.kwargs.get("regex")
+        if exact or isinstance(self.entry, (int, float)):
+            op = "!=" if self.inverse else "=="
+            return f"{self.column} {op} {self.entry!r}"
+        how = "matches" if self.exact_match else "contains"
+        case = "" if self.case else " (case-insensitive)"
+        return f"{negate}{self.column} {how} /{self.entry}/{case}"
+
+
+def _merge_exact(steps):
+    """
+    Merge plain equality/set steps on one column into one set test, for explain()
+
+    Return: list of strings describing the merged column test
+    """
+    keep, drop, other = None, set(), list()
+    for step in steps:
+        entry = step.entry
+        plain = step.exact_match and not step.kwargs.get("regex") and step.case
+        if isinstance(entry, str) and plain:
+            entry = {entry}
+        elif not (isinstance(entry, (set, list)) and step.exact_match and step.case):
+            other.append(step.describe())
+            continue
+        entry = set(entry)
+        if step.inverse:
+            drop |= entry
+        else:
+            keep = entry if keep is None else keep & entry
+    out = list()
+    col = steps[0].column
+    if keep is not None:
+        keep = sorted(keep - drop)
+        out.append(f"{col} == {keep[0]!r}" if len(keep) == 1 else f"{col} in {keep}")
+    elif drop:
+        drop = sorted(drop)
+        out.append(f"{col} != {drop[0]!r}" if len(drop) == 1 else f"{col} not in {drop}")
+    return out + other
+
+
+def _fused_mask(frame, steps):
+    """
+    Make one boolean mask for a group of fusable steps
+
+    Steps are grouped by column. For categorical columns, every test on that
+    column is run over the categories, combined, and looked up by code once.
+    """
+    by_column = dict()
+    for step in steps:
+        by_column.setdefault(step.column, list()).append(step)
+    mask = np.ones(len(frame), dtype=bool)
+    for column, col_steps in by_column.items():
+        categorical = Filter(frame, column)._categorical_for(col_steps[0].entry)
+        combined = None
+        if categorical is not None:
+            for step in col_steps:
+                hits = step.label_hits(categorical)
+                if hits is None:
+                    combined = None
+                    break
+                combined = hits if combined is None else combined & hits
+        if combined is not None:
+            mask &= combined[categorical.codes]
+            continue
+        for step in col_steps:
+            mask &= step.mask(frame)
+    return mask
+
+
+class Query(object):
+    """
+    A lazy plan of filters over a Corpus, File or Dataset
+    """
+
+    def __init__(self, source, steps=None):
+        self._source = source
+        self._steps = list(steps or list())
+        self._result = None
+
+    def _add(self, step):
+        return Query(self._source, self._steps + [step])
+
+    @property
+    def just(self):
+        """
+        query.just.lemma.book -- add a filter to the plan
+        """
+        return QuerySlice(self)
+
+    @property
+    def skip(self):
+        """
+        query.skip.xpos.PUNCT -- add an inverse filter to the plan
+        """
+        return QuerySlice(self, inverse=True)
+
+    @property
+    def near(self):
+        """
+        query.near.lemma.book -- keep tokens near matches
+        """
+        return QuerySlice(self, distance=3)
+
+    @property
+    def bigrams(self):
+        """
+        query.bigrams.lemma.book -- keep tokens next to matches
+        """
+        return QuerySlice(self, distance=1)
+
+    @property
+    def see(self):
+        """
+        query.see.lemma.by.speaker -- terminal: make a table
+        """
+        return QuerySlice(self, see=True)
+
+    def _stages(self):
+        """
+        Split steps into stages: lists of fusable steps, or single unfusable steps
+        """
+        stages = list()
+        for step in self._steps:
+            if step.fusable and stages and isinstance(stages[-1], list):
+                stages[-1].append(step)
+            elif step.fusable:
+                stages.append([step])
+            else:
+                stages.append(step)
+        return stages
+
+    def _columns(self):
+        """
+        Columns needed to run the plan, or None if everything is needed
+        """
+        if any(step.column in SEARCH_COLUMNS for step in self._steps):
+            return
+        return list(dict.fromkeys(step.column for step in self._steps))
+
+    def _execute(self, frame):
+        """
+        Run the whole plan over one DataFrame
+        """
+        for stage in self._stages():
+            if not len(frame):
+                break
+            if isinstance(stage, list):
+                frame = frame[_fused_mask(frame, stage)]
+            else:
+                frame = stage.run(frame)
+        return frame
+
+    def _run(self, usecols=None):
+        """
+        Run the plan, in one pass per file if the source is not in memory
+        """
+        from .dataset import Dataset
+
+        source = self._source
+        if isinstance(source, pd.DataFrame):
+            return self._execute(source)
+
+        files = source.files if source.files is not None else [source]
+        kwa = dict(ncols=120, unit="file", desc="Querying corpus on disk", total=len(files))
+        t = tqdm(**kwa) if len(files) > 1 else None
+        load = dict(usecols=usecols) if usecols is not None else dict()
+        results = list()
+        n = 0
+        for file in files:
+            loaded = file.load(**load)
+            if loaded is None:
+                _tqdm_update(t)
+                continue
+            loaded["_n"] = range(n, n + len(loaded))
+            n += len(loaded)
+            result = self._execute(loaded)
+            if len(result):
+                results.append(result)
+            _tqdm_update(t)
+        _tqdm_close(t)
+        name = getattr(source, "name", None)
+        if not results:
+            return Dataset(pd.DataFrame(), name=name)
+        df = _order_df_columns(pd.concat(results, sort=False))
+        return Dataset(df, name=name)
+
+    def collect(self):
+        """
+        Run the plan, returning a Dataset
+        """
+        if self._result is None:
+            self._result = self._run()
+        return self._result
+
+    def to_resultset(self):
+        """
+        Terminal: run the plan, returning the matching _n values as a ResultSet
+        """
+        from .results import ResultSet
+
+        reference = self._source if isinstance(self._source, pd.DataFrame) else None
+        return ResultSet.from_dataset(self.collect(), reference=reference)
+
+    def table(self, show=["w"], subcorpora=["file"], **kwargs):
+        """
+        Terminal: run the plan and make a frequency table
+
+        For unloaded corpora, only the columns the plan and table need are loaded.
+        """
+        show = _ensure_list_of_short_names(show)
+        if subcorpora:
+            subcorpora = _ensure_list_of_short_names(subcorpora)
+        if self._result is not None or isinstance(self._source, pd.DataFrame):
+            result = self.collect()
+        else:
+            needed = self._columns()
+            if needed is not None:
+                plain = [i[2:] if i.startswith(("+", "-")) else i for i in show]
+                needed = list(dict.fromkeys(needed + plain + list(subcorpora or [])))
+            result = self._run(usecols=needed)
+        return result.table(show=show, subcorpora=subcorpora, **kwargs)
+
+    def conc(self, *args, **kwargs):
+        """
+        Terminal: run the plan and make a concordance
+        """
+        return self.collect().conc(*args, **kwargs)
+
+    def __len__(self):
+        return len(self.collect())
+
+    def __iter__(self):
+        return iter(self.collect())
+
+    def explain(self):
+        """
+        Show how this plan will be run
+        """
+        source = self._source
+        if isinstance(source, pd.DataFrame):
+            where = f"Dataset ({len(source)} rows), one pass in memory"
+        else:
+            files = source.files if source.files is not None else [source]
+            where = f"{type(source).__name__} ({source.path}), one pass per file ({len(files)})"
+        lines = [f"Query over {where}"]
+        if not self._steps:
+            lines.append("  (no filters)")
+        for i, stage in enumerate(self._stages(), start=1):
+            if not isinstance(stage, list):
+                lines.append(f"  {i}. {stage!r}")
+                continue
+            lines.append(f"  {i}. fused filter, one mask:")
+            by_column = dict()
+            for step in stage:
+                by_column.setdefault(step.column, list()).append(step)
+            for col_steps in by_column.values():
+                lines.append("       " + " and ".join(_merge_exact(col_steps)))
+        columns = self._columns()
+        if columns is not None and not isinstance(source, pd.DataFrame):
+            lines.append(f"  columns loaded: {columns} (plus any needed for output)")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"<{type(self).__module__}.{type(self).__name__}>\n{self.explain()}"
+
+
+class QuerySlice(object):
+    """
+    query.just/skip/near/see -- gets the column in query.just.COLUMN
+    """
+
+    def __init__(self, query, inverse=False, distance=None, see=False):
+        self._query = query
+        self.inverse = inverse
+        self.distance = distance
+        self.see = see
+
+    def _validate(self, col):
+        source = self._query._source
+        if not isinstance(source, pd.DataFrame):
+            return
+        valid = list(source.columns) + list(source.index.names) + list(SEARCH_COLUMNS)
+        for i in col:
+            if i not in valid:
+                raise ValueError(f"Invalid name(s): {col}")
+
+    def __getattr__(self, col):
+        if col.startswith("__"):
+            raise AttributeError(col)
+        return self(col)
+
+    def __call__(self, col):
+        col = _ensure_list_of_short_names(col)
+        self._validate(col)
+        use = QueryInterim if self.see else QueryFilter
+        return use(self._query, col[0], inverse=self.inverse, distance=self.distance)
+
+
+class QueryFilter(object):
+    """
+    query.just.COLUMN -- gets the entry, adding a step to the plan
+    """
+
+    def __init__(self, query, column, inverse=False, distance=None):
+        self._query = query
+        self.column = column
+        self.inverse = inverse
+        self.distance = distance
+
+    def __call__(self, entry, **kwargs):
+        if self.distance is not None:
+            kwargs.setdefault("distance", self.distance)
+        distance = kwargs.pop("distance", None)
+        step = Step(self.column, entry, inverse=self.inverse, distance=distance, **kwargs)
+        return self._query._add(step)
+
+    def __getattr__(self, entry):
+        """
+        query.just/skip.column.<entry>
+        """
+        if entry.startswith("__"):
+            raise AttributeError(entry)
+        return self.__call__(entry, exact_match=True, regex=False)
+
+
+class QueryInterim(QueryFilter):
+    """
+    query.see.COLUMN -- terminal table making
+    """
+
+    @property
+    def by(self):
+        """
+        query.see.x.by.y
+        """
+        return QueryInterim(self._query, self.column)
+
+    def __getattr__(self, entry):
+        """
+        query.see.x.by.<entry>
+        """
+        if entry.startswith("__"):
+            raise AttributeError(entry)
+        return self.__call__(entry)
+
+    def __call__(self, entry=None, *args, **kwargs):
+        if not entry:
+            return self._query.collect()[self.column].value_counts()
+        entry = _ensure_list_of_short_names(entry)
+        return self._query.table(show=entry, subcorpora=[self.column], *args, **kwargs)
@@ -0,0 +1,168 @@
+"""
+buzz: search/filter results as compact arrays of row ids
+
+A ResultSet is just a sorted array of _n values plus the Dataset they point
+into. Combining results is then a merge of sorted integer arrays, rather than
+hashing _n for every row, and rows are only copied when they are needed.
+"""
+
+import numpy as np
+
+from .exceptions import NoReferenceCorpus
+
+
+def _dedupe_sorted(arr):
+    """
+    Remove repeated values from a sorted array
+    """
+    if len(arr) < 2:
+        return arr
+    keep = np.empty(len(arr), dtype=bool)
+    keep[0] = True
+    np.not_equal(arr[1:], arr[:-1], out=keep[1:])
+    return arr[keep]
+
+
+def _in_sorted(values, sorted_arr):
+    """
+    Boolean index: which of values are present in sorted_arr
+    """
+    if not len(sorted_arr):
+        return np.zeros(len(values), dtype=bool)
+    ix = np.searchsorted(sorted_arr, values)
+    ix[ix == len(sorted_arr)] = 0
+    return sorted_arr[ix] == values
+
+
+class ResultSet(object):
+    """
+    A sorted array of _n values, plus the Dataset they come from
+    """
+
+    def __init__(self, ids, reference=None, assume_sorted=False):
+        ids = np.asarray(ids, dtype=np.int64)
+        if not assume_sorted:
+            ids = _dedupe_sorted(np.sort(ids, kind="mergesort"))
+        self.ids = ids
+        self.reference = reference
+
+    @classmethod
+    def from_dataset(cls, df, reference=None):
+        """
+        Make a ResultSet from a Dataset of results, using its reference if we can
+        """
+        if reference is None:
+            reference = getattr(df, "reference", None)
+        return cls(df["_n"].values, reference=reference)
+
+    @classmethod
+    def from_mask(cls, reference, mask):
+        """
+        Make a ResultSet from a boolean index over the rows of reference
+        """
+        return cls(reference["_n"].values[np.asarray(mask, dtype=bool)], reference=reference)
+
+    def _new(self, ids):
+        return ResultSet(ids, reference=self.reference, assume_sorted=True)
+
+    def _other_ids(self, other):
+        if isinstance(other, ResultSet):
+            if self.reference is not None and other.reference is not None:
+                if other.reference is not self.reference:
+                    raise ValueError("Cannot combine results from different reference data")
+            return other.ids
+        return ResultSet.from_dataset(other).ids
+
+    def _universe(self):
+        """
+        Sorted _n values of every row in the reference data
+        """
+        if self.reference is None:
+            raise NoReferenceCorpus("No reference data to take the complement against.")
+        universe = self.reference["_n"].values
+        if len(universe) > 1 and (np.diff(universe) <= 0).any():
+            universe = _dedupe_sorted(np.sort(universe))
+        return universe
+
+    def union(self, other):
+        """
+        Ids in either result
+        """
+        both = np.concatenate([self.ids, self._other_ids(other)])
+        # two sorted runs: mergesort just merges them
+        return self._new(_dedupe_sorted(np.sort(both, kind="mergesort")))
+
+    def intersection(self, other):
+        """
+        Ids in both results
+        """
+        a, b = self.ids, self._other_ids(other)
+        small, big = (a, b) if len(a) <= len(b) else (b, a)
+        return self._new(small[_in_sorted(small, big)])
+
+    def difference(self, other):
+        """
+        Ids in this result but not the other
+        """
+        return self._new(self.ids[~_in_sorted(self.ids, self._other_ids(other))])
+
+    def complement(self):
+        """
+        Ids in the reference data that are not in this result
+        """
+        universe = self._universe()
+        ids = self.ids[_in_sorted(self.ids, universe)]
+        bitmap = np.ones(len(universe), dtype=bool)
+        bitmap[np.searchsorted(universe, ids)] = False
+        return self._new(universe[bitmap])
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __invert__ = complement
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __contains__(self, n):
+        return bool(_in_sorted(np.asarray([n]), self.ids)[0])
+
+    def __eq__(self, other):
+        if not isinstance(other, ResultSet):
+            return NotImplemented
+        return np.array_equal(self.ids, other.ids)
+
+    def __repr__(self):
+        sup = super().__repr__().rstrip(">")
+        return f"{sup} ({len(self)} results)>"
+
+    def mask(self):
+        """
+        Boolean index over the rows of the reference data
+        """
+        if self.reference is None:
+            raise NoReferenceCorpus("No reference data to get result rows from.")
+        return _in_sorted(self.reference["_n"].values, self.ids)
+
+    def collect(self):
+        """
+        Materialise the matching rows as a Dataset
+        """
+        return self.reference[self.mask()]
+
+    def table(self, *args, **kwargs):
+        """
+        Make a frequency table from the matching rows
+        """
+        return self.collect().table(*args, **kwargs)
+
+    def conc(self, *args, **kwargs):
+        """
+        Make a concordance from the matching rows
+        """
+        corpus = getattr(self.reference, "reference", None)
+        kwargs.setdefault("reference", self.reference if corpus is None else corpus)
+        return self.collect().conc(*args, **kwargs)
@@ -138,7 +138,7 @@ class Searcher(object):
         position_data = None
         if multiword:
             bool_ix, position_data = _bool_ix_for_multiword(df, bool_ix, multiword)
-            bool_ix = list(bool_ix.values)
+            bool_ix = list(bool_ix)
         # get just the lines matching the bool ix
         return bool_ix, position_data
 
@@ -196,7 +196,7 @@ class Searcher(object):
             if self.target == "d":
                 depg, position_data = self._depgrep_iteration(piece, query, position=position, multiword=multiword)
                 res = piece[depg] if not inverse else piece[~depg]
-                if position_data:
+                if position_data is not None:
                     res["_position"] = position_data
             elif self.target == "t":
                 gram_ser = self._tgrep_iteration(piece)
@@ -0,0 +1,345 @@
+"""
+buzz: nearest-neighbour search over sentence vectors
+
+Every sentence gets a unit-length float32 vector, made from its tf-idf row
+(randomly projected down to a fixed size) or from spaCy. Exact search scores
+blocks of sentences with one matrix product each; approximate search uses
+random-hyperplane hashing to pick candidates, and scores only those.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .utils import _get_nlp, _sentence_ids
+
+# sentences scored or encoded at once
+BLOCK_SIZE = 100_000
+
+
+def _unit(vectors):
+    """
+    Scale rows to unit length, as float32
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def _sentence_keys(df):
+    """
+    (file, s) of every sentence in df, in order, and the row each one starts on
+    """
+    sents = _sentence_ids(df)
+    firsts = np.zeros(0, dtype=int)
+    if len(df):
+        firsts = np.flatnonzero(np.r_[True, sents[1:] != sents[:-1]])
+    files = df.index.get_level_values("file")[firsts]
+    numbers = df.index.get_level_values("s")[firsts]
+    return pd.MultiIndex.from_arrays([files, numbers], names=["file", "s"]), firsts
+
+
+def _projection(size, dims, seed=0):
+    """
+    Random Gaussian projection from size dimensions down to dims
+    """
+    rng = np.random.RandomState(seed)
+    return (rng.standard_normal((size, dims)) / np.sqrt(dims)).astype(np.float32)
+
+
+def _top_k(scores, k):
+    """
+    Positions of the k highest scores, best first
+    """
+    k = min(k, len(scores))
+    if not k:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="mergesort")]
+
+
+def _tfidf_encoder(df, show, dims, seed=0):
+    """
+    Tf-idf model of the sentences of df, and a function from its rows to vectors
+    """
+    df.tfidf_by(None, show=show)
+    model = df._tfidf[(None, tuple(show))]
+    size = len(model.vocab)
+    project = _projection(size, dims, seed) if size > dims else None
+
+    def encode(rows):
+        rows = rows.astype(np.float32)
+        return rows @ project if project is not None else rows.toarray()
+
+    return model, encode
+
+
+def _text_encoder(model, encode):
+    """
+    Text to vector, through the tf-idf model and projection
+    """
+
+    def encoder(text):
+        return _unit(encode(model.transform_text(text)))[0]
+
+    return encoder
+
+
+def _spacy_encoder(language):
+    """
+    Text to spaCy vector, getting the model the first time it is needed
+    """
+
+    def nlp():
+        model = _get_nlp(language=language)
+        return model, [i for i in ["parser", "ner"] if i in model.pipe_names]
+
+    def encoder(text):
+        model, disable = nlp()
+        return _unit(model(text, disable=disable).vector)
+
+    encoder.nlp = nlp
+    return encoder
+
+
+def _vector_sum(texts, nlp, disable=[], batch_size=1000):
+    """
+    Sum of the token vectors in texts, and how many tokens there were
+
+    Texts are streamed through nlp.pipe, so only one batch is parsed at once.
+    A doc's vector is the mean of its tokens', so each counts len(doc) times.
+    """
+    total, count = 0.0, 0
+    for doc in nlp.pipe(texts, batch_size=batch_size, disable=disable):
+        total = total + np.asarray(doc.vector, dtype=np.float64) * len(doc)
+        count += len(doc)
+    return np.asarray(total), count
+
+
+def _mean_vector(total, count):
+    return total / count if count else np.zeros(np.shape(total))
+
+
+def _document_vector(df, language="en", batch_size=1000):
+    """
+    Mean token vector of every sentence in df, kept on df and in its model store
+    """
+    from .store import _fingerprint
+
+    if df._vectors is None:
+        df._vectors = dict()
+    if language in df._vectors:
+        return df._vectors[language]
+    cache = None
+    if df._store is not None:
+        name = f"vector-{language}-{_fingerprint(df, None, ['text'])}.npy"
+        cache = os.path.join(df._store.path, name)
+    if cache is not None and os.path.isfile(cache):
+        vector = np.load(cache)
+    else:
+        nlp, disable = _spacy_encoder(language).nlp()
+        _, firsts = _sentence_keys(df)
+        texts = (str(i) for i in df["text"].values[firsts])
+        vector = _mean_vector(*_vector_sum(texts, nlp, disable, batch_size))
+        if cache is not None:
+            try:
+                os.makedirs(os.path.dirname(cache), exist_ok=True)
+                np.save(cache, vector)
+            except OSError:
+                pass
+    df._vectors[language] = vector
+    return vector
+
+
+class SentenceIndex(object):
+    """
+    Unit vectors for every sentence, searchable by cosine similarity
+
+    encoder turns a text string into a vector; it is set when the index is
+    built or loaded for a Dataset, and is not saved.
+    """
+
+    def __init__(self, vectors, keys, encoder=None, n_bits=16, n_tables=8, seed=0):
+        self.vectors = vectors
+        self.keys = keys
+        self.encoder = encoder
+        self.n_bits = n_bits
+        self.n_tables = n_tables
+        self.seed = seed
+        self._tables = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return f"<SentenceIndex: {len(self)} sentences, {self.vectors.shape[1]} dimensions>"
+
+    @classmethod
+    def from_tfidf(cls, df, show=["w"], dims=256, seed=0):
+        """
+        Sentence vectors from tf-idf rows, projected to dims when the vocabulary is bigger
+        """
+        model, encode = _tfidf_encoder(df, show, dims, seed=seed)
+        features = model.transform_dataset(df)
+        starts = range(0, features.shape[0], BLOCK_SIZE)
+        blocks = [encode(features[i : i + BLOCK_SIZE]) for i in starts]
+        vectors = _unit(np.vstack(blocks) if blocks else np.zeros((0, min(len(model.vocab), dims))))
+        keys, _ = _sentence_keys(df)
+        return cls(vectors, keys, encoder=_text_encoder(model, encode), seed=seed)
+
+    @classmethod
+    def from_spacy(cls, df, language="en", batch_size=1000):
+        """
+        Sentence vectors from spaCy, streaming the sentences through nlp.pipe
+        """
+        encoder = _spacy_encoder(language)
+        keys, firsts = _sentence_keys(df)
+        texts = df["text"].values[firsts]
+        nlp, disable = encoder.nlp()
+        docs = nlp.pipe(texts, batch_size=batch_size, disable=disable)
+        vectors = _unit(np.array([doc.vector for doc in docs], dtype=np.float32))
+        return cls(vectors, keys, encoder=encoder)
+
+    def save(self, path):
+        """
+        Store the index in a folder: vectors as .npy, keys as json
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), np.asarray(self.vectors, dtype=np.float32))
+        keys = [[str(f), int(s)] for f, s in self.keys]
+        settings = dict(n_bits=self.n_bits, n_tables=self.n_tables, seed=self.seed)
+        with open(os.path.join(path, "keys.json"), "w") as fo:
+            json.dump(dict(settings, keys=keys), fo)
+
+    @classmethod
+    def load(cls, path, encoder=None):
+        """
+        Load an index stored with SentenceIndex.save, vectors memory-mapped
+        """
+        with open(os.path.join(path, "keys.json")) as fo:
+            meta = json.load(fo)
+        keys = pd.MultiIndex.from_tuples([tuple(i) for i in meta.pop("keys")], names=["file", "s"])
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        return cls(vectors, keys, encoder=encoder, **meta)
+
+    def _hash(self, vectors, planes):
+        """
+        One bucket number per vector, from the side of each hyperplane it is on
+        """
+        bits = (vectors @ planes.T) > 0
+        return bits.astype(np.int64) @ (1 << np.arange(planes.shape[0], dtype=np.int64))
+
+    def _build_tables(self):
+        """
+        For each hash table: hyperplanes, and sentence rows sorted by bucket
+        """
+        rng = np.random.RandomState(self.seed + 1)
+        tables = list()
+        for _ in range(self.n_tables):
+            planes = rng.standard_normal((self.n_bits, self.vectors.shape[1])).astype(np.float32)
+            blocks = range(0, len(self), BLOCK_SIZE)
+            buckets = [self._hash(self.vectors[i : i + BLOCK_SIZE], planes) for i in blocks]
+            buckets = np.concatenate(buckets) if buckets else np.zeros(0, dtype=np.int64)
+            order = np.argsort(buckets, kind="mergesort")
+            tables.append((planes, buckets[order], order))
+        self._tables = tables
+
+    def _candidates(self, vector):
+        """
+        Rows that share a bucket with vector in any table
+        """
+        if self._tables is None:
+            self._build_tables()
+        found = list()
+        for planes, buckets, order in self._tables:
+            bucket = self._hash(vector[None, :], planes)[0]
+            lo, hi = np.searchsorted(buckets, [bucket, bucket + 1])
+            found.append(order[lo:hi])
+        return np.unique(np.concatenate(found))
+
+    def search(self, vector, k=20, approximate=False):
+        """
+        Rows of the k sentences most similar to vector, and their similarities
+        """
+        vector = _unit(vector)
+        if approximate:
+            rows = self._candidates(vector)
+            # too few candidates: fall back to scoring everything
+            if len(rows) >= k:
+                scores = np.asarray(self.vectors[rows] @ vector)
+                top = _top_k(scores, k)
+                return rows[top], scores[top]
+        best_rows, best_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        for start in range(0, len(self), BLOCK_SIZE):
+            scores = np.asarray(self.vectors[start : start + BLOCK_SIZE] @ vector)
+            top = _top_k(scores, k)
+            best_rows = np.r_[best_rows, top + start]
+            best_scores = np.r_[best_scores, scores[top]]
+            keep = _top_k(best_scores, k)
+            best_rows, best_scores = best_rows[keep], best_scores[keep]
+        return best_rows, best_scores
+
+
+def _sentence_index(df, by="tfidf", show=["w"], dims=256, language="en", batch_size=1000):
+    """
+    Build a SentenceIndex for df, or load it from df's model store
+    """
+    from .store import _fingerprint
+
+    if by not in {"tfidf", "spacy"}:
+        raise ValueError(f"Sentence vectors can be made by tfidf or spacy, not {by}")
+    folder = None
+    if df._store is not None:
+        what = "_".join(show) if by == "tfidf" else language
+        name = f"sentences-{by}-{what}-{dims}-{_fingerprint(df, None, show)}"
+        folder = os.path.join(df._store.path, name)
+        if os.path.isfile(os.path.join(folder, "keys.json")):
+            if by == "tfidf":
+                encoder = _text_encoder(*_tfidf_encoder(df, show, dims))
+            else:
+                encoder = _spacy_encoder(language)
+            return SentenceIndex.load(folder, encoder=encoder)
+    if by == "tfidf":
+        index = SentenceIndex.from_tfidf(df, show=show, dims=dims)
+    else:
+        index = SentenceIndex.from_spacy(df, language=language, batch_size=batch_size)
+    if folder is not None:
+        try:
+            index.save(folder)
+        except OSError:
+            pass
+    return index
+
+
+def _most_similar(df, index, query, k=20, approximate=False):
+    """
+    The k sentences of df most like query: a text string, a (file, s) key, or
+    a Dataset of one or more sentences, whose own sentences are left out
+    """
+    exclude = list()
+    if isinstance(query, str):
+        if index.encoder is None:
+            raise ValueError("This sentence index cannot encode text: rebuild it for a Dataset")
+        vector = index.encoder(query)
+    elif isinstance(query, tuple):
+        exclude = [index.keys.get_loc(query)]
+        vector = index.vectors[exclude[0]]
+    else:
+        keys, firsts = _sentence_keys(query)
+        exclude = [i for i in index.keys.get_indexer(keys) if i >= 0]
+        if exclude:
+            vector = np.asarray(index.vectors[exclude]).mean(axis=0)
+        else:
+            # sentences from elsewhere: encode their text
+            vector = index.encoder(" ".join(query["text"].values[firsts]))
+    rows, scores = index.search(vector, k=k + len(exclude), approximate=approximate)
+    keep = ~np.isin(rows, exclude)
+    rows, scores = rows[keep][:k], scores[keep][:k]
+    out = pd.DataFrame(dict(similarity=scores), index=index.keys[rows])
+    if "text" in df.columns:
+        keys, firsts = _sentence_keys(df)
+        texts = pd.Series(df["text"].values[firsts], index=keys)
+        out.insert(0, "text", texts.reindex(out.index).values)
+    return out
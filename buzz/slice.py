@@ -17,19 +17,28 @@ You can string these together however you like:
 
 corpus.just.speaker.MOOKIE.skip.xpos.PUNCT.see.lemma.by.wordclass
 
+Each step above filters straight away. To build the chain as a lazy plan, run
+once (per file, for unloaded corpora) when a table/conc/len is needed, use:
+
+corpus.lazy.just.speaker.MOOKIE.skip.xpos.PUNCT.see.lemma.by.wordclass
+
 """
 
 from abc import ABC, abstractmethod
 
+import numpy as np
 import pandas as pd
 
 from .exceptions import DataTypeError
+from .results import ResultSet
 from .search import Searcher
 from .utils import (
     _ensure_list_of_short_names,
     _get_short_name_from_long_name,
     _order_df_columns,
     _bool_ix_for_multiword,
+    _category_labels,
+    _get_categorical,
     _get_tqdm,
     _tqdm_update,
     _tqdm_close
@@ -97,21 +106,51 @@ class Filter(object):
             return entry
         return entry.casefold()
 
-    def _make_bool_index(self, entry, strung, exact_match, multiword, **kwargs):
+    @staticmethod
+    def _match_strung(entry, strung, exact_match, **kwargs):
         """
         Get a boolean index of matches for this entry over strung
         """
         if isinstance(entry, (int, float)):
-            return strung == entry, None
+            return strung == entry
         if isinstance(entry, (set, list)):
             if exact_match or not isinstance(list(entry)[0], str):
-                return strung.isin(entry), None
-            return strung.apply(lambda x: any(i in x for i in entry)), None
+                return strung.isin(entry)
+            return strung.apply(lambda x: any(i in x for i in entry))
         if not kwargs.get("regex") and exact_match:
-            return strung == entry, None
+            return strung == entry
         search_method = strung.str.match if exact_match else strung.str.contains
         kwargs = {k: v for k, v in kwargs.items() if k in {"regex", "case", "flags", "na"}}
-        bool_ix = search_method(entry, **kwargs)
+        return search_method(entry, **kwargs)
+
+    def _categorical_for(self, entry):
+        """
+        If we can match entry once per category rather than once per row, get the
+        pd.Categorical to match against. Otherwise, None
+        """
+        first = list(entry)[0] if isinstance(entry, (list, set, tuple)) else entry
+        if not isinstance(first, str):
+            return
+        return _get_categorical(self._corpus, self.column)
+
+    def _make_bool_index(self, entry, case, exact_match, multiword, **kwargs):
+        """
+        Get a boolean index of matches for this entry over the column
+
+        For categorical columns, the test is run once per category, and the
+        category hits are then looked up by each row's code
+        """
+        categorical = self._categorical_for(entry)
+        if categorical is not None:
+            labels = _category_labels(categorical, self.column, case=case)
+            normed = self._normalise_entry(entry, case)
+            hits = self._match_strung(normed, labels, exact_match, **kwargs)
+            # missing values have code -1, which looks up the final "nan" label
+            bool_ix = hits.values.astype(bool)[categorical.codes]
+        else:
+            strung = self._make_column_to_match_against(case, entry)
+            normed = self._normalise_entry(entry, case)
+            bool_ix = self._match_strung(normed, strung, exact_match, **kwargs)
         if multiword:
             bool_ix, new_ser = _bool_ix_for_multiword(self._corpus, bool_ix, multiword)
         else:
@@ -160,17 +199,16 @@ class Filter(object):
         if result is not None:
             if not self.inverse:
                 return result
-            return self._corpus[~self._corpus["_n"].isin(result["_n"])]
+            found = ResultSet.from_dataset(result, reference=self._corpus)
+            return found.complement().collect()
 
-        strung = self._make_column_to_match_against(case, entry)
-        entry = self._normalise_entry(entry, case)
-        bool_ix, new_ser = self._make_bool_index(entry, strung, exact_match, multiword, **kwargs)
+        bool_ix, new_ser = self._make_bool_index(entry, case, exact_match, multiword, **kwargs)
 
         if self.inverse:
             bool_ix = ~bool_ix
 
         out = self._corpus[bool_ix]
-        if new_ser:
+        if new_ser is not None:
             out["_position"] = new_ser
         return out
 
@@ -339,16 +377,18 @@ class Nearby(Filter):
         if not from_reference:
             self._corpus["_n"] = range(len(self._corpus))
         matches = super().__call__(entry, case=case, exact_match=exact_match, **kwargs)
-        nears = dict()
-        for n in matches["_n"]:
-            start = max([0, n - distance])
-            end = min([n + distance + 1, len(self._corpus.reference)])
-            for i in range(start, end):
-                if i != n:
-                    nears[i] = i - n
         ref = self._corpus.reference if from_reference else self._corpus
-        out = ref.iloc[sorted(list(nears))]
-        out["_position"] = [v for k, v in sorted(nears.items())]
+        offsets = np.arange(-distance, distance + 1)
+        offsets = offsets[offsets != 0]
+        window = matches["_n"].values[:, None] + offsets
+        valid = (window >= 0) & (window < len(ref))
+        rows = window[valid]
+        positions = np.broadcast_to(offsets, window.shape)[valid]
+        # where windows overlap, the later match decides the position
+        rows, positions = rows[::-1], positions[::-1]
+        rows, first = np.unique(rows, return_index=True)
+        out = ref.iloc[rows]
+        out["_position"] = positions[first]
         self._corpus["_n"] = store_n
         return out
 
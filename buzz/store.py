@@ -0,0 +1,145 @@
+"""
+buzz: on-disk store of fitted tf-idf models
+
+Each model is a folder of .npy arrays plus a small json file describing it.
+Arrays are loaded memory-mapped, so many processes (e.g. web workers) can
+score text against the same model without refitting or copying it.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from .tfidf import TfidfModel, _tfidf_model
+
+# arrays that make up a TfidfModel, besides the sparse matrices
+ARRAYS = ["vocab", "idf", "bin_ids"]
+MATRICES = ["matrix", "centroids"]
+
+
+def _fingerprint(df, column, show):
+    """
+    Short hash of the rows, bins and shown values of df, to tell data apart
+    """
+    cols = [i for i in [column] + list(show) if i and i in df.columns]
+    digest = hashlib.sha1()
+    digest.update(pd.util.hash_pandas_object(df.index).values.tobytes())
+    if cols:
+        digest.update(pd.util.hash_pandas_object(df[cols], index=False).values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+class ModelStore(object):
+    """
+    Fitted models kept in a folder, keyed by column, show, n_top_members and
+    a fingerprint of the data they were fitted on
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+
+    def __repr__(self):
+        return f"<ModelStore at {self.path}: {len(self.models())} models>"
+
+    def _folder(self, column, show, n_top_members, fingerprint):
+        name = "-".join([str(column), "_".join(show), str(n_top_members), fingerprint])
+        return os.path.join(self.path, re.sub(r"[^\w.-]", "_", name))
+
+    def models(self):
+        """
+        Description of every stored model, newest first
+        """
+        if not os.path.isdir(self.path):
+            return list()
+        out = list()
+        for name in os.listdir(self.path):
+            meta = os.path.join(self.path, name, "model.json")
+            if os.path.isfile(meta):
+                with open(meta) as fo:
+                    out.append(dict(json.load(fo), folder=os.path.join(self.path, name)))
+        return sorted(out, key=lambda i: os.path.getmtime(i["folder"]), reverse=True)
+
+    def save(self, model, n_top_members=-1, fingerprint=""):
+        """
+        Write model to the store, returning its folder
+        """
+        folder = self._folder(model.column, model.show, n_top_members, fingerprint)
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, "vocab.npy"), np.asarray(model.vocab, dtype=str))
+        np.save(os.path.join(folder, "idf.npy"), model.idf)
+        np.save(os.path.join(folder, "bin_ids.npy"), model.bin_ids)
+        for name in MATRICES:
+            matrix = getattr(model, name)
+            for part in ["data", "indices", "indptr"]:
+                np.save(os.path.join(folder, f"{name}.{part}.npy"), getattr(matrix, part))
+        meta = dict(
+            column=model.column,
+            show=model.show,
+            n_top_members=n_top_members,
+            fingerprint=fingerprint,
+            bins=[i.item() if hasattr(i, "item") else i for i in model.bins],
+            shape=list(model.matrix.shape),
+        )
+        # json last: a folder without it is an unfinished save
+        with open(os.path.join(folder, "model.json"), "w") as fo:
+            json.dump(meta, fo)
+        return folder
+
+    def load(self, folder):
+        """
+        Load the model in folder, with its arrays memory-mapped
+        """
+        with open(os.path.join(folder, "model.json")) as fo:
+            meta = json.load(fo)
+        arrays = {i: np.load(os.path.join(folder, f"{i}.npy"), mmap_mode="r") for i in ARRAYS}
+        shapes = dict(matrix=tuple(meta["shape"]), centroids=(len(meta["bins"]), meta["shape"][1]))
+        matrices = dict()
+        for name in MATRICES:
+            parts = []
+            for part in ["data", "indices", "indptr"]:
+                path = os.path.join(folder, f"{name}.{part}.npy")
+                parts.append(np.load(path, mmap_mode="r"))
+            matrices[name] = csr_matrix(tuple(parts), shape=shapes[name], copy=False)
+        return TfidfModel(
+            arrays["vocab"],
+            arrays["idf"],
+            meta["bins"],
+            matrices["matrix"],
+            arrays["bin_ids"],
+            show=meta["show"],
+            column=meta["column"],
+            centroids=matrices["centroids"],
+        )
+
+    def latest(self, column, show=["w"], n_top_members=-1):
+        """
+        Newest stored model for column and show, whatever data it came from
+
+        For scoring new text without the corpus, e.g. in a web worker
+        """
+        for meta in self.models():
+            same = meta["column"] == column and meta["show"] == list(show)
+            if same and meta["n_top_members"] == n_top_members:
+                return self.load(meta["folder"])
+        raise KeyError(f"No stored model for {column} showing {show}")
+
+    def get(self, df, column, show=["w"], n_top_members=-1):
+        """
+        Stored model for this data if there is one, otherwise fit and store it
+        """
+        fingerprint = _fingerprint(df, column, show)
+        folder = self._folder(column, show, n_top_members, fingerprint)
+        if os.path.isfile(os.path.join(folder, "model.json")):
+            return self.load(folder)
+        model = _tfidf_model(df, column, n_top_members=n_top_members, show=show)
+        try:
+            self.save(model, n_top_members=n_top_members, fingerprint=fingerprint)
+        except OSError:
+            # read-only corpus folder: keep the model in memory only
+            pass
+        return model
@@ -1,6 +1,7 @@
+import numpy as np
 import pandas as pd
 
-from .views import _sort, _tabview
+from .views import _sort, _tabview, _trend_stats
 
 
 class Table(pd.DataFrame):
@@ -34,6 +35,12 @@ class Table(pd.DataFrame):
         """
         return _sort(self, by=by, keep_stats=keep_stats, remove_above_p=remove_above_p)
 
+    def stats(self):
+        """
+        Slope, intercept, r, p and stderr of each column against row number
+        """
+        return _trend_stats(self.values, self.columns)
+
     def plot(self, *args, **kwargs):
         """
         Visualise this table
@@ -94,3 +101,160 @@ class Table(pd.DataFrame):
         from .views import _keyness
 
         return _keyness(self, keyness, reference=reference)
+
+
+class SparseTable(object):
+    """
+    A frequency table held as a scipy CSR matrix, for very large vocabularies
+
+    Rows are subcorpora and columns are matches, as in Table. Only cells with
+    a count are stored; to_dense() makes a regular Table for display/plotting.
+    """
+
+    def __init__(self, matrix, index, columns, reference=None):
+        from scipy.sparse import csr_matrix
+
+        self.matrix = csr_matrix(matrix)
+        self.index = index
+        self.columns = columns
+        self._reference = reference
+
+    def _new(self, matrix, index=None, columns=None):
+        index = self.index if index is None else index
+        columns = self.columns if columns is None else columns
+        return SparseTable(matrix, index, columns, reference=self._reference)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def __repr__(self):
+        sup = super().__repr__().rstrip(">")
+        return f"{sup} ({self.shape[0]} x {self.shape[1]}, {self.matrix.nnz} non-zero)>"
+
+    def to_dense(self):
+        """
+        Make a regular Table from this one
+        """
+        dense = pd.DataFrame(self.matrix.toarray(), index=self.index, columns=self.columns)
+        return Table(dense, reference=self._reference)
+
+    def sum(self, axis=0):
+        """
+        Totals for each column (axis=0) or each row (axis=1)
+        """
+        totals = np.asarray(self.matrix.sum(axis=axis)).ravel()
+        return pd.Series(totals, index=self.columns if axis == 0 else self.index)
+
+    def _reorder(self, order):
+        return self._new(self.matrix[:, order], columns=self.columns[order])
+
+    def stats(self):
+        """
+        Slope, intercept, r, p and stderr of each column against row number
+        """
+        return _trend_stats(self.matrix, self.columns)
+
+    def sort(self, by="total", remove_above_p=False):
+        """
+        Sort columns: (total/infreq), (increase/decrease), (static/turbulent), (name/reverse)
+
+        remove_above_p drops columns whose slope has a higher p value than this
+        """
+        by = {"most": "total", True: "total", "least": "infreq"}.get(by, by)
+        stats = None
+        if by in {"increase", "decrease", "static", "turbulent"} or remove_above_p:
+            stats = self.stats()
+        if by in {"total", "infreq"}:
+            totals = self.sum().values
+            order = np.argsort(-totals if by == "total" else totals, kind="mergesort")
+        elif by == "name":
+            order = np.argsort(np.asarray(self.columns, dtype=str), kind="mergesort")
+        elif by == "reverse":
+            order = np.arange(self.shape[1])[::-1]
+        elif by in {"increase", "decrease", "static", "turbulent"}:
+            slopes = stats["slope"].values
+            key = dict(increase=-slopes, decrease=slopes, static=np.abs(slopes))
+            order = np.argsort(key.get(by, -np.abs(slopes)), kind="mergesort")
+        else:
+            raise ValueError(f"Sparse tables cannot be sorted by {by}")
+        if stats is not None and remove_above_p:
+            order = order[stats["p"].values[order] <= remove_above_p]
+        return self._reorder(order)
+
+    def top(self, n=10):
+        """
+        Keep just the n columns with the highest totals
+        """
+        totals = self.sum().values
+        n = min(n, len(totals))
+        top = np.argpartition(-totals, n - 1)[:n] if n else np.zeros(0, dtype=int)
+        top = top[np.argsort(-totals[top], kind="mergesort")]
+        return self._reorder(top)
+
+    def square(self, n=10):
+        """
+        Restrict both rows and columns
+        """
+        return self._new(self.matrix[:n, :n], index=self.index[:n], columns=self.columns[:n])
+
+    def relative(self, denom=None):
+        """
+        Give a relative frequency version of this table
+        """
+        from scipy.sparse import diags
+        from .dataset import Dataset
+
+        if denom is True or denom is None:
+            denom = self.sum(axis=1)
+        elif isinstance(denom, Dataset):
+            subcorpora = list(self.index.names)
+            denom = denom.table(subcorpora=subcorpora, sparse=True).sum(axis=1)
+        elif isinstance(denom, (Table, SparseTable)):
+            denom = denom.sum(axis=1)
+        denom = np.asarray(denom.reindex(self.index).values, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.where(denom == 0, 0.0, 100.0 / denom)
+        return self._new(diags(scale) @ self.matrix)
+
+    def keyness(self, keyness, reference=None, block_size=1000):
+        """
+        Keywords for each subcorpus, worked out a block of rows at a time
+
+        Only words that occur in a subcorpus get a score there, the same score
+        as in Table.keyness. Absent words stay empty rather than filling the
+        whole matrix, so their negative keyness is not shown.
+        """
+        from .views import _reference_counts, _vector_keyness
+
+        if reference is None:
+            print("Warning: no reference corpus supplied. Using result frame as reference corpus")
+            reference = self.sum()
+        ref_counts, ref_sum = _reference_counts(reference, self.columns)
+        row_sums = np.asarray(self.matrix.sum(axis=1)).ravel()
+        matrix = self.matrix.astype(float)
+        indptr = matrix.indptr
+        for start in range(0, self.shape[0], block_size):
+            end = min(start + block_size, self.shape[0])
+            # in CSR, the cells of a block of rows are one slice of .data
+            lo, hi = indptr[start], indptr[end]
+            rows = np.repeat(np.arange(start, end), np.diff(indptr[start : end + 1]))
+            refs = ref_counts[matrix.indices[lo:hi]]
+            matrix.data[lo:hi] = _vector_keyness(
+                keyness, matrix.data[lo:hi], refs, row_sums[rows], ref_sum
+            )
+        out = self._new(matrix)
+        order = np.argsort(-np.asarray(abs(matrix).sum(axis=0)).ravel(), kind="mergesort")
+        return out._reorder(order)
+
+    def view(self, *args, **kwargs):
+        return self.to_dense().view(*args, **kwargs)
+
+    def plot(self, *args, **kwargs):
+        return self.to_dense().plot(*args, **kwargs)
+
+    def chart(self, *args, **kwargs):
+        return self.to_dense().chart(*args, **kwargs)
@@ -1,56 +1,117 @@
-from collections import Counter, defaultdict
+"""
+buzz: tf-idf models of the sentences in each bin of a metadata column
 
+All sentences go into one sparse sentence x term matrix, built straight from
+integer codes. Idf is worked out once over every sentence, so all bins share
+one vocabulary and can be compared directly.
+"""
+
+import re
+from collections import Counter
+
+import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
+from scipy.sparse import coo_matrix, csr_matrix, diags
 
-from .utils import _get_tqdm, _make_match_col, _tqdm_close, _tqdm_update
+from .utils import (
+    _codes_and_labels,
+    _get_tqdm,
+    _make_match_col,
+    _sentence_ids,
+    _tqdm_close,
+    _tqdm_update,
+)
 
 tqdm = _get_tqdm()
 
+# for plain text input: words, or runs of punctuation
+TOKEN = re.compile(r"\w+|[^\w\s]+")
+
+
+# sentences scored at once, to bound the size of the dense score block
+CHUNK_SIZE = 100_000
+
 
-def _tfidf_prototypical(df, column, show, n_top_members=-1, only_correct=True, top=-1):
+def _top_per_bin(bins, scores, top):
+    """
+    Positions of the top scores within each bin, best first, bins in order
+    """
+    out = list()
+    for binn in np.unique(bins):
+        members = np.flatnonzero(bins == binn)
+        if len(members) > top:
+            members = members[np.argpartition(-scores[members], top - 1)[:top]]
+        out.append(members[np.argsort(-scores[members], kind="mergesort")])
+    return np.concatenate(out) if out else np.zeros(0, dtype=np.int64)
+
+
+def _tfidf_prototypical(
+    df, column, show, n_top_members=-1, only_correct=True, top=-1, chunk_size=CHUNK_SIZE
+):
     """
     Get prototypical instances over bins segmented by column
+
+    Every sentence is scored against every bin with one sparse product per
+    chunk of sentences: (sentences x terms) . (terms x bins)
     """
     if not isinstance(show, list):
         show = [show]
 
     # make the language models
-    if (column, tuple(show)) not in df._tfidf:
+    if (column, tuple(show)) not in (df._tfidf or dict()):
         df.tfidf_by(column, show=show, n_top_members=n_top_members)
+    model = df._tfidf[(column, tuple(show))]
 
     if n_top_members > 0:
         top_members = list(getattr(df, column).value_counts().index[:n_top_members])
         df = df[getattr(df, column).isin(top_members)]
 
-    df["_formatted"] = _make_match_col(df, show, preserve_case=False)
-
-    index = list()
-    results = list()
-
-    groupby = df.groupby(column)
-
-    kwa = dict(ncols=120, unit="bin", desc="Scoring against models", total=len(groupby))
-    t = tqdm(**kwa) if len(groupby) > 1 else None
-
-    for _column_value, df_by_attr in groupby:
-        for fsi, sent in df_by_attr.groupby(level=["file", "s"]):
-            # note, the actions below are probably done twice. bad.
-            text = sent.iloc[0].text
-            form = " ".join(sent["_formatted"])
-            scores = df.tfidf_score(column, show, sent)
-            if column in sent.columns:
-                actual = getattr(sent.iloc[0], column)
-            else:
-                actual = sent.index.get_level_values(column)[0]
-            for binn, score in scores.items():
-                if only_correct and binn != actual:
-                    continue
-                index.append((fsi[0], fsi[1], form, text, actual, binn))
-                results.append(score)
-
+    features = model.transform_dataset(df)
+    sents = _sentence_ids(df)
+    firsts = np.flatnonzero(np.r_[True, sents[1:] != sents[:-1]])
+    values = df[column] if column in df.columns else df.index.get_level_values(column)
+    actual = model.bins.get_indexer(np.asarray(values)[firsts])
+    # sentences by bin, then in corpus order, as the bins are grouped
+    order = np.argsort(np.where(actual < 0, len(model.bins), actual), kind="mergesort")
+    order = order[actual[order] >= 0]
+
+    chunks = range(0, len(order), chunk_size)
+    kwa = dict(ncols=120, unit="chunk", desc="Scoring against models", total=len(chunks))
+    t = tqdm(**kwa) if len(chunks) > 1 else None
+    sent_ix, bin_ix, results = list(), list(), list()
+    for start in chunks:
+        chunk = order[start : start + chunk_size]
+        scored = model.score(features[chunk])
+        if only_correct:
+            sent_ix.append(chunk)
+            bin_ix.append(actual[chunk])
+            results.append(scored[np.arange(len(chunk)), actual[chunk]])
+        else:
+            sent_ix.append(np.repeat(chunk, len(model.bins)))
+            bin_ix.append(np.tile(np.arange(len(model.bins)), len(chunk)))
+            results.append(scored.ravel())
         _tqdm_update(t)
     _tqdm_close(t)
+    empty = np.zeros(0, dtype=np.int64)
+    sent_ix = np.concatenate(sent_ix) if sent_ix else empty
+    bin_ix = np.concatenate(bin_ix) if bin_ix else empty
+    results = np.concatenate(results) if results else np.zeros(0)
+
+    # for top, keep the best sentences for each bin before formatting anything
+    if top >= 1:
+        keep = _top_per_bin(bin_ix, results, top)
+        sent_ix, bin_ix, results = sent_ix[keep], bin_ix[keep], results[keep]
+
+    # format just the sentences that are being returned
+    formatted = _make_match_col(df, show, preserve_case=False).values
+    bounds = np.r_[firsts, len(df)]
+    forms = [" ".join(formatted[bounds[i] : bounds[i + 1]]) for i in sent_ix]
+    rows = firsts[sent_ix]
+    files = df.index.get_level_values("file")[rows]
+    numbers = df.index.get_level_values("s")[rows]
+    texts = df["text"].values[rows]
+    actuals = model.bins[actual[sent_ix]]
+    guesses = model.bins[bin_ix]
 
     show = "/".join(show)
     names = ["file", "s", "text", "actual " + column, "guess " + column]
@@ -58,101 +119,181 @@ def _tfidf_prototypical(df, column, show, n_top_members=-1, only_correct=True, t
         names.insert(2, show)
     else:
         names.insert(2, "data")
-    index = pd.MultiIndex.from_tuples(index, names=names)
-    results = pd.Series(results, index=index)
+    arrays = [files, numbers, forms, texts, actuals, guesses]
     if only_correct:
-        try:
-            reset = results.reset_index()
-        except ValueError:
-            print("NAMES", names, results.index)
-            reset = results.drop(names, axis=0, errors="ignore").reset_index()
-        bool_ix = reset["guess " + column] == reset["actual " + column]
-        results = results[bool_ix.values]
-        results.index = results.index.droplevel(-1)
-        results.index.names = [i.replace("actual ", "") for i in results.index.names]
-    results.name = "similarity"
-    if top < 1:
-        return results
-
-    def _group_apply_sort_head(group):
-        return group.sort_values(ascending=False).head(top)
-
-    grouped = results.groupby(column, sort=False).apply(_group_apply_sort_head)
-    grouped.index = grouped.index.droplevel(-1)
-    return grouped
+        arrays, names = arrays[:-1], names[:-1]
+        names[-1] = column
+    # for top, the bin the sentences were picked for comes first instead of last
+    if top >= 1:
+        arrays, names = arrays[-1:] + arrays[:-1], names[-1:] + names[:-1]
+    index = pd.MultiIndex.from_arrays(arrays, names=names)
+    return pd.Series(results, index=index, name="similarity")
 
 
 def _tfidf_score(df, column, show, text):
+    """
+    Mean similarity of the sentences in text to each bin of the column's model
+    """
     key = (column, tuple(show))
-    if key not in df._tfidf:
+    if key not in (df._tfidf or dict()):
         df.tfidf_by(column, show=show)
+    model = df._tfidf[key]
 
-    scores = dict()
-    for k, (vec, features, show) in df._tfidf[key].items():
-        if isinstance(text, str):
-            if show != ["w"]:
-                err = f'Input text can only be string when vector is ["w"], not {show}'
-                raise ValueError(err)
-            sents = [text]
-        elif isinstance(text, list):
-            sents = text
-        else:
-            sents = list()
-            series = _make_match_col(text, show, preserve_case=False)
-            for _, sent in series.groupby(level=["file", "s"]):
-                sents.append(" ".join(sent))
-        new_features = vec.transform(sents)
-        scored = (features * new_features.T).A
-        scores[k] = scored
-        scores[k] = (sum(scored) / len(scored))[0]
-    return Counter(scores)
-
-
-def _tfidf_model(df, column, n_top_members=-1, show=["w"]):
+    if isinstance(text, (str, list)):
+        if show != ["w"]:
+            err = f'Input text can only be string when vector is ["w"], not {show}'
+            raise ValueError(err)
+        new_features = model.transform_text(text)
+    else:
+        new_features = model.transform_dataset(text)
+    scored = model.score(new_features)
+    return Counter(dict(zip(model.bins, scored.mean(axis=0))))
 
-    attr_sents = defaultdict(list)
-    sents = list()
 
-    if n_top_members > 0:
-        top_members = list(getattr(df, column).value_counts().index[:n_top_members])
-        df = df[getattr(df, column).isin(top_members)]
-
-    # get dict of attr: [list, of, sents]
-    df["_formatted"] = _make_match_col(df, show, preserve_case=False)
+def _normalise(matrix):
+    """
+    Scale every row of a sparse matrix to unit length
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    with np.errstate(divide="ignore"):
+        scale = np.where(norms == 0, 0.0, 1.0 / norms)
+    return csr_matrix(diags(scale) @ matrix)
 
-    groupby = (
-        df.groupby(column) if column else df["_formatted"].groupby(level=["file", "s"])
-    )
 
-    kwa = dict(
-        ncols=120, unit="bin", desc=f"Building {column} model", total=len(groupby)
-    )
-    t = tqdm(**kwa) if len(groupby) > 1 else None
+def _count_matrix(rows, terms, shape):
+    """
+    Sparse count of each term in each row
+    """
+    ones = np.ones(len(rows), dtype=float)
+    return csr_matrix(coo_matrix((ones, (rows, terms)), shape=shape))
 
-    if column:
-        for attr, df_by_attr in df.groupby(column):
-            for _, sent in df_by_attr.groupby(level=["file", "s"]):
-                attr_sents[attr].append(" ".join(sent["_formatted"]))
-            _tqdm_update(t)
 
-    else:
-        for _, sent in df["_formatted"].groupby(level=["file", "s"]):
-            sents.append(" ".join(sent))
-            _tqdm_update(t)
-        attr_sents["_base"] = sents
+class TfidfModel(object):
+    """
+    One tf-idf matrix for all sentences, with their bins
 
-    _tqdm_close(t)
+    Sentences are rows, ordered by bin, so each bin is a slice of rows. A bin's
+    centroid is the mean of its rows; the mean cosine similarity of a sentence
+    to the bin's sentences is its dot product with the centroid.
+    """
 
-    # for each database, make a vector
-    vectors = dict()
-    for attr, sents in attr_sents.items():
-        vec = TfidfVectorizer()
-        vec.fit(sents)
-        features = vec.transform(sents)
-        vectors[attr] = (vec, features, show)
+    def __init__(
+        self, vocab, idf, bins, matrix, bin_ids, show=["w"], column=None, centroids=None
+    ):
+        self.vocab = np.asarray(vocab, dtype=object)
+        self.idf = np.asarray(idf, dtype=float)
+        self.bins = pd.Index(bins)
+        self.matrix = matrix
+        self.bin_ids = np.asarray(bin_ids, dtype=np.int64)
+        self.show = list(show)
+        self.column = column
+        self.bin_starts = np.searchsorted(self.bin_ids, np.arange(len(self.bins) + 1))
+        if centroids is None:
+            sizes = np.diff(self.bin_starts)
+            with np.errstate(divide="ignore"):
+                weight = np.where(sizes == 0, 0.0, 1.0 / sizes)[self.bin_ids]
+            rows = np.arange(len(self.bin_ids))
+            shape = (len(self.bins), len(self.bin_ids))
+            centroids = csr_matrix((weight, (self.bin_ids, rows)), shape=shape) @ matrix
+        self.centroids = centroids
+        self._vocab_index = None
+
+    def __repr__(self):
+        return f"<TfidfModel of {self.column}: {len(self.bins)} bins, {len(self.vocab)} terms>"
+
+    @classmethod
+    def from_dataset(cls, df, column, n_top_members=-1, show=["w"]):
+        """
+        Build the sentence x term matrix from codes, weighting by idf once
+        """
+        if column and n_top_members > 0:
+            top_members = list(getattr(df, column).value_counts().index[:n_top_members])
+            df = df[getattr(df, column).isin(top_members)]
+
+        codes, vocab = _codes_and_labels(df, show, preserve_case=False)
+        sents = _sentence_ids(df)
+        if sents is None:
+            sents = np.zeros(len(df), dtype=np.int64)
+        firsts = np.flatnonzero(np.r_[True, sents[1:] != sents[:-1]]) if len(df) else sents
+
+        # the bin of each sentence is the value on its first token
+        if column:
+            values = df[column] if column in df.columns else df.index.get_level_values(column)
+            bin_ids, bins = pd.factorize(np.asarray(values)[firsts], sort=True)
+        else:
+            bin_ids, bins = np.zeros(len(firsts), dtype=np.int64), ["_base"]
+        # sentences without a bin are left out; the rest are ordered by bin
+        order = np.argsort(np.where(bin_ids < 0, len(bins), bin_ids), kind="mergesort")
+        order = order[bin_ids[order] >= 0]
+        new_row = np.full(len(firsts), -1, dtype=np.int64)
+        new_row[order] = np.arange(len(order))
+
+        rows = new_row[sents]
+        keep = rows >= 0
+        counts = _count_matrix(rows[keep], codes[keep], (len(order), len(vocab)))
+        doc_freq = np.bincount(counts.indices, minlength=len(vocab))
+        # smoothed idf, as in scikit-learn's TfidfVectorizer
+        idf = np.log((1 + len(order)) / (1 + doc_freq)) + 1
+        matrix = _normalise(counts @ diags(idf))
+        return cls(vocab, idf, bins, matrix, bin_ids[order], show=show, column=column)
+
+    def rows(self, binn):
+        """
+        The tf-idf rows of the sentences in one bin
+        """
+        i = self.bins.get_loc(binn)
+        return self.matrix[self.bin_starts[i] : self.bin_starts[i + 1]]
+
+    def _weigh(self, counts):
+        return _normalise(counts @ diags(self.idf))
+
+    def transform(self, sentences):
+        """
+        Tf-idf rows for sentences given as lists of terms; unknown terms are ignored
+        """
+        if self._vocab_index is None:
+            self._vocab_index = pd.Index(self.vocab)
+        lengths = np.array([len(sent) for sent in sentences], dtype=np.int64)
+        terms = [term for sent in sentences for term in sent]
+        terms = self._vocab_index.get_indexer(terms) if terms else np.zeros(0, dtype=np.int64)
+        rows = np.repeat(np.arange(len(sentences)), lengths)
+        keep = terms >= 0
+        counts = _count_matrix(rows[keep], terms[keep], (len(sentences), len(self.vocab)))
+        return self._weigh(counts)
+
+    def transform_text(self, sentences):
+        """
+        Tf-idf rows for plain text sentences, split into words and punctuation
+        """
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        return self.transform([TOKEN.findall(sent.lower()) for sent in sentences])
+
+    def transform_dataset(self, df):
+        """
+        Tf-idf rows for every sentence in df, formatted by this model's show
+        """
+        if self._vocab_index is None:
+            self._vocab_index = pd.Index(self.vocab)
+        codes, labels = _codes_and_labels(df, self.show, preserve_case=False)
+        terms = self._vocab_index.get_indexer(labels)[codes]
+        sents = _sentence_ids(df)
+        if sents is None:
+            sents = np.zeros(len(df), dtype=np.int64)
+        num_sents = int(sents[-1]) + 1 if len(df) else 0
+        keep = terms >= 0
+        counts = _count_matrix(sents[keep], terms[keep], (num_sents, len(self.vocab)))
+        return self._weigh(counts)
+
+    def score(self, features):
+        """
+        Similarity of each row of features to each bin, as a dense array
+        """
+        return (features @ self.centroids.T).toarray()
 
-    # little hack when there are no columns
-    if not column:
-        vectors = vectors["_base"]
 
-    return vectors
+def _tfidf_model(df, column, n_top_members=-1, show=["w"]):
+    """
+    Make a TfidfModel of the sentences in each bin of column
+    """
+    return TfidfModel.from_dataset(df, column, n_top_members=n_top_members, show=show)
@@ -2,35 +2,63 @@
 buzz's topology method
 """
 
+import re
 from collections import defaultdict
 import pandas as pd
 import numpy as np
-from joblib import Parallel
 from .constants import TOPOLOGY_QUERIES
 from . import multi
-from .utils import _get_tqdm, _tqdm_update, _tqdm_close
-
-from scipy.spatial.distance import cosine
+from .utils import (
+    _category_labels,
+    _get_categorical,
+    _get_tqdm,
+    _tqdm_update,
+    _tqdm_close,
+)
+from .similarity import _top_k, _unit
 
 tqdm = _get_tqdm()
 
+# the parts of a topology query that can be run in one pass for all lemmas
+NODE = re.compile(r'\{query\}|[siwlxpmgfeoSIWLXPMGFEO](?:"[^"]*"|/[^/]*/)')
+OPERATOR = re.compile(r"->>|->|<-|=|[+-]\d*")
+QUERY_TOKENS = re.compile(NODE.pattern + "|" + OPERATOR.pattern + r"|[()\[\]|]")
 
-def _cos_unit(row, df=None):
-    """
-    appliable
-    """
-    return cosine(row, pd.Series([1] * len(df.columns), index=df.columns))
 
+# pairwise metrics: similarities, except euclidean, which is a distance
+METRICS = {"cosine", "euclidean", "jaccard"}
 
-def _create_cos(word, df):
+
+def _prepare(vectors, metric):
     """
-    appliable
+    float32 vectors ready for _block_scores, plus the norms or sizes it needs
     """
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {sorted(METRICS)}, not {metric}")
+    if metric == "cosine":
+        return _unit(vectors), None
+    if metric == "jaccard":
+        vectors = (np.asarray(vectors) != 0).astype(np.float32)
+        return vectors, vectors.sum(axis=1)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors, np.einsum("ij,ij->i", vectors, vectors)
 
-    def cos_word(row):
-        return cosine(row, df.loc[word])
 
-    return cos_word
+def _block_scores(metric, vectors, extra, start, stop):
+    """
+    Scores of rows start:stop of vectors against every row, with one product
+    """
+    products = vectors[start:stop] @ vectors.T
+    if metric == "cosine":
+        return products
+    if metric == "jaccard":
+        union = extra[start:stop, None] + extra[None, :] - products
+        return np.divide(products, union, out=np.zeros_like(products), where=union > 0)
+    squared = extra[start:stop, None] + extra[None, :] - 2 * products
+    # rounding leaves small nonzero distances from each row to itself
+    rows = np.arange(len(squared))
+    squared[rows, rows + start] = 0
+    return np.sqrt(np.maximum(squared, 0, out=squared), out=squared)
 
 
 class TopologyData(pd.DataFrame):
@@ -53,10 +81,64 @@ class TopologyData(pd.DataFrame):
             return self.pow(2).sum(axis=1).pow(0.5)
         if word == "taxi":
             return self.sum(axis=1)
-        if word == "cos_unit":
-            return self.apply(_cos_unit, df=self, axis=1)
+        values = self.values.astype(np.float32)
+        other = np.ones(values.shape[1], dtype=np.float32)
+        if word != "cos_unit":
+            other = values[self.index.get_loc(word)]
+        # cosine distance of every row to the unit vector or to word's row
+        norms = np.linalg.norm(values, axis=1) * np.linalg.norm(other)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.Series(1 - values @ other / norms, index=self.index)
+
+    def _lemma_vectors(self):
+        """
+        Lemmas (the columns) as rows of a float32 matrix
+        """
+        return np.ascontiguousarray(self.values.T, dtype=np.float32)
+
+    def pairwise(self, metric="cosine", block_size=1000):
+        """
+        Lemma by lemma cosine or jaccard similarity, or euclidean distance
+
+        Computed block_size lemmas at a time, so memory beyond the float32
+        result stays bounded.
+        """
+        vectors, extra = _prepare(self._lemma_vectors(), metric)
+        out = np.empty((len(vectors), len(vectors)), dtype=np.float32)
+        for start in range(0, len(vectors), block_size):
+            stop = start + block_size
+            out[start:stop] = _block_scores(metric, vectors, extra, start, stop)
+        return pd.DataFrame(out, index=self.columns, columns=self.columns)
 
-        return self.apply(_create_cos(word, self), df=self, axis=1)
+    def nearest(self, word, k=10, metric="cosine"):
+        """
+        The k lemmas most like word, most similar first
+        """
+        vectors, extra = _prepare(self._lemma_vectors(), metric)
+        position = self.columns.get_loc(word)
+        scores = _block_scores(metric, vectors, extra, position, position + 1)[0]
+        # best is highest, except for a distance
+        order = -scores if metric == "euclidean" else scores.copy()
+        order[position] = -np.inf
+        top = _top_k(order, min(k, len(scores) - 1))
+        return pd.Series(scores[top], index=self.columns[top], name=word)
+
+    def clusters(self, n_clusters=8, metric="cosine", method="average"):
+        """
+        Group the lemmas into at most n_clusters by hierarchical clustering
+
+        Return: Series of cluster number for each lemma
+        """
+        from scipy.cluster.hierarchy import fcluster, linkage
+        from scipy.spatial.distance import squareform
+
+        scores = self.pairwise(metric=metric).values.astype(np.float64)
+        distances = scores if metric == "euclidean" else 1 - scores
+        np.fill_diagonal(distances, 0)
+        condensed = squareform(np.maximum(distances, 0), checks=False)
+        tree = linkage(condensed, method=method)
+        labels = fcluster(tree, n_clusters, criterion="maxclust")
+        return pd.Series(labels, index=self.columns, name="cluster")
 
     def word_axis(self, word1, word2):
         import matplotlib.pyplot as plt
@@ -84,7 +166,9 @@ class TopologyData(pd.DataFrame):
 
 
 def _process_chunk(dataset, word, name, query, is_bool, features_of_interest, counts):
-    # dataset = pd.read_pickle(dataset)
+    """
+    Run one query for one lemma with depgrep, for queries _parse_query cannot read
+    """
     results = dict()
     if not isinstance(query, str):
         # lambda query can be done as an apply, no depgrep
@@ -94,38 +178,200 @@ def _process_chunk(dataset, word, name, query, is_bool, features_of_interest, co
         query = query.format(query=f'l"{word}"')
         result = dataset.depgrep(query, position=None)
     if result.empty:
-        # or return df
         return
     # if we have not specified which particular features to count,
     # e.g. {w, l, x}, we just count the result row itself
     if not features_of_interest:
-        count = len(result) / counts[word]
-        if count > 0:
-            return word, {name.lower(): count}
-        else:
-            return
-
+        return word, {name.lower(): len(result) / counts[word]}
     # this is almost certainly if we want the index of the word (i)
     if any(i in {"file", "s", "i"} for i in features_of_interest):
         result = result.reset_index()
     for col in features_of_interest:
         # in our search result, count tokens (rows) by feature of interest
-        valcount = result[col].value_counts()
-        # this could be an apply, but we need both key and value
-        # so we would need to make it into a DataFrame... annoying
-        for realisation, subc in valcount.items():
-            # make the feature name
-            bits = [name, col, str(realisation)]
+        for realisation, subc in result[col].value_counts().items():
+            if not subc:
+                continue
             # the replace is for -pron- lemma mostly
-            feature_name = "_".join(bits).lower().replace("-", "")
-            # divide occurrences by length of corpus
-            # a value of 1 would indicate that all that occurred in the
-            # corpus was this feature??
-            count = subc / len(dataset)
-            if count > 0:
-                # not sure if we should divide by corpus length instead?
-                results[feature_name] = subc / counts[word]
-        return word, results
+            feature_name = "_".join([name, col, str(realisation)]).lower().replace("-", "")
+            results[feature_name] = results.get(feature_name, 0) + subc / counts[word]
+    return word, results
+
+
+def _parse_query(query):
+    """
+    Split a topology query into its first node and its relations
+
+    Each relation is a list of (operator, node) alternatives. Returns None for
+    anything beyond the simple queries in TOPOLOGY_QUERIES, which then go to
+    depgrep one lemma at a time.
+    """
+    if not isinstance(query, str):
+        return
+    tokens = QUERY_TOKENS.findall(query)
+    if not tokens or "".join(tokens) != re.sub(r"\s", "", query):
+        return
+    head, rest = tokens[0], tokens[1:]
+    if not NODE.fullmatch(head):
+        return
+    relations = list()
+    while rest:
+        if rest[0] in {"(", "["}:
+            close = ")" if rest[0] == "(" else "]"
+            if close not in rest:
+                return
+            end = rest.index(close)
+            group, rest = rest[1:end], rest[end + 1 :]
+            alternatives = [tuple(group[i : i + 2]) for i in range(0, len(group), 3)]
+            if any(i != "|" for i in group[2::3]):
+                return
+        else:
+            alternatives, rest = [tuple(rest[:2])], rest[2:]
+        for alternative in alternatives:
+            if len(alternative) != 2 or not OPERATOR.fullmatch(alternative[0]):
+                return
+            if not NODE.fullmatch(alternative[1]):
+                return
+        relations.append(alternatives)
+    # the lemma must be in exactly one place: the first node or one relation
+    on_target = [all(node == "{query}" for _, node in i) for i in relations]
+    mixed = [any(node == "{query}" for _, node in i) for i in relations]
+    if mixed != on_target or sum(on_target) + (head == "{query}") != 1:
+        return
+    return head, relations
+
+
+def _node_mask(df, node):
+    """
+    Boolean index of the rows matching one depgrep node, e.g. F/nsubj/ or x"NOUN"
+
+    As in depgrep, a lowercase attribute name makes the match case insensitive
+    """
+    attr, value = node[0], node[2:-1]
+    column = attr.lower()
+    case = attr.isupper()
+    if value in {"*", "__"}:
+        return np.ones(len(df), dtype=bool)
+    categorical = _get_categorical(df, column)
+    if categorical is not None:
+        labels = _category_labels(categorical, column, case=True)
+        codes = categorical.codes
+    else:
+        values = df[column] if column in df.columns else df.index.get_level_values(column)
+        codes, uniques = pd.factorize(np.asarray(values))
+        labels = pd.Series(np.append(np.asarray(uniques).astype(str), "nan"))
+    if not case:
+        labels = labels.str.lower()
+        value = value.lower()
+    # match each label once, then look the answer up for every row
+    if node[1] == '"':
+        hits = labels.isin(value.split(",")).values
+    else:
+        regex = re.compile(value)
+        hits = np.array([bool(regex.search(label)) for label in labels])
+    return hits[codes]
+
+
+def _governors(df):
+    """
+    Row number of each token's governor, or -1 for roots
+
+    Uses the same arithmetic as depgrep, so sentences must be contiguous
+    """
+    n = np.arange(len(df))
+    i = df.index.get_level_values("i").values.astype(np.int64)
+    g = pd.to_numeric(df["g"], errors="coerce").fillna(0).values.astype(np.int64)
+    governors = n - i + g
+    governors[(g == 0) | (governors < 0) | (governors >= len(df))] = -1
+    return governors
+
+
+def _related(operator, governors):
+    """
+    Every pair of rows (a, b) such that a operator b holds, as two arrays
+    """
+    n = np.arange(len(governors))
+    if operator == "=":
+        return n, n
+    has_gov = governors >= 0
+    if operator == "<-":
+        return n[has_gov], governors[has_gov]
+    if operator == "->":
+        return governors[has_gov], n[has_gov]
+    if operator == "->>":
+        # depgrep looks five levels down for descendants
+        heads, others, ancestors = list(), list(), governors.copy()
+        for _ in range(5):
+            found = ancestors >= 0
+            heads.append(ancestors[found])
+            others.append(n[found])
+            ancestors[found] = governors[ancestors[found]]
+            ancestors[~found] = -1
+        return np.concatenate(heads), np.concatenate(others)
+    # +N: b is N rows after a; -N: b is N rows before a
+    distance = int(operator[1:] or 1) * (1 if operator[0] == "+" else -1)
+    heads = n[max(0, -distance) : len(n) - max(0, distance)]
+    return heads, heads + distance
+
+
+def _target_keys(dataset, to_search):
+    """
+    For each row, the number of the lemma it counts towards, or -1
+
+    Lemmas are matched case insensitively, like l"word" in depgrep
+    """
+    names = pd.Index(sorted({str(i).lower() for i in to_search}))
+    lemmas = _get_categorical(dataset, "l")
+    if lemmas is not None:
+        labels = _category_labels(lemmas, "l", case=False)
+        return names.get_indexer(labels)[lemmas.codes], names
+    lemmas = dataset["l"].astype(str).str.lower()
+    return names.get_indexer(lemmas), names
+
+
+def _one_pass(dataset, name, parsed, features_of_interest, keys, governors):
+    """
+    Count one query's matches for every lemma at once
+
+    Return: DataFrame of key, feature and count, like _process_chunk for all lemmas
+    """
+    head, relations = parsed
+    matches = keys >= 0 if head == "{query}" else _node_mask(dataset, head)
+    heads = others = np.flatnonzero(matches) if head == "{query}" else None
+    for alternatives in relations:
+        pairs = [_related(operator, governors) for operator, _ in alternatives]
+        if alternatives[0][1] == "{query}":
+            heads = np.concatenate([i for i, _ in pairs])
+            others = np.concatenate([j for _, j in pairs])
+            continue
+        found = np.zeros(len(dataset), dtype=bool)
+        for (a, b), (_, node) in zip(pairs, alternatives):
+            found[a[_node_mask(dataset, node)[b]]] = True
+        matches &= found
+    keep = matches[heads] & (keys[others] >= 0)
+    # like depgrep for each lemma, a row matches a lemma at most once
+    width = np.int64(len(dataset))
+    pairs = np.unique(keys[others[keep]].astype(np.int64) * width + heads[keep])
+    heads, hits = pairs % width, pairs // width
+    # if we have not specified which particular features to count,
+    # e.g. {w, l, x}, we just count the result row itself
+    if not features_of_interest:
+        counted = np.bincount(hits)
+        found = np.flatnonzero(counted)
+        return pd.DataFrame(dict(key=found, feature=name.lower(), count=counted[found]))
+    out = list()
+    for col in features_of_interest:
+        values = dataset[col] if col in dataset.columns else dataset.index.get_level_values(col)
+        codes, uniques = pd.factorize(np.asarray(values)[heads])
+        good = codes >= 0
+        width = np.int64(len(uniques))
+        combos, counted = np.unique(hits[good] * width + codes[good], return_counts=True)
+        # the replace is for -pron- lemma mostly
+        names = [f"{name}_{col}_{i}".lower().replace("-", "") for i in uniques]
+        features = np.asarray(names, dtype=object)[combos % width]
+        out.append(pd.DataFrame(dict(key=combos // width, feature=features, count=counted)))
+    if not out:
+        return pd.DataFrame(columns=["key", "feature", "count"])
+    return pd.concat(out, ignore_index=True)
 
 
 def _topology(dataset, kind="verb", wordlist=None, min_occur=10, *args, **kwargs):
@@ -140,78 +386,54 @@ def _topology(dataset, kind="verb", wordlist=None, min_occur=10, *args, **kwargs
     min_occur = 1 if not min_occur else min_occur
     to_search = list(counts[counts >= min_occur].index)
     n_tok = len(to_search)
-    n_search = n_tok * len(queries)
     formatted = ", ".join(to_search)
-    print(f"To be analysed ({n_tok} tokens, {n_search} searches): {formatted}\n\n")
-    # all the results end up in this huge dict
-    huge = defaultdict(dict)
+    print(f"To be analysed ({n_tok} lemmas, {len(queries)} queries): {formatted}\n\n")
+    parsed = {name: _parse_query(query) for name, (query, _, _) in queries.items()}
+    # queries we cannot do in one pass are run for each lemma with depgrep
     searches = list()
-    multiprocess = multi.how_many(kwargs.pop("multiprocess", True))
     for word in to_search:
         for name, (query, is_bool, features_of_interest) in queries.items():
-            # todo: remove when there are no more lambdas
-            if isinstance(query, str):
-                searches.append(
-                    [word, name, query, is_bool, features_of_interest, counts.copy()]
-                )
-
-    if multiprocess and multiprocess > 1:
-        # multiprocess does not work with lambda queries!
-        chunks = np.array_split(searches, multiprocess)
-        delay = (multi.topology(dataset, x, i) for i, x in enumerate(chunks))
-        results = Parallel(n_jobs=multiprocess)(delay)
-        results = [item for sublist in results for item in sublist]
-        out = defaultdict(dict)
-        for result in results:
-            if result is None:
-                continue
-            term, freq = result
-            out[term].update(freq)
-        top = TopologyData(out)
-        return top.fillna(0.0)
-
-    t = tqdm(ncols=120, unit="query", desc=f"Counting {kind.lower()}s", total=n_search)
-    for word, name, query, _is_bool, features_of_interest, _ in searches:
-        huge[word] = dict()
-        if not isinstance(query, str):
-            # lambda query can be done as an apply, no depgrep
-            result = dataset[dataset.apply(query, axis=1)]
-        else:
-            # put the lemma into the unformatted query
-            query = query.format(query=f'l"{word}"')
-            result = dataset.depgrep(query, position=None)
-        if result.empty:
-            _tqdm_update(t, postfix=word)
-            continue
-        # if we have not specified which particular features to count,
-        # e.g. {w, l, x}, we just count the result row itself
-        if not features_of_interest:
-            count = len(result) / counts[word]
-            if count > 0:
-                huge[word][name.lower()] = count
-            _tqdm_update(t, postfix=word)
+            if parsed[name] is None:
+                searches.append([word, name, query, is_bool, features_of_interest])
+    multiprocess = multi.how_many(kwargs.pop("multiprocess", True))
+
+    # one pass over the dataset for each query, counting all lemmas at once
+    keys, names = _target_keys(dataset, to_search)
+    governors = _governors(dataset)
+    total = sum(i is not None for i in parsed.values())
+    t = tqdm(ncols=120, unit="query", desc=f"Counting {kind.lower()}s", total=total)
+    found = list()
+    for name, (_, _, features_of_interest) in queries.items():
+        if parsed[name] is None:
             continue
-        # this is almost certainly if we want the index of the word (i)
-        if any(i in {"file", "s", "i"} for i in features_of_interest):
-            result = result.reset_index()
-        for col in features_of_interest:
-            # in our search result, count tokens (rows) by feature of interest
-            valcount = result[col].value_counts()
-            # this could be an apply, but we need both key and value
-            # so we would need to make it into a DataFrame... annoying
-            for realisation, subc in valcount.items():
-                # make the feature name
-                bits = [name, col, str(realisation)]
-                # the replace is for -pron- lemma mostly
-                feature_name = "_".join(bits).lower().replace("-", "")
-                # divide occurrences by length of corpus
-                # a value of 1 would indicate that all that occurred in the
-                # corpus was this feature??
-                count = subc / len(dataset)
-                if count > 0:
-                    # not sure if we should divide by corpus length instead?
-                    huge[word][feature_name] = subc / counts[word]
-            _tqdm_update(t, postfix=word)
+        found.append(_one_pass(dataset, name, parsed[name], features_of_interest, keys, governors))
+        _tqdm_update(t, postfix=name)
     _tqdm_close(t)
-    top = TopologyData(huge)
+    # each lowercased lemma counts towards every word it came from
+    if found:
+        found = pd.concat(found, ignore_index=True)
+    else:
+        found = pd.DataFrame(columns=["key", "feature", "count"])
+    word_keys = names.get_indexer([str(i).lower() for i in to_search])
+    words = pd.DataFrame(dict(word=to_search, key=word_keys))
+    found = found.astype(dict(key=np.int64)).merge(words, on="key")
+    found["value"] = found["count"].values / counts.reindex(found["word"]).values
+    huge = found.groupby(["feature", "word"])["value"].sum().unstack("word")
+
+    # lambda queries cannot be pickled, so they stay in this process
+    if any(not isinstance(i[2], str) for i in searches):
+        multiprocess = 1
+    chunks = [searches[i::multiprocess] for i in range(min(multiprocess, len(searches)))]
+    nested = multi.broadcast(multi.topology, dataset, chunks, counts=counts)
+    results = [item for sublist in nested for item in sublist]
+    out = defaultdict(dict)
+    for result in results:
+        if result is not None:
+            term, freq = result
+            out[term].update(freq)
+    if out:
+        huge = huge.add(pd.DataFrame(out), fill_value=0)
+    top = TopologyData(huge.reindex(columns=to_search))
+    top.columns.name = None
+    top.index.name = None
     return top.fillna(0.0)
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import re
 import shutil
@@ -129,6 +130,45 @@ def _make_match_col(df, show, preserve_case, show_entities=False, reference=None
     return made
 
 
+# case-folded (and plain stringified) category labels, cached per column. slices of
+# a Dataset share their categories, so chained filters can reuse these views
+_CATEGORY_LABELS = dict()
+
+
+def _get_categorical(df, column):
+    """
+    Get the pd.Categorical behind a column or index level, or None if not categorical
+    """
+    if column in df.columns:
+        data = df[column]
+        if data.dtype.name == "category":
+            return data.values
+        return
+    if column in df.index.names:
+        data = df.index.get_level_values(column)
+        if isinstance(data, pd.CategoricalIndex):
+            return data.values
+
+
+def _category_labels(categorical, column, case=True):
+    """
+    Get stringified labels for each category of a pd.Categorical
+
+    A final "nan" label is appended, so that missing values (code -1) look up
+    the last label, exactly as they would after astype(str).
+    """
+    categories = categorical.categories
+    key = (column, case)
+    cached = _CATEGORY_LABELS.get(key)
+    if cached is not None and cached[0] is categories:
+        return cached[1]
+    labels = pd.Series(np.append(categories.astype(str).values, "nan"))
+    if not case:
+        labels = labels.str.lower()
+    _CATEGORY_LABELS[key] = (categories, labels)
+    return labels
+
+
 def _get_tqdm():
     """
     Get either the IPython or regular version of tqdm
@@ -198,22 +238,25 @@ def _make_tree(tree):
         return
 
 
-def _get_nlp(language="en", constituencies=False):
+# spaCy pipelines loaded in this process, see _get_nlp
+_NLP = dict()
+
+
+def _load_nlp(language, constituencies, sentencizer, disable):
     """
-    Get spaCY/benepar with models by language
+    Load a spaCy model and build its pipeline
     """
     import spacy
 
-    language = language.lower()
     model_name = LANGUAGE_TO_MODEL.get(language, language)
 
     try:
-        nlp = spacy.load(model_name)
+        nlp = spacy.load(model_name, disable=list(disable))
     except OSError:
         from spacy.cli import download
 
         download(model_name)
-        nlp = spacy.load(model_name)
+        nlp = spacy.load(model_name, disable=list(disable))
 
     if language in BENEPAR_LANGUAGES and constituencies:
         from benepar.spacy_plugin import BeneparComponent
@@ -225,10 +268,27 @@ def _get_nlp(language="en", constituencies=False):
 
             benepar.download(BENEPAR_LANGUAGES[language])
             nlp.add_pipe(BeneparComponent(BENEPAR_LANGUAGES[language]))
-            # nlp.add_pipe(nlp.create_pipe("sentencizer"))
+    if sentencizer:
+        where = dict(before="parser") if "parser" in nlp.pipe_names else dict()
+        nlp.add_pipe(nlp.create_pipe("sentencizer"), **where)
     return nlp
 
 
+def _get_nlp(language="en", constituencies=False, sentencizer=False, disable=()):
+    """
+    Get spaCY/benepar with models by language
+
+    Each pipeline is loaded once per process and reused, so callers must not
+    add or remove its pipes. sentencizer adds one before the parser; disable
+    names components not to load at all.
+    """
+    language = language.lower()
+    key = (language, bool(constituencies), bool(sentencizer), tuple(sorted(disable)))
+    if key not in _NLP:
+        _NLP[key] = _load_nlp(*key)
+    return _NLP[key]
+
+
 def cast(text):
     """
     Attempt to get object from JSON string, or return the string
@@ -628,27 +688,153 @@ def _set_best_data_types(df):
     return df
 
 
+def _sentence_ids(df):
+    """
+    Get an integer id for the sentence each row belongs to, or None if unknown
+
+    Rows of a sentence are always contiguous, so a new id starts wherever
+    the file or sentence number differs from the row before.
+    """
+    keys = list()
+    for level in ["file", "s"]:
+        if level in df.columns:
+            keys.append(np.asarray(df[level].values))
+        elif level in df.index.names:
+            keys.append(np.asarray(df.index.get_level_values(level)))
+    if not keys or not len(df):
+        return
+    changes = np.zeros(len(df), dtype=bool)
+    for key in keys:
+        changes[1:] |= key[1:] != key[:-1]
+    return np.cumsum(changes)
+
+
+def _codes_and_labels(df, by, preserve_case=False):
+    """
+    Get an integer code for every row of df, and the label for each code
+
+    by can be one column name or a list of them, joined with a slash
+    """
+    if isinstance(by, str):
+        by = [by]
+    codes, labels = None, None
+    for col in by:
+        categorical = _get_categorical(df, col)
+        if categorical is not None:
+            # work on the categories, then map every row's code: cheap
+            cat_labels = _category_labels(categorical, col, case=preserve_case)
+            remap, uniques = pd.factorize(cat_labels)
+            col_codes = remap[categorical.codes]
+        else:
+            values = df[col] if col in df.columns else df.index.get_level_values(col)
+            values = pd.Series(np.asarray(values)).astype(str)
+            if not preserve_case:
+                values = values.str.lower()
+            col_codes, uniques = pd.factorize(values)
+        uniques = np.asarray(uniques, dtype=object)
+        if codes is None:
+            codes, labels = col_codes.astype(np.int64), uniques
+            continue
+        combined = codes * len(uniques) + col_codes
+        combined, inverse = np.unique(combined, return_inverse=True)
+        labels = np.array(
+            [f"{labels[c // len(uniques)]}/{uniques[c % len(uniques)]}" for c in combined],
+            dtype=object,
+        )
+        codes = inverse.astype(np.int64)
+    return codes, labels
+
+
+def _ranges(lengths):
+    """
+    Concatenated np.arange(n) for each n in lengths
+    """
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.arange(lengths.sum()) - offsets
+
+
+def _cache_path(corpus_path, name):
+    """
+    Path for a cached artefact of the corpus at corpus_path, in its .buzz folder
+    """
+    cache_dir = os.path.join(corpus_path, ".buzz")
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, name)
+
+
+def _cache_is_fresh(cache_file, filepaths):
+    """
+    Is cache_file there, and newer than every file it was built from?
+    """
+    if not os.path.isfile(cache_file):
+        return False
+    built = os.path.getmtime(cache_file)
+    return all(os.path.getmtime(path) <= built for path in filepaths)
+
+
+def _files_fingerprint(filepaths):
+    """
+    Short hash of a set of files and when each was last changed
+    """
+    digest = hashlib.sha1()
+    for path in sorted(filepaths):
+        digest.update(f"{path}:{os.path.getmtime(path)}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _remove_stale_caches(cache_file):
+    """
+    Delete older versions of cache_file: the same kind and spec, but another
+    fingerprint of the corpus files, or none (the old naming)
+    """
+    folder, name = os.path.split(cache_file)
+    spec, ext = re.match(r"(.*)-[0-9a-f]{16}(\.\w+)$", name).groups()
+    stale = re.compile(re.escape(spec) + r"(-[0-9a-f]{16})?" + re.escape(ext) + "$")
+    for other in os.listdir(folder):
+        if other != name and stale.match(other):
+            os.remove(os.path.join(folder, other))
+
+
 def _bool_ix_for_multiword(corpus, bool_ix, n):
     """
     When there is a multiword query, we need to also return
     the nth token(s) after the match
-    """
-    new_ix = set()
-    old_ix_length = len(bool_ix)
-    new_ser = []
-    df = corpus
-    only_good = df[bool_ix]
-    for abs_n in list(only_good._n):
-        for x in range(n):
-            also_good = abs_n+x
-            if also_good >= old_ix_length:
-                continue
-            new_ix.add(also_good)
-            new_ser.append(x)
-    # now we have new_ix, a set of all the good _n values
-    # we need a boolean index
-    bool_ix = df._n.isin(new_ix)
-    return bool_ix, new_ser
+
+    Expanded positions stop at the end of the data and at sentence boundaries.
+
+    Return: boolean index over corpus, plus the _position of each selected row
+    """
+    ns = corpus["_n"].values
+    bool_ix = np.asarray(bool_ix, dtype=bool)
+    start_rows = np.flatnonzero(bool_ix)
+    offsets = np.arange(n)
+    # every (match, offset) pair as an _n value
+    wanted = ns[start_rows][:, None] + offsets
+    # find the row holding each wanted _n, if there is one
+    sorter = None if (np.diff(ns) > 0).all() else np.argsort(ns, kind="mergesort")
+    rows = np.searchsorted(ns, wanted, sorter=sorter)
+    rows[rows >= len(ns)] = 0
+    if sorter is not None:
+        rows = sorter[rows]
+    valid = ns[rows] == wanted
+    sents = _sentence_ids(corpus)
+    if sents is not None:
+        valid &= sents[rows] == sents[start_rows][:, None]
+    rows = rows[valid]
+    positions = np.broadcast_to(offsets, wanted.shape)[valid]
+    # a row reached from more than one match keeps its smallest offset
+    order = np.lexsort((positions, rows))
+    rows, positions = rows[order], positions[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = rows[1:] != rows[:-1]
+    rows, positions = rows[first], positions[first]
+    new_ix = np.zeros(len(ns), dtype=bool)
+    new_ix[rows] = True
+    # rows are sorted, so positions line up with corpus[new_ix]
+    return new_ix, positions
+
 
 def _get_ocr_engine(lang):
     """
@@ -7,7 +7,8 @@ import math
 import numpy as np
 import pandas as pd
 
-from .utils import _auto_window, _make_match_col
+from .freqlist import FrequencyList
+from .utils import _auto_window, _category_labels, _get_categorical, _make_match_col
 
 
 def _get_widths(df, is_conc, window):
@@ -90,19 +91,54 @@ def _tabview(df, reference, window="auto", **kwargs):
     view(df, **view_style)
 
 
-def _lingres(ser, index):
+def _trend_stats(values, columns):
     """
-    Appliable stats calculation
-    """
-    from scipy.stats import linregress
+    Regress every column on row number at once, in closed form
 
-    ix = ["_slope", "_intercept", "_r", "_p", "_stderr"]
-    return pd.Series(linregress(index, ser.values), index=ix)
+    Gives the slope, intercept, r, p and stderr that scipy's linregress gives
+    for each column. values can be a 2d array or a scipy sparse matrix, which
+    is never made dense.
+    """
+    from scipy.sparse import issparse
+    from scipy.stats import t as t_dist
+
+    n = values.shape[0]
+    x = np.arange(n, dtype=float)
+    x -= x.mean() if n else 0.0
+    ssxm = (x ** 2).mean() if n else 0.0
+    # population (co)variances, like np.cov(x, y, bias=1) in linregress
+    if issparse(values):
+        ymean = np.asarray(values.mean(axis=0), dtype=float).ravel()
+        ssym = np.asarray(values.multiply(values).mean(axis=0), dtype=float).ravel()
+        ssym = np.maximum(ssym - ymean ** 2, 0.0)
+        ssxym = np.asarray(values.T @ x, dtype=float).ravel() / n
+    else:
+        values = np.asarray(values, dtype=float)
+        ymean = values.mean(axis=0)
+        ssym = ((values - ymean) ** 2).mean(axis=0)
+        ssxym = x @ values / n
+    dof = n - 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_den = np.sqrt(ssxm * ssym)
+        r = np.clip(np.where(r_den == 0, 0.0, ssxym / r_den), -1.0, 1.0)
+        slope = ssxym / ssxm
+        intercept = ymean - slope * (n - 1) / 2
+        if n == 2:
+            p = np.where(ssym == 0, 1.0, 0.0)
+            stderr = np.zeros(len(r))
+        else:
+            tiny = 1.0e-20
+            t = r * np.sqrt(dof / ((1.0 - r + tiny) * (1.0 + r + tiny)))
+            p = 2 * t_dist.sf(np.abs(t), dof)
+            stderr = np.sqrt((1 - r ** 2) * ssym / ssxm / dof)
+    data = dict(slope=slope, intercept=intercept, r=r, p=p, stderr=stderr)
+    stats = pd.DataFrame(data, index=columns)
+    return stats.replace([np.inf, -np.inf], 0.0)
 
 
 def _sort(df, by=False, keep_stats=False, remove_above_p=False):
     """
-    Sort results, potentially using scipy's linregress
+    Sort results, potentially using linear regression statistics
     """
     # translate options and make sure they are parseable
     stat_field = ["_slope", "_intercept", "_r", "_p", "_stderr"]
@@ -115,19 +151,10 @@ def _sort(df, by=False, keep_stats=False, remove_above_p=False):
     by_convert = {"most": "total", True: "total", "least": "infreq"}
     by = by_convert.get(by, by)
 
+    # stats are kept beside the table, one row per column, not appended to it
+    stats = None
     if keep_stats or by in stat_field + stat_sorts:
-        n_column = list(range(len(df)))
-        # quick fix: do not have categorical index, because we might want to do regression on them
-        try:
-            df.index = df.index.astype(int)
-        except Exception:
-            try:
-                df.index = df.index.astype(object)
-            except Exception:
-                pass
-        stats = df.apply(_lingres, axis=0, index=n_column)
-        df = df.append(stats)
-        df = df.replace([np.inf, -np.inf], 0.0)
+        stats = _trend_stats(df.values, df.columns)
 
     if by == "name":
         # currently case sensitive
@@ -141,13 +168,14 @@ def _sort(df, by=False, keep_stats=False, remove_above_p=False):
         df = df.loc[::, ::-1]
 
     # sort by slope etc., or search by subcorpus name
-    if by in stat_field or by not in options:
-        asc = False if by is True or by in {"total", "most"} else True
+    elif by in stat_field:
+        df = df[stats[by.lstrip("_")].sort_values(ascending=True).index]
 
-        df = df.T.sort_values(by=by, ascending=asc).T
+    elif by not in options:
+        df = df.T.sort_values(by=by, ascending=True).T
 
-    if "_slope" in df.index:
-        slopes = df.loc["_slope"]
+    if stats is not None:
+        slopes = stats["slope"]
         if by == "increase":
             std = slopes.sort_values(ascending=False)
             df = df[std.index]
@@ -161,15 +189,19 @@ def _sort(df, by=False, keep_stats=False, remove_above_p=False):
             std = slopes.abs().sort_values(ascending=False)
             df = df[std.index]
         if remove_above_p is not False and remove_above_p > 0:
-            df = df.T
-            df = df[df["_p"] <= remove_above_p]
-            df = df.T
+            df = df.loc[:, (stats["p"].reindex(df.columns) <= remove_above_p).values]
 
-    # remove stats field by default
-    if not keep_stats:
-        df = df.drop(stat_field, axis=0, errors="ignore")
-    else:
-        df.index = [i.lstrip("_") if i in stat_field else i for i in list(df.index)]
+    # add the stats under the table if the user wants that
+    if keep_stats:
+        # quick fix: do not have categorical index, so we can add the stats rows
+        try:
+            df.index = df.index.astype(int)
+        except Exception:
+            try:
+                df.index = df.index.astype(object)
+            except Exception:
+                pass
+        df = pd.concat([df, stats.reindex(df.columns).T])
     return df
 
 
@@ -235,18 +267,42 @@ def _effect_size_for_ll(data, target_sum, ref_sum):
     return ll / (sum([target_sum, ref_sum]) * math.log(min([expected_target, expected_ref])))
 
 
-def _make_keywords(subcorpus, reference, ref_sum, measure):
+def _vector_keyness(measure, target, ref, target_sum, ref_sum):
     """
-    Apply function for getting keyness calculations
-
-    subcorpus: Series of tokens and their counts for this subcorpus
+    Keyness for whole arrays of counts at once: target and ref are the counts
+    of each word in the target and reference, target_sum may be an array too
     """
-    # how many words are there in this subcorpus
-    target_sum = subcorpus.sum()
-    # make series with counts in reference
-    df = pd.DataFrame(subcorpus)
-    df["_ref_counts"] = reference
-    return df.apply(measure, axis=1, raw=True, args=(target_sum, ref_sum))
+    target = np.asarray(target, dtype=float)
+    ref = np.asarray(ref, dtype=float)
+    target_sum = np.asarray(target_sum, dtype=float)
+    ref_sum = float(ref_sum)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if measure in {"ll", "bf", "el"}:
+            both = ref + target
+            total = ref_sum + target_sum
+            e1 = ref_sum * both / total
+            e2 = target_sum * both / total
+            log1 = np.where(ref == 0, 0.0, np.log(np.where(ref == 0, 1.0, ref / e1)))
+            log2 = np.where(target == 0, 0.0, np.log(np.where(target == 0, 1.0, target / e2)))
+            score = 2 * (ref * log1 + target * log2)
+            score = np.where(target / target_sum < ref / ref_sum, -score, score)
+            if measure == "bf":
+                return score - np.log(total)
+            if measure == "el":
+                return score / (total * np.log(np.minimum(e2, e1)))
+            return score
+        if measure == "pd":
+            norm_target = target / target_sum
+            norm_ref = ref / ref_sum
+            norm_ref = np.where(norm_ref == 0, 0.00000000000000000000000001, norm_ref)
+            score = ((norm_target - norm_ref) * 100.0) / norm_ref
+            return np.where(score == -100.0, 0.0, score)
+        if measure == "or":
+            return (target / (target_sum - target)) / (ref / (ref_sum - ref))
+        if measure == "rr":
+            return (target / target_sum) / (ref / ref_sum)
+    # unknown measures fall back to log likelihood, as in _keyness
+    return _vector_keyness("ll", target, ref, target_sum, ref_sum)
 
 
 def _table(
@@ -262,18 +318,27 @@ def _table(
     keep_stats=False,
     show_entities=False,
     min_occur=0,
+    sparse=False,
     **kwargs,
 ):
     """
     Generate a result table view from Results, or a Results-like DataFrame
-    """
-    from .table import Table
 
+    sparse: build a SparseTable (scipy CSR) rather than a dense pivot table
+    """
     if relative is not False and keyness:
         raise ValueError("Either relative or keyness, not both.")
 
     # we need access to reference corpus for freq calculation
     reference = kwargs.get("reference", getattr(df, "_reference", df))
+    # a frequency list only has counts, so matches are formatted from the data
+    freqs = None
+    # neighbouring words (+1w, -1w) are taken from the whole corpus
+    context = reference
+    if isinstance(reference, FrequencyList):
+        freqs, reference = reference, df
+        context = getattr(df, "reference", None)
+        context = df if context is None else context
 
     # show and subcorpora must always be a list
     if not isinstance(show, list):
@@ -285,37 +350,112 @@ def _table(
     for to_show in show:
         if not to_show.startswith(("+", "-")):
             continue
-        df[to_show] = reference[to_show[2:]].shift(-int(to_show[1]))
+        df[to_show] = context[to_show[2:]].shift(-int(to_show[1]))
 
     # create a default for remove_above_p
     remove_above_p = 0.05 if remove_above_p is True else remove_above_p
 
-    # make a column representing the 'show' info
-    needs_format = df if not keyness else reference
-    kwa = dict(show_entities=show_entities, reference=reference)
-    match = _make_match_col(needs_format, show, preserve_case, **kwa)
-    df["_match"] = match
-    reference["_match"] = match
+    if freqs is not None:
+        freqs.check(show, preserve_case)
+    plain_keyness = keyness is False or freqs is not None
+
+    if sparse:
+        # counted from codes; only entities need each match formatting first
+        match = None
+        if show_entities:
+            kwa = dict(show_entities=show_entities, reference=reference)
+            match = _make_match_col(df, show, preserve_case, **kwa)
+        kwa = dict(min_occur=min_occur, match=match)
+        table = _sparse_table(df, subcorpora, show, preserve_case, reference, **kwa)
+        if keyness is not False and freqs is None and match is None:
+            freqs = _code_table(reference, False, show, preserve_case).iloc[0]
+        elif keyness is not False and freqs is None:
+            kwa = dict(show_entities=show_entities, reference=reference)
+            freqs = _make_match_col(reference, show, preserve_case, **kwa).value_counts()
+        finish = dict(relative=relative, keyness=keyness, sort=sort, keep_stats=keep_stats)
+        finish.update(remove_above_p=remove_above_p, multiindex_columns=multiindex_columns)
+        return _finish_table(table, show, reference=freqs, sparse=True, **finish)
+
+    # usually we can count integer codes, formatting each distinct match once.
+    # entities and keyness still need the formatted _match column
+    if not show_entities and plain_keyness and len(df):
+        table = _code_table(df, subcorpora, show, preserve_case, min_occur=min_occur)
+    else:
+        # make a column representing the 'show' info
+        needs_format = df if not keyness else reference
+        kwa = dict(show_entities=show_entities, reference=reference)
+        match = _make_match_col(needs_format, show, preserve_case, **kwa)
+        df["_match"] = match
+        reference["_match"] = match
+
+        if min_occur:
+            vcs = df._match.value_counts()
+            enough = vcs[vcs >= min_occur].index
+            df = df[df._match.isin(enough)]
+
+        # make the matrix
+        if subcorpora:
+            df["_count"] = 1
+            pivot = dict(index=subcorpora, columns="_match", values="_count", aggfunc=sum)
+            table = df.pivot_table(**pivot)
+        else:
+            table = pd.DataFrame(df["_match"].value_counts()).T
+
+        table = table.fillna(0)
+
+    table = _finish_table(
+        table,
+        show,
+        reference=reference if freqs is None else freqs,
+        relative=relative,
+        keyness=keyness,
+        sort=sort,
+        keep_stats=keep_stats,
+        remove_above_p=remove_above_p,
+        multiindex_columns=multiindex_columns,
+    )
 
-    if min_occur:
-        vcs = df._match.value_counts()
-        enough = vcs[vcs >= min_occur].index
-        df = df[df._match.isin(enough)]
+    df.drop(["_match", "_count"], axis=1, inplace=True, errors="ignore")
+    if reference is not None:
+        reference.drop("_match", axis=1, inplace=True, errors="ignore")
 
-    # make the matrix
-    if subcorpora:
-        df["_count"] = 1
-        pivot = dict(index=subcorpora, columns="_match", values="_count", aggfunc=sum)
-        table = df.pivot_table(**pivot)
-    else:
-        table = pd.DataFrame(df["_match"].value_counts()).T
+    return table
 
-    table = table.fillna(0)
 
-    # make table now so we can relative/sort
-    table = Table(table, reference=reference)
+def _finish_table(
+    table,
+    show,
+    reference=None,
+    relative=False,
+    keyness=False,
+    sort="total",
+    keep_stats=False,
+    remove_above_p=False,
+    multiindex_columns=False,
+    sparse=False,
+):
+    """
+    Turn raw counts into a Table, then do relative/keyness/sort/columns
+
+    With sparse, table may already be a SparseTable; a SparseTable keeps its
+    stats apart, via SparseTable.stats(), so keep_stats cannot be used.
+    """
+    from .table import SparseTable, Table
+
+    if sparse:
+        if keep_stats:
+            raise ValueError("Sparse tables cannot keep_stats; use SparseTable.stats() instead")
+        if keyness is not False and remove_above_p:
+            raise ValueError("remove_above_p needs a sorted table of counts, not keyness")
+        if not isinstance(table, SparseTable):
+            columns = table.columns.rename(None)
+            values = table.values.astype(int)
+            table = SparseTable(values, table.index, columns, reference=reference)
+    else:
+        # make table now so we can relative/sort
+        table = Table(table, reference=reference)
 
-    table = table.astype(int)
+        table = table.astype(int)
 
     # relative frequency if user wants that
     if relative is not False:
@@ -326,7 +466,9 @@ def _table(
 
     # sort if the user wants that. do not sort keyness because it is different
     if sort and not keyness:
-        sorts = dict(by=sort, keep_stats=keep_stats, remove_above_p=remove_above_p)
+        sorts = dict(by=sort, remove_above_p=remove_above_p)
+        if not sparse:
+            sorts["keep_stats"] = keep_stats
         table = table.sort(**sorts)
 
     # make columns into multiindex if the user wants that
@@ -334,39 +476,251 @@ def _table(
         table.columns = table.columns.str.split("/", n=len(show) - 1, expand=True)
         table.columns.names = show
     else:
-        table.columns.name = "/".join(show)
-
-    df.drop(["_match", "_count"], axis=1, inplace=True, errors="ignore")
-    if reference is not None:
-        reference.drop("_match", axis=1, inplace=True, errors="ignore")
+        table.columns = table.columns.rename("/".join(show))
 
     return table
 
 
+def _partial_counts(df, show, subcorpora, preserve_case=False):
+    """
+    Counts for one piece of a corpus, as a Series indexed by subcorpora + match
+    """
+    table = _code_table(df, subcorpora, show, preserve_case)
+    if not subcorpora:
+        return table.iloc[0].rename_axis("_match")
+    counts = table.stack()
+    counts = counts[counts > 0]
+    # plain levels, so that pieces with different categories combine cleanly
+    index = counts.index
+    levels = [np.asarray(index.get_level_values(i), dtype=object) for i in range(index.nlevels)]
+    counts.index = pd.MultiIndex.from_arrays(levels, names=list(subcorpora) + ["_match"])
+    return counts
+
+
+def _merge_counts(partials, subcorpora, wide=True):
+    """
+    Sum partial counts; with wide=True, make them into a subcorpora x match frame
+    """
+    partials = [i for i in partials if i is not None and len(i)]
+    if not partials:
+        return pd.DataFrame() if wide else None
+    counts = pd.concat(partials)
+    counts = counts.groupby(level=list(range(counts.index.nlevels))).sum()
+    if not wide:
+        return counts
+    if not subcorpora:
+        counts = counts.sort_values(ascending=False, kind="mergesort")
+        return pd.DataFrame([counts.values], index=["_match"], columns=list(counts.index))
+    return counts.unstack("_match", fill_value=0)
+
+
+def _column_codes(df, column):
+    """
+    Integer codes for a column or index level, and a string label for each
+
+    Missing values get the last code, labelled "nan", as astype(str) would.
+    """
+    categorical = _get_categorical(df, column)
+    if categorical is not None:
+        codes = np.asarray(categorical.codes, dtype=np.int64)
+        labels = _category_labels(categorical, column).values
+    else:
+        values = df[column] if column in df.columns else df.index.get_level_values(column)
+        codes, uniques = pd.factorize(values)
+        labels = np.append(np.asarray(uniques).astype(str), "nan")
+    codes = np.where(codes < 0, len(labels) - 1, codes)
+    return codes, np.asarray(labels, dtype=object)
+
+
+def _combine_codes(codes, more, more_size):
+    """
+    One code for each distinct pair of codes, keeping their sort order
+    """
+    combined, inverse = np.unique(codes * more_size + more, return_inverse=True)
+    return inverse.ravel(), combined // more_size, combined % more_size
+
+
+def _show_codes(df, show, preserve_case):
+    """
+    Codes for the match column that _make_match_col would make, with labels
+
+    Only the distinct combinations of show values are formatted as strings.
+    Rows that would have no match (missing first attribute) get code -1.
+    """
+    codes, labels = _column_codes(df, show[0])
+    parts = [labels]
+    picks = [np.arange(len(labels))]
+    # with more than one attribute, str.cat gives NaN when the first one is missing
+    missing = (codes == len(labels) - 1) & pd.isnull(_raw_values(df, show[0]))
+    for column in show[1:]:
+        more, more_labels = _column_codes(df, column)
+        codes, left, right = _combine_codes(codes, more, len(more_labels))
+        picks = [pick[left] for pick in picks] + [right]
+        parts.append(more_labels)
+    formatted = pd.Series(parts[0][picks[0]], dtype=object)
+    if len(show) > 1:
+        others = [pd.Series(part[pick], dtype=object) for part, pick in zip(parts[1:], picks[1:])]
+        formatted = formatted.str.cat(others=others, sep="/").str.rstrip("/")
+    if not preserve_case:
+        formatted = formatted.str.lower()
+    # formatting can make different combinations identical (e.g. The, the)
+    remap, labels = pd.factorize(formatted)
+    codes = remap[codes]
+    if len(show) > 1:
+        codes = np.where(missing, -1, codes)
+    return codes, np.asarray(labels, dtype=object)
+
+
+def _raw_values(df, column):
+    if column in df.columns:
+        return df[column].values
+    return df.index.get_level_values(column)
+
+
+def _subcorpus_codes(df, subcorpora):
+    """
+    A code for each row's combination of subcorpora (-1 if any is missing),
+    the sorted values of each subcorpus column, and whether pivot_table would
+    show every combination: it does when a column is categorical.
+    """
+    codes, uniques, categorical = list(), list(), False
+    for column in subcorpora:
+        cat = _get_categorical(df, column)
+        if cat is not None:
+            categorical = True
+            codes.append(np.asarray(cat.codes, dtype=np.int64))
+            uniques.append(np.asarray(cat.categories, dtype=object))
+        else:
+            col_codes, col_uniques = pd.factorize(_raw_values(df, column), sort=True)
+            codes.append(col_codes)
+            uniques.append(np.asarray(col_uniques, dtype=object))
+    missing = np.any([c < 0 for c in codes], axis=0)
+    sizes = [max(len(u), 1) for u in uniques]
+    keys = np.ravel_multi_index([np.maximum(c, 0) for c in codes], sizes)
+    return np.where(missing, -1, keys), uniques, categorical
+
+
+def _table_codes(df, subcorpora, show, preserve_case, min_occur=0, match=None):
+    """
+    Row and column code of every counted token, plus the index and columns
+    those codes point to, for dense and sparse tables alike
+
+    Columns are codes of show, unless an already formatted match is given
+    """
+    if match is None:
+        col_codes, col_labels = _show_codes(df, show, preserve_case)
+    else:
+        col_codes, col_labels = pd.factorize(match)
+        col_labels = np.asarray(col_labels, dtype=object)
+    keep = col_codes >= 0
+    if min_occur:
+        totals = np.bincount(col_codes[keep], minlength=len(col_labels))
+        keep &= totals[np.maximum(col_codes, 0)] >= min_occur
+    # with categorical subcorpora, pivot_table shows every category, and
+    # every match, even those only found where a subcorpus is missing
+    all_cols = col_codes[keep]
+    if subcorpora:
+        row_codes, uniques, categorical = _subcorpus_codes(df, subcorpora)
+        keep &= row_codes >= 0
+    else:
+        row_codes, categorical = np.zeros(len(df), dtype=np.int64), False
+    row_codes, col_codes = row_codes[keep], col_codes[keep]
+
+    if categorical:
+        sizes = [len(u) for u in uniques]
+        rows_seen = np.arange(int(np.prod(sizes)))
+        cols_seen = np.unique(all_cols)
+        col_codes = np.searchsorted(cols_seen, col_codes)
+    else:
+        rows_seen, row_codes = np.unique(row_codes, return_inverse=True)
+        cols_seen, col_codes = np.unique(col_codes, return_inverse=True)
+    row_codes, col_codes = row_codes.ravel(), col_codes.ravel()
+    columns = col_labels[cols_seen]
+
+    if subcorpora:
+        order = np.argsort(columns.astype(str), kind="mergesort")
+        positions = np.unravel_index(rows_seen, [max(len(u), 1) for u in uniques])
+        arrays = [u[pos] for u, pos in zip(uniques, positions)]
+        if len(subcorpora) == 1:
+            index = pd.Index(arrays[0], name=subcorpora[0])
+        else:
+            index = pd.MultiIndex.from_arrays(arrays, names=subcorpora)
+    else:
+        # like value_counts: most frequent first
+        totals = np.bincount(col_codes, minlength=len(cols_seen))
+        order = np.argsort(-totals, kind="mergesort")
+        index = pd.Index(["_match"])
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    columns = pd.Index(columns[order], name="_match" if subcorpora else None)
+    return row_codes, rank[col_codes], index, columns
+
+
+def _code_table(df, subcorpora, show, preserve_case, min_occur=0):
+    """
+    Counts of each match by subcorpus, like pivot_table(...).fillna(0), but
+    made with np.bincount over integer codes
+    """
+    codes = _table_codes(df, subcorpora, show, preserve_case, min_occur=min_occur)
+    row_codes, col_codes, index, columns = codes
+    cells = len(index) * len(columns)
+    counts = np.bincount(row_codes * len(columns) + col_codes, minlength=cells)
+    counts = counts.reshape(len(index), len(columns))
+    return pd.DataFrame(counts, index=index, columns=columns)
+
+
+def _sparse_table(df, subcorpora, show, preserve_case, reference, min_occur=0, match=None):
+    """
+    Count matches by subcorpora straight into a CSR matrix, via integer codes
+    """
+    from scipy.sparse import coo_matrix
+
+    from .table import SparseTable
+
+    row_codes, col_codes, index, columns = _table_codes(
+        df, subcorpora, show, preserve_case, min_occur, match=match
+    )
+    ones = np.ones(len(row_codes), dtype=np.int64)
+    shape = (len(index), len(columns))
+    matrix = coo_matrix((ones, (row_codes, col_codes)), shape=shape).tocsr()
+    return SparseTable(matrix, index, columns.rename(None), reference=reference)
+
+
+def _reference_counts(reference, columns):
+    """
+    Count of each column's match in the reference, plus the reference size
+
+    reference can be a Dataset with a _match column, or counts already (a
+    Series, e.g. from a streamed table, or a FrequencyList)
+    """
+    if isinstance(reference, FrequencyList):
+        reference = reference.counts
+    if isinstance(reference, pd.Series):
+        ref_sum = reference.sum()
+    else:
+        ref_sum = reference.shape[0]
+        reference = reference["_match"].value_counts()
+    ref = reference.reindex(columns).fillna(0).values.astype(float)
+    return ref, float(ref_sum)
+
+
 def _keyness(table, keyness, reference=None):
     """
     Need a freq table, keyness measure and a reference corpus
+
+    Every cell is worked out at once, over the whole count matrix
     """
     if reference is None:
         warn = "Warning: no reference corpus supplied. Using result frame as reference corpus"
         print(warn)
-        reference = table
-    # get the total counts for match column in reference, sorted
-    ref = reference["_match"].value_counts()[table.iloc[0].index]
-    measures = {
-        "ll": _log_likelihood,
-        "pd": _perc_diff,
-        "or": _odds_ratio,
-        "bf": _bayes_factor_bic,
-        "el": _effect_size_for_ll,
-        "rr": _relrisk
-    }
-    measure = measures.get(keyness, _log_likelihood)
-    # kwargs for apply func. ref sum is number of words in reference, which is its shape
-    kwa = dict(axis=1, reference=ref, measure=measure, ref_sum=reference.shape[0])
-    # keywords runs over every subcorpus and then every match.
-    # first, for each row (subcorpus) in the table, we apply _make_keywords
-    applied = table.apply(_make_keywords, **kwa)
+        reference = table.sum()
+    ref, ref_sum = _reference_counts(reference, table.columns)
+    counts = table.values.astype(float)
+    # one row per subcorpus: its own size is the target sum
+    target_sum = counts.sum(axis=1)[:, None]
+    scores = _vector_keyness(keyness, counts, ref[None, :], target_sum, ref_sum)
+    applied = table.astype(float)
+    applied.iloc[:, :] = scores
     top = applied.abs().sum().sort_values(ascending=False)
     table = applied[top.index]
     return table
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark CQL sequence queries against equivalent depgrep queries
+
+usage: python scripts/bench_cql.py path/to/parsed/corpus [repeats]
+
+depgrep finds the first token of each match, CQL the whole span, so the
+number of CQL matches (spans) should equal the number of depgrep hits.
+"""
+
+import sys
+import time
+
+from buzz.corpus import Corpus
+
+QUERIES = [
+    ('[x="NOUN"]', "x/^NOUN$/"),
+    ('[l="the"%c]', "l/^the$/"),
+    ('[x="DET"] [x="NOUN"]', "x/^DET$/ + x/^NOUN$/"),
+    ('[x="ADJ"] [x="NOUN"]', "x/^ADJ$/ + x/^NOUN$/"),
+]
+
+
+def timed(func, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        taken = time.perf_counter() - start
+        best = taken if best is None else min(best, taken)
+    return best, result
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "tests/testing-parsed"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    data = Corpus(path).load()
+    print(f"{len(data)} tokens, best of {repeats}")
+    for cql, depgrep in QUERIES:
+        cql_time, cql_res = timed(lambda: data.cql(cql), repeats)
+        dep_time, dep_res = timed(lambda: data.depgrep(depgrep, case_sensitive=False), repeats)
+        spans = int((cql_res["_position"] == 0).sum()) if len(cql_res) else 0
+        for query, seconds, found in [(cql, cql_time, spans), (depgrep, dep_time, len(dep_res))]:
+            speed = len(data) / seconds
+            print(f"{query:<24} {seconds:8.3f}s {found:>8} matches  {speed:>12,.0f} tok/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark table construction: integer codes vs the old pivot_table route
+
+usage: python scripts/bench_table.py path/to/parsed/corpus [max_copies]
+
+The corpus is loaded once and repeated (with distinct file names) to make
+bigger and bigger datasets, so timings can be compared as size grows.
+"""
+
+import sys
+import time
+
+import pandas as pd
+
+from buzz.corpus import Corpus
+from buzz.dataset import Dataset
+from buzz.utils import _make_match_col
+
+SETTINGS = [
+    dict(show=["w"], subcorpora=["file"]),
+    dict(show=["l", "x"], subcorpora=["file"]),
+    dict(show=["w"], subcorpora=["file", "s"]),
+]
+
+
+def pivot_table(df, show, subcorpora):
+    """
+    How tables used to be made
+    """
+    df = df.copy()
+    df["_match"] = _make_match_col(df, show, preserve_case=False)
+    df["_count"] = 1
+    pivot = dict(index=subcorpora, columns="_match", values="_count", aggfunc=sum)
+    return df.pivot_table(**pivot).fillna(0).astype(int)
+
+
+def repeated(data, copies):
+    """
+    Stack copies of data, renaming files so they stay separate subcorpora
+    """
+    pieces = list()
+    for i in range(copies):
+        piece = data.reset_index()
+        piece["file"] = piece["file"].astype(str) + f"-{i}"
+        pieces.append(piece)
+    big = pd.concat(pieces, ignore_index=True)
+    big["file"] = big["file"].astype("category")
+    return Dataset(big.set_index(["file", "s", "i"]))
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "tests/testing-parsed"
+    max_copies = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    data = Corpus(path).load()
+    copies = 1
+    while copies <= max_copies:
+        big = repeated(data, copies)
+        for kwargs in SETTINGS:
+            codes = timed(lambda: big.table(sort=False, **kwargs))
+            pivot = timed(lambda: pivot_table(big, **kwargs))
+            name = f"show={kwargs['show']} subcorpora={kwargs['subcorpora']}"
+            print(f"{len(big):>10} tokens  {name:<40} codes {codes:8.3f}s  pivot {pivot:8.3f}s")
+        copies *= 10
+
+
+if __name__ == "__main__":
+    main()
@@ -220,6 +220,35 @@ class TestCorpus(unittest.TestCase):
         self.assertIsInstance(spac, list)
         self.assertTrue(all(isinstance(i, Doc) for i in spac))
 
+    def test_nlp_registry(self):
+        """
+        Each spaCy pipeline is loaded and built once per process
+        """
+        from buzz import utils
+
+        class Pipeline(object):
+            def __init__(self, disable):
+                self.pipe_names = [i for i in ["tagger", "parser", "ner"] if i not in disable]
+
+            def create_pipe(self, name):
+                return name
+
+            def add_pipe(self, pipe, before=None):
+                where = self.pipe_names.index(before) if before else len(self.pipe_names)
+                self.pipe_names.insert(where, pipe)
+
+        utils._NLP.clear()
+        with patch("spacy.load", side_effect=lambda name, disable: Pipeline(disable)) as load:
+            nlp = utils._get_nlp("en", sentencizer=True)
+            self.assertIs(utils._get_nlp("EN", sentencizer=True), nlp)
+            self.assertEqual(nlp.pipe_names, ["tagger", "sentencizer", "parser", "ner"])
+            self.assertEqual(load.call_count, 1)
+            fast = utils._get_nlp("en", sentencizer=True, disable=["parser", "ner"])
+            self.assertEqual(fast.pipe_names, ["tagger", "sentencizer"])
+            self.assertIsNot(utils._get_nlp("en"), nlp)
+            self.assertEqual(load.call_count, 3)
+        utils._NLP.clear()
+
     def test_dataset(self):
         d = Dataset(self.parsed.path)
         f = Dataset(self.parsed.files[0].path)
@@ -1,18 +1,34 @@
+import os
+import shutil
+import tempfile
 import unittest
 
+import numpy as np
+
 from buzz.corpus import Corpus
 
 
 class TestSearch(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        """ get_some_resource() is slow, to avoid calling it for each test use setUpClass()
-            and store the result as class variable
+        """get_some_resource() is slow, to avoid calling it for each test use setUpClass()
+        and store the result as class variable
         """
         super().setUpClass()
-        cls.parsed = Corpus("tests/testing-parsed")
+        # caches are written into the corpus' .buzz folder, so use a copy
+        cls.folder = tempfile.mkdtemp()
+        path = os.path.join(cls.folder, "testing-parsed")
+        shutil.copytree(
+            "tests/testing-parsed", path, ignore=shutil.ignore_patterns(".buzz")
+        )
+        cls.parsed = Corpus(path)
         cls.loaded = cls.parsed.load()
 
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+        super().tearDownClass()
+
     def test_non_loaded(self):
         # todo: find out why .equals isn't the same.
         res = self.parsed.depgrep("w/book/ = x/NOUN/")
@@ -38,6 +54,527 @@ class TestSearch(unittest.TestCase):
         self.assertFalse("punct" in big.columns)
         self.assertEqual(big.shape[1], 3)
 
+    def test_categorical_filter(self):
+        """
+        Matching once per category should give the same rows as matching every row
+        """
+        self.assertEqual(self.loaded["l"].dtype.name, "category")
+        plain = self.loaded.copy()
+        plain["l"] = plain["l"].astype(object)
+        queries = [
+            (["book"], dict()),
+            (["^B"], dict(case=False)),
+            (["Jungle"], dict(exact_match=True, regex=False)),
+            ([["book", "the"]], dict(exact_match=True)),
+            ([["oo", "ung"]], dict()),
+        ]
+        for args, kwargs in queries:
+            for getter in ["just", "skip"]:
+                cat = getattr(self.loaded, getter).lemma(*args, **kwargs)
+                obj = getattr(plain, getter).lemma(*args, **kwargs)
+                self.assertTrue(len(cat))
+                self.assertEqual(list(cat._n), list(obj._n))
+
+    def test_lazy(self):
+        """
+        Lazy plans give the same results as eager chains, for loaded and unloaded data
+        """
+        eager = self.loaded.just.wordclass.NOUN.skip.lemma.book.skip.lemma("^j")
+        plan = self.loaded.lazy.just.wordclass.NOUN.skip.lemma.book.skip.lemma("^j")
+        self.assertIn("fused filter", plan.explain())
+        self.assertEqual(list(plan.collect()._n), list(eager._n))
+        unloaded = self.parsed.lazy.just.wordclass.NOUN.skip.lemma.book.skip.lemma("^j")
+        self.assertEqual(len(unloaded), len(eager))
+        self.assertEqual(list(unloaded.collect()._n), list(eager._n))
+        tab = unloaded.see.x.by.l
+        self.assertEqual(
+            list(tab.sum().sort_index()), list(eager.see.x.by.l.sum().sort_index())
+        )
+        near = self.loaded.lazy.skip.wordclass.PUNCT.bigrams.lemma("jungle").collect()
+        self.assertEqual(
+            len(near), len(self.loaded.skip.wordclass.PUNCT.bigrams.lemma("jungle"))
+        )
+
+    def test_step_mask_missing(self):
+        """
+        A missing value (nan from str.contains) is not a match
+        """
+        from unittest.mock import patch
+
+        import pandas as pd
+
+        from buzz.query import Step
+
+        found = (pd.Series([True, np.nan, False], dtype=object), None)
+        with patch("buzz.query.Filter._make_bool_index", return_value=found):
+            mask = Step("l", "book").mask(self.loaded.iloc[:3])
+            self.assertEqual(list(mask), [True, False, False])
+            mask = Step("l", "book", inverse=True).mask(self.loaded.iloc[:3])
+            self.assertEqual(list(mask), [False, True, True])
+
+    def test_resultset(self):
+        """
+        Set algebra over ResultSets matches the equivalent filters
+        """
+        nouns = self.loaded.just.wordclass.NOUN.to_resultset()
+        books = self.loaded.just.lemma("book").to_resultset()
+        self.assertEqual(
+            len(nouns & books), len(self.loaded.just.wordclass.NOUN.just.lemma("book"))
+        )
+        self.assertEqual(len(nouns | books), len(set(nouns.ids) | set(books.ids)))
+        self.assertEqual(len(nouns - books), len(nouns) - len(nouns & books))
+        self.assertEqual(len(~nouns), len(self.loaded.skip.wordclass.NOUN))
+        self.assertTrue(nouns.ids[0] in nouns)
+        collected = (nouns & books).collect()
+        self.assertTrue((collected.x == "NOUN").all())
+        conc = books.conc(show=["w"])
+        self.assertEqual(len(conc), len(books))
+        no_deps = self.loaded.skip.depgrep("l/book/")
+        self.assertEqual(
+            len(no_deps), len(self.loaded) - len(self.loaded.depgrep("l/book/"))
+        )
+
+    def test_multiword(self):
+        """
+        Multiword matches expand to the following tokens, within the sentence
+        """
+        the = self.loaded.just.lemma("^the$", case=False)
+        res = self.loaded.just.lemma("^the$", case=False, multiword=3)
+        self.assertEqual((res["_position"] == 0).sum(), len(the))
+        self.assertTrue(res["_position"].max() <= 2)
+        for (f, s, i), pos in res["_position"].items():
+            if pos:
+                self.assertEqual(self.loaded.loc[(f, s, i - pos), "l"].lower(), "the")
+        # on a slice, _n no longer matches row number
+        no_punct = self.loaded.skip.x.PUNCT
+        the = no_punct.just.lemma("^the$", case=False)
+        res = no_punct.just.lemma("^the$", case=False, multiword=2)
+        self.assertEqual((res["_position"] == 0).sum(), len(the))
+        self.assertEqual(set(res.loc[res["_position"] == 1, "_n"]), set(the["_n"] + 1))
+        dep = self.loaded.depgrep("l/^the$/", multiword=2)
+        self.assertEqual(sorted(dep._position.unique()), [0, 1])
+        self.assertEqual(
+            (dep._position == 0).sum(), len(self.loaded.depgrep("l/^the$/"))
+        )
+
+    def test_collocates(self):
+        """
+        Collocate counts match a plain loop over the windows
+        """
+        colls = self.loaded.collocates("l/^the$/", span=(-2, 2), sentence_bound=False)
+        lemmas = self.loaded["l"].str.lower().values
+        counts = dict()
+        for i in self.loaded.depgrep("l/^the$/")._n:
+            for j in range(max(0, i - 2), min(len(lemmas), i + 3)):
+                if j != i:
+                    counts[lemmas[j]] = counts.get(lemmas[j], 0) + 1
+        self.assertEqual(dict(colls["count"]), counts)
+        self.assertTrue(colls["mi"].is_monotonic_decreasing)
+        for measure in ["t", "ll", "logdice"]:
+            res = self.loaded.collocates(
+                self.loaded.just.lemma("jungle"), measure=measure
+            )
+            self.assertEqual(res.columns[-1], measure)
+            self.assertTrue(len(res))
+        bound = self.loaded.collocates("l/^the$/", span=(-2, 2))
+        self.assertTrue(bound["count"].sum() <= colls["count"].sum())
+
+    def test_ngrams(self):
+        """
+        Suffix array n-gram counts match counting within each sentence by hand
+        """
+        bigrams = self.loaded.ngrams(2, show="w")
+        counts = dict()
+        for _, sent in self.loaded.groupby(["file", "s"], sort=False):
+            words = sent["w"].str.lower().tolist()
+            for gram in zip(words, words[1:]):
+                counts[" ".join(gram)] = counts.get(" ".join(gram), 0) + 1
+        self.assertEqual(dict(bigrams), counts)
+        self.assertTrue(bigrams.is_monotonic_decreasing)
+        index = self.loaded.ngram_index()
+        self.assertEqual(
+            index.count("the jungle book"),
+            self.loaded.ngrams(3, show="w")["the jungle book"],
+        )
+        self.assertEqual(index.count("not a real phrase"), 0)
+        res = self.loaded.phrase("the jungle book")
+        self.assertEqual((res._position == 0).sum(), index.count("the jungle book"))
+        self.assertEqual(
+            res[res._position == 2].w.str.lower().unique().tolist(), ["book"]
+        )
+        cached = self.parsed.ngram_index()
+        self.assertEqual(
+            self.parsed.ngram_index().count("the jungle"), cached.count("the jungle")
+        )
+        self.assertEqual(cached.count("the jungle"), index.count("the jungle"))
+
+    def test_cache_file_set(self):
+        """
+        Cached indexes and frequency lists notice removed and older added files
+        """
+        folder = os.path.join(tempfile.mkdtemp(), "copy-parsed")
+        shutil.copytree(
+            "tests/testing-parsed", folder, ignore=shutil.ignore_patterns(".buzz")
+        )
+        try:
+            removed = os.path.join(folder, "first", "one.txt.conllu")
+            before = Corpus(folder)
+            index, freqs = before.ngram_index(), before.frequency_list()
+            os.remove(removed)
+            after = Corpus(folder)
+            smaller = Corpus(folder).load()
+            self.assertEqual(
+                after.ngram_index().count("the"), (smaller.w.str.lower() == "the").sum()
+            )
+            self.assertEqual(after.frequency_list().total, len(smaller))
+            # only the caches for the current files are kept
+            caches = sorted(
+                i.split("-")[0] for i in os.listdir(os.path.join(folder, ".buzz"))
+            )
+            self.assertEqual(caches, ["freqs", "ngrams"])
+            # put it back with an old modification time: still not the cached data
+            shutil.copy("tests/testing-parsed/first/one.txt.conllu", removed)
+            os.utime(removed, (0, 0))
+            self.assertEqual(Corpus(folder).frequency_list().total, freqs.total)
+            self.assertEqual(
+                Corpus(folder).ngram_index().count("the"), index.count("the")
+            )
+        finally:
+            shutil.rmtree(os.path.dirname(folder))
+
+    def test_cql(self):
+        """
+        CQL spans agree with depgrep, and conc shows the whole span
+        """
+        res = self.loaded.cql('[x="DET"] [x="NOUN"]')
+        dep = self.loaded.depgrep("x/^DET$/ + x/^NOUN$/")
+        self.assertEqual((res._position == 0).sum(), len(dep))
+        self.assertEqual(len(res), 2 * len(dep))
+        spans = self.loaded.cql('"the"%c [x="ADJ"]{0,2} [x="NOUN"]')
+        self.assertTrue(spans._position.max() >= 2)
+        conc = spans.conc(show=["w"])
+        self.assertEqual(len(conc), (spans._position == 0).sum())
+        self.assertIn("the english author", conc.match.str.lower().tolist())
+        firsts = self.loaded.cql("<s> []")
+        self.assertEqual(len(firsts), len(self.loaded.groupby(["file", "s"])))
+        self.assertTrue((self.loaded.cql('[x="PUNCT"] </s>').x == "PUNCT").all())
+        self.assertEqual(len(self.parsed.cql('[x="DET"] [x="NOUN"]')), len(res))
+        with self.assertRaises(ValueError):
+            self.loaded.cql('[x="DET"')
+        # %l is literal, %d ignores diacritics
+        data = self.loaded.copy()
+        data["w"] = data["w"].cat.rename_categories(
+            lambda w: "café" if w == "book" else w
+        )
+        books = (data["w"] == "café").sum()
+        self.assertEqual(len(data.cql('"cafe"%d')), books)
+        self.assertEqual(len(data.cql('"caf."%d')), books)
+        self.assertEqual(len(data.cql('"caf."%l')), 0)
+        self.assertEqual(len(data.cql('"cafe"')), 0)
+        with self.assertRaisesRegex(ValueError, "%z"):
+            data.cql('"cafe"%z')
+
+    def test_conc_context(self):
+        """
+        Contexts cut from the character buffer match joining the words
+        """
+        books = self.loaded.just.lemma("book")
+        conc = books.conc(show=["w"], window=(20, 25))
+        words = self.loaded["w"].values
+        for n, left, right in zip(books._n, conc.left, conc.right):
+            self.assertEqual(left, " ".join(words[max(n - 20, 0) : n])[-20:])
+            self.assertEqual(
+                right, " ".join(words[n + 1 : min(n + 25, len(words) - 1)])[:25]
+            )
+        bound = books.conc(show=["w"], window=(200, 200), sentence_bound=True)
+        for (f, s, _), left, right in zip(books.index, bound.left, bound.right):
+            sent = " ".join(self.loaded.loc[(f, s)]["w"])
+            self.assertIn(left, sent)
+            self.assertIn(right, sent)
+        # a new w column of the same length rebuilds the buffer
+        edited = self.loaded.copy()
+        for words in [
+            edited["w"].cat.add_categories("XYZ"),
+            edited["w"].astype(object),
+        ]:
+            edited["w"] = words
+            edited.reference = edited
+            books = edited.just.lemma("book")
+            books.conc(show=["w"], window=(20, 25))
+            words = words.copy()
+            words.iloc[books._n.values[0] - 1] = "XYZ"
+            edited["w"] = words
+            self.assertTrue(
+                books.conc(show=["w"], window=(20, 25)).left.iloc[0].endswith("XYZ")
+            )
+
+    def test_lazy_conc(self):
+        """
+        Lazy concordance pages match the eager concordance, and sort by codes
+        """
+        the = self.loaded.just.lemma("the")
+        eager = the.conc(show=["w"], window=30)
+        lazy = the.conc(show=["w"], window=30, lazy=True)
+        self.assertEqual(len(lazy), len(eager))
+        self.assertTrue(lazy.page(1, size=10).equals(eager.iloc[10:20]))
+        self.assertTrue(lazy[3].equals(eager.iloc[[3]]))
+        self.assertTrue(lazy.collect().equals(eager))
+        by_right = lazy.sort("R1").collect()
+        words = self.loaded["w"].values
+        firsts = [words[n + 1] for n in the._n.values[by_right.index]]
+        self.assertEqual(firsts, sorted(firsts))
+        by_left = lazy.sort(["L1", "R1"], ascending=False).collect()
+        befores = [words[n - 1] if n else "" for n in the._n.values[by_left.index]]
+        self.assertEqual(befores, sorted(befores, reverse=True))
+
+    def test_tfidf(self):
+        """
+        One tf-idf matrix for all bins matches scikit-learn over the same sentences
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self.loaded.tfidf_by("file", show=["l", "x"])
+        model = self.loaded._tfidf[("file", ("l", "x"))]
+        self.assertEqual(list(model.bins), sorted(self.loaded.index.levels[0]))
+        formatted = (
+            self.loaded.l.astype(str) + "/" + self.loaded.x.astype(str)
+        ).str.lower()
+        sents = [list(sent) for _, sent in formatted.groupby(level=["file", "s"])]
+        vec = TfidfVectorizer(analyzer=list).fit(sents)
+        expected = vec.transform(sents)[:, [vec.vocabulary_[t] for t in model.vocab]]
+        self.assertTrue(abs(expected - model.matrix).max() < 1e-12)
+        # scoring against a bin is the mean similarity to its sentences
+        sent = self.loaded.loc[["first/one"]].iloc[:20]
+        scores = self.loaded.tfidf_score("file", ["l", "x"], sent)
+        rows = model.rows("second/second")
+        by_hand = (model.transform_dataset(sent) @ rows.T).toarray().mean()
+        self.assertAlmostEqual(scores["second/second"], by_hand)
+        words = self.loaded.tfidf_score("file", ["w"], "The jungle book is a book.")
+        self.assertEqual(len(words), 4)
+
+    def test_prototypical(self):
+        """
+        Batched scoring matches scoring each sentence on its own, in any chunk size
+        """
+        proto = self.loaded.prototypical("file", ["l", "x"], chunk_size=3)
+        self.assertEqual(len(proto), len(self.loaded.groupby(["file", "s"])))
+        files, sents = self.loaded.index.get_level_values(
+            0
+        ), self.loaded.index.get_level_values(1)
+        for (f, s, _, _, actual), score in proto.iloc[::4].items():
+            sent = self.loaded[(files == f) & (sents == s)]
+            self.assertAlmostEqual(
+                score, self.loaded.tfidf_score("file", ["l", "x"], sent)[actual]
+            )
+        every = self.loaded.prototypical("file", ["l", "x"], only_correct=False)
+        self.assertEqual(len(every), len(proto) * 4)
+        best = self.loaded.proto.file(show=["l", "x"], top=2)
+        self.assertEqual(list(best.index.names)[:3], ["file", "file", "s"])
+        for binn, scores in best.groupby(level=0):
+            expected = proto.xs(binn, level=-1).sort_values(ascending=False).head(2)
+            self.assertEqual(list(scores), list(expected))
+
+    def test_model_store(self):
+        """
+        Stored models reload memory-mapped and score exactly as freshly fitted ones
+        """
+        from buzz.store import ModelStore
+
+        with tempfile.TemporaryDirectory() as folder:
+            store = ModelStore(folder)
+            data = self.loaded.copy()
+            data.tfidf_by("file", show=["w"], store=store)
+            fitted = data._tfidf[("file", ("w",))]
+            self.assertEqual(len(store.models()), 1)
+            again = self.loaded.copy()
+            again.tfidf_by("file", show=["w"], store=store)
+            loaded = again._tfidf[("file", ("w",))]
+            self.assertEqual(len(store.models()), 1)
+            self.assertEqual(list(loaded.bins), list(fitted.bins))
+            self.assertTrue(abs(loaded.matrix - fitted.matrix).max() < 1e-12)
+            worker = store.latest("file", show=["w"])
+            text = "The Jungle Book is a book about the jungle."
+            self.assertTrue((worker.score(worker.transform_text(text)) > 0).all())
+            # slices have their own data, so their own models
+            part = data.just.file("second")
+            part.tfidf_by("file", show=["w"], store=store)
+            self.assertEqual(len(part._tfidf[("file", ("w",))].bins), 2)
+            self.assertEqual(len(data._tfidf[("file", ("w",))].bins), 4)
+            self.assertEqual(len(store.models()), 2)
+
+    def test_most_similar(self):
+        """
+        Blocked search finds the same neighbours as comparing every tf-idf row
+        """
+        index = self.loaded.sentence_index(dims=1000)
+        model = self.loaded._tfidf[(None, ("w",))]
+        rows = model.transform_dataset(self.loaded).toarray()
+        query = ("first/one", 2)
+        scores = rows @ rows[index.keys.get_loc(query)]
+        expected = [
+            index.keys[i]
+            for i in np.argsort(-scores, kind="mergesort")
+            if index.keys[i] != query
+        ][:5]
+        found = self.loaded.most_similar(query, k=5, dims=1000)
+        self.assertEqual(list(found.index), expected)
+        self.assertTrue(found.similarity.is_monotonic_decreasing)
+        text = self.loaded.most_similar("the jungle book", k=3)
+        self.assertIn("Jungle Book", text.text.iloc[0])
+        approx = self.loaded.most_similar("the jungle book", k=3, approximate=True)
+        self.assertTrue(
+            set(approx.index)
+            <= set(self.loaded.most_similar("the jungle book", k=13).index)
+        )
+        small = self.loaded.sentence_index(dims=16)
+        self.assertEqual(small.vectors.shape, (len(index), 16))
+        self.assertEqual(small.vectors.dtype, np.float32)
+
+    def test_document_vector(self):
+        """
+        Streamed, token-weighted vectors equal the vector of all the text at once
+        """
+        import glob
+        from unittest.mock import patch
+
+        class Doc(list):
+            @property
+            def vector(self):
+                return np.mean([[len(t), t.count("e")] for t in self], axis=0)
+
+        class Pipeline(object):
+            pipe_names = ["tagger", "parser", "ner"]
+            batches = 0
+
+            def pipe(self, texts, batch_size=1000, disable=[]):
+                Pipeline.batches += 1
+                return (Doc(text.split()) for text in texts)
+
+        for path in glob.glob(f"{self.parsed.path}/.buzz/**/vector-*", recursive=True):
+            os.remove(path)
+        with patch("buzz.similarity._get_nlp", return_value=Pipeline()):
+            data = self.loaded.copy()
+            expected = Doc(" ".join(data.sentences()["text"]).split()).vector
+            self.assertTrue(np.allclose(data.vector, expected))
+            self.assertTrue(np.allclose(self.parsed.vector, expected))
+            # one pass per file, then everything comes from the cache
+            self.assertEqual(Pipeline.batches, 1 + len(self.parsed.files))
+            self.assertTrue(np.allclose(self.parsed.document_vector(), expected))
+            self.assertEqual(Pipeline.batches, 1 + len(self.parsed.files))
+
+    def test_topology(self):
+        """
+        One pass per query gives the same counts as depgrep for each lemma
+        """
+        from buzz.constants import TOPOLOGY_QUERIES
+        from buzz.topology import _parse_query, _process_chunk
+
+        self.assertIsNone(_parse_query("F/nsubj/ <- {query} <- {query}"))
+        words = ["move", "note", "echo", "know"]
+        top = self.loaded.topology(kind="verb", wordlist=words, min_occur=1)
+        self.assertEqual(set(top.columns), set(words))
+        queries = dict(TOPOLOGY_QUERIES["VERB"], **TOPOLOGY_QUERIES["GENERAL"])
+        counts = self.loaded.just.wordclass.VERB.l.value_counts()
+        expected = dict()
+        for word in words:
+            expected[word] = dict()
+            for name, query in queries.items():
+                self.assertIsNotNone(_parse_query(query[0]))
+                result = _process_chunk(self.loaded, word, name, *query, counts)
+                if result:
+                    expected[word].update(result[1])
+        for word, features in expected.items():
+            for feature, value in features.items():
+                self.assertAlmostEqual(top.loc[feature, word], value)
+            self.assertEqual(top[word].astype(bool).sum(), len(features))
+
+    def test_topology_pairwise(self):
+        """
+        Blocked float32 similarities agree with scipy's pairwise distances
+        """
+        from scipy.spatial.distance import cdist
+
+        top = self.loaded.topology(kind="verb", min_occur=1)
+        vectors = top.values.T
+        expected = dict(
+            cosine=1 - cdist(vectors, vectors, "cosine"),
+            euclidean=cdist(vectors, vectors),
+            jaccard=1 - cdist(vectors != 0, vectors != 0, "jaccard"),
+        )
+        for metric, scores in expected.items():
+            pairwise = top.pairwise(metric=metric, block_size=5)
+            self.assertEqual(pairwise.values.dtype, np.float32)
+            self.assertTrue(np.allclose(pairwise.values, scores, atol=1e-5))
+        nearest = top.nearest("move", k=3)
+        self.assertEqual(len(nearest), 3)
+        self.assertNotIn("move", nearest.index)
+        self.assertTrue(
+            np.allclose(nearest.values, top.pairwise().loc["move", nearest.index])
+        )
+        self.assertTrue(nearest.is_monotonic_decreasing)
+        clusters = top.clusters(n_clusters=3)
+        self.assertEqual(list(clusters.index), list(top.columns))
+        self.assertLessEqual(clusters.nunique(), 3)
+        with self.assertRaises(ValueError):
+            top.pairwise(metric="manhattan")
+
+    def test_formality(self):
+        """
+        Scoring the vocabulary once gives the same scores as scoring each token
+        """
+        from buzz.formality import FormalityScorer
+
+        scorer = FormalityScorer()
+        scorer.override = {("book", "NOUN"): 0.5}
+        scorer.academic = {"theme", "story"}
+        scores = scorer.sentences(self.loaded.copy())
+        lemmas, xpos = self.loaded["l"].astype(str), self.loaded["x"].astype(str)
+        expected = [scorer.token(lemma, pos) for lemma, pos in zip(lemmas, xpos)]
+        self.assertTrue(np.allclose(scores["_formality"], expected))
+        self.assertTrue(
+            (scores.loc[self.loaded["l"] == "book", "_formality"] == 0.5).all()
+        )
+        first = scores.loc[self.loaded.index[0][:2], "_formality"]
+        length = scorer._formality_by_sent_length(len(first))
+        sent_score = ((length / 2) + (first.mean() * 2)) / 2
+        self.assertTrue(np.allclose(scores["_sent_formality"].iloc[0], sent_score))
+
+    def test_shared_dataset(self):
+        """
+        Workers rebuild the same Dataset from shared arrays, which are then deleted
+        """
+        import pandas as pd
+
+        from unittest.mock import patch
+
+        from buzz import multi
+
+        # with and without the pandas internals that avoid consolidation
+        for blocks in {multi.BlockManager, None}:
+            with patch("buzz.multi.BlockManager", blocks), multi.SharedDataset(
+                self.loaded
+            ) as shared:
+                attached = shared.attach()
+                folder = shared.folder
+                # the worker's columns and index codes are the shared memory maps
+                for name, kind, path, _ in shared.columns:
+                    if kind == "array" and blocks is None:
+                        continue
+                    values = attached[name].values
+                    values = values.codes if kind == "category" else values
+                    self.assertTrue(np.shares_memory(values, shared._mapped[path]))
+                for codes, (_, path) in zip(attached.index.codes, shared.levels):
+                    self.assertTrue(np.shares_memory(codes, shared._mapped[path]))
+            self.assertFalse(os.path.exists(folder))
+            # object columns come back as categoricals
+            same = pd.DataFrame(attached).astype(object)
+            pd.testing.assert_frame_equal(
+                same, pd.DataFrame(self.loaded).astype(object)
+            )
+        one = self.loaded.describe('l"book"', queryset="NOUN", multiprocess=1)
+        many = self.loaded.describe('l"book"', queryset="NOUN", multiprocess=2)
+        self.assertTrue(one.index.equals(many.index))
+
     def test_depgrep(self):
         res = self.loaded.depgrep("L/book/")
         self.assertEqual(len(res), 3)
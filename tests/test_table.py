@@ -1,8 +1,22 @@
+import os
+import shutil
+import tempfile
 import unittest
 from unittest.mock import patch
 
+import numpy as np
+import pandas as pd
+
 from buzz.corpus import Corpus
-from buzz.table import Table
+from buzz.freqlist import FrequencyList
+from buzz.table import SparseTable, Table
+from buzz.views import (
+    _bayes_factor_bic,
+    _effect_size_for_ll,
+    _log_likelihood,
+    _perc_diff,
+    _relrisk,
+)
 
 TOTAL_TOKENS = 329
 
@@ -34,6 +48,112 @@ class TestTable(unittest.TestCase):
         self.assertEqual(relative.index.name, absolute.index.name)
         self.assertEqual(relative.columns.name, absolute.columns.name)
 
+    def test_codes_match_pivot(self):
+        for show, subcorpora in [
+            (["w"], ["file"]),
+            (["l", "x"], ["file", "s"]),
+            (["x"], ["speaker"]),
+        ]:
+            data = LOADED.copy()
+            data["_match"] = data[show[0]].astype(str).str.lower()
+            if len(show) > 1:
+                others = [data[i].astype(str) for i in show[1:]]
+                data["_match"] = (
+                    data["_match"].str.cat(others=others, sep="/").str.lower()
+                )
+            data["_count"] = 1
+            pivot = data.pivot_table(
+                index=subcorpora, columns="_match", values="_count", aggfunc=sum
+            )
+            pivot = pivot.fillna(0).astype(int)
+            tab = LOADED.table(show=show, subcorpora=subcorpora, sort=False)
+            # pandas versions differ on keeping matches seen only outside every subcorpus
+            tab = tab.loc[:, tab.sum() > 0]
+            pivot = pivot.loc[:, pivot.sum() > 0]
+            self.assertEqual(list(tab.columns), list(pivot.columns))
+            self.assertEqual(list(tab.index), list(pivot.index))
+            self.assertTrue((tab.values == pivot.values).all())
+
+    def test_sparse(self):
+        dense = LOADED.table(subcorpora=["file", "s"])
+        sparse = LOADED.table(subcorpora=["file", "s"], sparse=True)
+        self.assertIsInstance(sparse, SparseTable)
+        self.assertEqual(sparse.shape, dense.shape)
+        self.assertEqual(sparse.columns.name, "w")
+        same = sparse.to_dense().reindex(index=dense.index, columns=dense.columns)
+        self.assertTrue((same.values == dense.values).all())
+        self.assertEqual(list(sparse.sum()), sorted(sparse.sum(), reverse=True))
+        self.assertEqual(list(sparse.top(5).columns), list(sparse.columns[:5]))
+        self.assertEqual(sparse.square(3).shape, (3, 3))
+        rel = sparse.relative().to_dense()
+        self.assertTrue(((rel.sum(axis=1) - 100).abs() < 1e-9).all())
+        slopes = LOADED.table(sparse=True, sort="increase")
+        self.assertEqual(slopes.columns[0], LOADED.table(sort="increase").columns[0])
+        keys = LOADED.table(keyness="ll", sparse=True).to_dense()
+        dense_keys = LOADED.table(keyness="ll")
+        present = (
+            LOADED.table().reindex(index=dense_keys.index, columns=dense_keys.columns)
+            > 0
+        )
+        keys = keys.reindex(index=dense_keys.index, columns=dense_keys.columns).fillna(
+            0
+        )
+        self.assertTrue(
+            ((keys - dense_keys.where(present, 0)).abs() < 1e-6).all().all()
+        )
+        # words absent from a subcorpus keep no (negative) score
+        self.assertTrue((dense_keys.where(~present, 0) < 0).any().any())
+        self.assertTrue((keys.where(~present, 0) == 0).all().all())
+        kwargs = dict(subcorpora="s", sort="increase", remove_above_p=0.5)
+        dense = LOADED.table(**kwargs)
+        self.assertEqual(
+            set(LOADED.table(sparse=True, **kwargs).columns), set(dense.columns)
+        )
+        split = LOADED.table(show=["w", "x"], multiindex_columns=True, sparse=True)
+        self.assertEqual(list(split.columns.names), ["w", "x"])
+        with self.assertRaisesRegex(ValueError, "keep_stats"):
+            LOADED.table(sparse=True, keep_stats=True)
+        with self.assertRaisesRegex(ValueError, "remove_above_p"):
+            LOADED.table(keyness="ll", remove_above_p=True, sparse=True)
+
+    def test_sparse_categorical(self):
+        data = LOADED.copy()
+        # an unused category still gets its own (empty) row
+        speakers = ["nobody"] + list(data["speaker"].cat.categories)
+        data["speaker"] = data["speaker"].cat.set_categories(speakers)
+        for show in [["w"], ["l", "x"]]:
+            dense = data.table(show=show, subcorpora="speaker", sort=False)
+            sparse = data.table(
+                show=show, subcorpora="speaker", sort=False, sparse=True
+            )
+            self.assertEqual(list(sparse.index), list(dense.index))
+            self.assertEqual(list(sparse.columns), list(dense.columns))
+            self.assertTrue((sparse.to_dense().values == dense.values).all())
+
+    def test_streaming(self):
+        corpus = Corpus("tests/testing-parsed")
+        settings = [
+            dict(show=["l"], subcorpora=["file"]),
+            dict(show=["x", "l"], subcorpora=["file"], relative=True),
+            dict(show=["l"], subcorpora=["file"], min_occur=3),
+            dict(show=["w"], subcorpora=["file"], keyness="ll"),
+        ]
+        for kwargs in settings:
+            loaded = LOADED.table(**kwargs)
+            streamed = corpus.table(streaming=True, multiprocess=2, **kwargs)
+            self.assertEqual(set(streamed.columns), set(loaded.columns))
+            streamed = streamed.loc[loaded.index, loaded.columns]
+            self.assertTrue(((streamed - loaded).abs() < 1e-9).all().all())
+        totals = corpus.table(show="l", subcorpora=False, streaming=True)
+        self.assertEqual(totals.sum(axis=1).iloc[0], len(LOADED))
+        sparse = corpus.table(show="l", streaming=True, sparse=True, relative=True)
+        self.assertIsInstance(sparse, SparseTable)
+        loaded = LOADED.table(show="l", relative=True)
+        same = sparse.to_dense().reindex(index=loaded.index, columns=loaded.columns)
+        self.assertTrue(((same - loaded).abs() < 1e-9).all().all())
+        with self.assertRaisesRegex(ValueError, "show_entities, top"):
+            corpus.table(streaming=True, show_entities=True, top=5)
+
     def test_show(self):
         word_pos = LOADED.table(show=["w", "p"])
         self.assertTrue(all("/" in i for i in word_pos.columns))
@@ -63,6 +183,87 @@ class TestTable(unittest.TestCase):
         # since many values are equally turbulent...
         self.assertEqual(word_pos.columns[0], "file/nn")
 
+    def test_vector_keyness(self):
+        """
+        Whole-table keyness matches the scalar measures, cell by cell
+        """
+        scalar = dict(
+            ll=_log_likelihood,
+            pd=_perc_diff,
+            bf=_bayes_factor_bic,
+            el=_effect_size_for_ll,
+            rr=_relrisk,
+            ll_default=_log_likelihood,
+        )
+        counts = LOADED.table(show=["w"])
+        ref = LOADED["w"].str.lower().value_counts()
+        for measure, func in scalar.items():
+            keys = LOADED.table(show=["w"], keyness=measure)
+            for subcorpus, row in counts.iterrows():
+                for word, count in row.iloc[:40].items():
+                    data = np.array([count, ref[word]], dtype=float)
+                    expected = func(data, row.sum(), len(LOADED))
+                    self.assertAlmostEqual(
+                        keys.loc[subcorpus, word], expected, places=9
+                    )
+        sparse = LOADED.table(show=["w"], keyness="rr", sparse=True).to_dense()
+        dense = LOADED.table(show=["w"], keyness="rr")
+        present = counts.reindex(index=dense.index, columns=dense.columns) > 0
+        sparse = sparse.reindex(index=dense.index, columns=dense.columns).fillna(0)
+        self.assertTrue(((sparse - dense.where(present, 0)).abs() < 1e-9).all().all())
+
+    def test_frequency_list(self):
+        """
+        Keyness against a stored frequency list matches keyness against the data
+        """
+        # the list is cached in the corpus' .buzz folder, so use a copy
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, "testing-parsed")
+        shutil.copytree(
+            "tests/testing-parsed", path, ignore=shutil.ignore_patterns(".buzz")
+        )
+        self.addCleanup(shutil.rmtree, folder)
+        corpus = Corpus(path)
+        nouns = LOADED.just.wordclass.NOUN
+        freqs = corpus.frequency_list(show=["l", "x"])
+        self.assertEqual(freqs.total, len(LOADED))
+        self.assertEqual(
+            dict(freqs.counts), dict(LOADED.frequency_list(show="l/x").counts)
+        )
+        self.assertEqual(len(corpus.frequency_list(show=["l", "x"])), len(freqs))
+        dense = nouns.table(show=["l", "x"], keyness="ll", reference=LOADED)
+        stored = nouns.table(show=["l", "x"], keyness="ll", reference=freqs)
+        self.assertTrue(
+            ((stored.loc[dense.index, dense.columns] - dense).abs() < 1e-9).all().all()
+        )
+        sparse = nouns.table(
+            show=["l", "x"], keyness="ll", reference=freqs, sparse=True
+        )
+        self.assertEqual(sparse.shape, dense.shape)
+        streamed = corpus.table(
+            show=["l", "x"], keyness="ll", reference=freqs, streaming=True
+        )
+        self.assertEqual(
+            streamed.shape, LOADED.table(show=["l", "x"], keyness="ll").shape
+        )
+        with self.assertRaises(ValueError):
+            nouns.table(show=["w"], keyness="ll", reference=freqs)
+        # next words come from the corpus, not from the next matching noun
+        full = LOADED.copy()
+        full["+1w"] = full["w"].shift(-1)
+        nexts = FrequencyList.from_dataset(full, show="+1w")
+        stored = LOADED.just.wordclass.NOUN.table(
+            show=["+1w"], keyness="ll", reference=nexts
+        )
+        dense = LOADED.just.wordclass.NOUN.table(
+            show=["+1w"], keyness="ll", reference=full
+        )
+        self.assertEqual(set(stored.columns), set(dense.columns))
+        # the caller's counts keep their own index name
+        counts = pd.Series([2, 1], index=pd.Index(["a", "b"], name="mine"))
+        self.assertEqual(FrequencyList(counts, show="w").counts.index.name, "w")
+        self.assertEqual(counts.index.name, "mine")
+
     def test_no_ref_keyness(self):
         """
         This should make a reference corpus from the corpus itself!
@@ -111,6 +312,30 @@ class TestTable(unittest.TestCase):
         # check that all values are below the p threshold
         self.assertTrue((sig.loc["p"] <= 0.05).all(), sig.loc["p"])
 
+    def test_trend_stats(self):
+        """
+        Closed-form stats for every column match scipy's linregress
+        """
+        from scipy.stats import linregress
+
+        tab = LOADED.table(subcorpora=["file", "s"])
+        stats = tab.stats()
+        self.assertEqual(
+            list(stats.columns), ["slope", "intercept", "r", "p", "stderr"]
+        )
+        for word in tab.columns[:50]:
+            expected = linregress(np.arange(len(tab)), tab[word].values)
+            self.assertTrue(np.allclose(stats.loc[word].values, expected, atol=1e-9))
+        sparse = LOADED.table(subcorpora=["file", "s"], sparse=True)
+        self.assertTrue(
+            np.allclose(sparse.stats().loc[tab.columns].values, stats.values, atol=1e-6)
+        )
+        sig = sparse.sort("increase", remove_above_p=0.05)
+        self.assertTrue((stats.loc[sig.columns, "p"] <= 0.05).all())
+        self.assertEqual(
+            set(sig.columns), set(tab.sort("increase", remove_above_p=0.05).columns)
+        )
+
     def test_tabview(self):
         with patch("buzz.tabview.view", side_effect=ValueError("Boom!")):
             tab = LOADED.table()